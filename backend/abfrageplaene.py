@@ -0,0 +1,198 @@
+# abfrageplaene.py
+"""Abfrageplan-Regressionen fuer die heissen Pfade (Funktionen & Endpunkte).
+
+    python abfrageplaene.py        # Exit-Code 1 bei Verstoessen (fuer CI)
+
+Schneidet das von jeder Pruefung erzeugte SQL mit, laesst dafuer ``EXPLAIN QUERY PLAN``
+(SQLite) bzw. ``EXPLAIN`` mit ``enable_seqscan = off`` (Postgres) laufen und prueft:
+
+* kein Full-Scan ohne Index auf den wachsenden Tabellen (GROSSE_TABELLEN),
+* die erwarteten Indizes tauchen im Plan auf,
+* die Zahl der Statements je Aufruf bleibt unter der Obergrenze (kein N+1).
+
+Ohne FLOTTE_DB_URL laeuft alles gegen eine temporaere SQLite-Datei mit kleinem Testbestand.
+"""
+from __future__ import annotations
+
+import os
+import re
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Callable, List, Tuple
+
+if "FLOTTE_DB_URL" not in os.environ:
+    os.environ["FLOTTE_DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "abfrageplaene.db")
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+import flotte_v3_de as f
+
+GROSSE_TABELLEN = {"vermietung", "vermietung_position", "rechnung", "zaehlerstand", "aenderung_ereignis",
+                   "geraet_historie"}
+
+# -------------------- Mitschnitt & Plaene --------------------
+
+class SqlMitschnitt:
+    """Sammelt alle Statements, die waehrend des with-Blocks ueber ``engine`` laufen."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.statements: List[Tuple[str, object]] = []
+
+    def _mitschneiden(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self) -> "SqlMitschnitt":
+        event.listen(self.engine, "before_cursor_execute", self._mitschneiden)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._mitschneiden)
+
+def abfrageplan(engine: Engine, statement: str, parameters) -> List[str]:
+    with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            return [r[3] for r in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+        conn.exec_driver_sql("SET enable_seqscan = off")   # Seq Scan trotzdem -> kein nutzbarer Index
+        return [r[0] for r in conn.exec_driver_sql("EXPLAIN " + statement, parameters)]
+
+_SCAN = [re.compile(r"^\s*SCAN (\w+)\s*$"), re.compile(r"Seq Scan on (\w+)")]
+
+def full_scans(plan: List[str]) -> List[str]:
+    return [m.group(1) for zeile in plan for rx in _SCAN for m in [rx.search(zeile)] if m]
+
+# -------------------- Pruefungen --------------------
+
+@dataclass
+class Pruefung:
+    name: str
+    ausfuehren: Callable[[], object]
+    max_statements: int
+    indizes: Tuple[str, ...] = ()
+    erlaubte_scans: Tuple[str, ...] = ()
+
+@dataclass
+class Ergebnis:
+    pruefung: Pruefung
+    statements: int = 0
+    scans: List[str] = field(default_factory=list)
+    fehlende_indizes: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.scans and not self.fehlende_indizes and self.statements <= self.pruefung.max_statements
+
+def pruefen(p: Pruefung, engine: Engine) -> Ergebnis:
+    with SqlMitschnitt(engine) as m:
+        p.ausfuehren()
+    e = Ergebnis(p, statements=len(m.statements))
+    plaene: List[str] = []
+    for statement, parameters in m.statements:
+        if not statement.lstrip().upper().startswith("SELECT"):
+            continue
+        plan = abfrageplan(engine, statement, parameters)
+        plaene += plan
+        kopf = statement.split("\n")[0][:90]
+        e.scans += [f"{t}: {kopf}" for t in full_scans(plan) if t in GROSSE_TABELLEN and t not in p.erlaubte_scans]
+    e.fehlende_indizes = [ix for ix in p.indizes if not any(ix in zeile for zeile in plaene)]
+    return e
+
+def _testbestand() -> dict:
+    """Kleiner, aber realistisch verteilter Bestand (viele GESCHLOSSEN, wenige je Geraet) + ANALYZE,
+    damit der Planer wie in Produktion zwischen selektiven und unselektiven Indizes waehlt."""
+    f.init_db()
+    with f.SessionLocal() as s:
+        mp = f.mietpark_anlegen(s, "Mietpark Plan")
+        ks = [f.kunde_anlegen(s, f"Plan Kunde {i}").id for i in range(10)]
+        gs = [f.geraet_anlegen(s, f"Plan {i}", "test", heim_mietpark_id=mp.id).id for i in range(20)]
+        for monat in range(1, 11):
+            for i, g in enumerate(gs):
+                v = f.vermietung_anlegen(s, g, ks[i % len(ks)], date(2024, monat, 1), None, 100.0)
+                f.vermietung_schliessen(s, v.id, date(2024, monat, 20), stunden_ist=80.0)
+                f.position_hinzufuegen(s, v.id, f.PosTyp.MONTAGE, 1, 200.0, 50.0)
+                f.rechnung_hinzufuegen(s, v.id, f"PLAN-{v.id}", datum=date(2024, monat, 21), betrag_netto=2100.0,
+                                       bezahlt=monat < 9)
+        v = f.vermietung_anlegen(s, gs[0], ks[0], date(2025, 1, 1), None, 100.0)
+        f.vermietung_anlegen(s, gs[1], ks[0], date(2025, 3, 1), date(2025, 3, 31), 90.0, status=f.VermietStatus.RESERVIERT)
+        s.execute(text("ANALYZE")); s.commit()
+    from api_v3_de import app
+    from fastapi.testclient import TestClient
+    with TestClient(app) as c:   # Cursor einer tiefen Seite (ab Mitte), wie ihn ein Client weiterreicht
+        cursor = c.get("/vermietungen?limit=100").headers["X-Next-Cursor"]
+        geraet_cursor = c.get("/geraete?limit=5").headers["X-Next-Cursor"]
+    return {"geraet": gs[0], "kunde": ks[0], "vermietung": v.id, "cursor": cursor, "geraet_cursor": geraet_cursor}
+
+def pruefungen(ids: dict) -> List[Pruefung]:
+    from fastapi.testclient import TestClient
+    import api_v3_de
+    c = TestClient(api_v3_de.app)
+
+    def get(url: str, status: int = 200):
+        def _get():
+            r = c.get(url)
+            assert r.status_code == status, (url, r.status_code, r.text)
+        return _get
+
+    def mit_session(fn):
+        def _aufruf():
+            with f.SessionLocal() as s:
+                fn(s)
+        return _aufruf
+
+    return [
+        Pruefung("_ueberlappung", mit_session(lambda s: f._ueberlappung(s, ids["geraet"], date(2025, 1, 10), None)),
+                 max_statements=1, indizes=("ix_vermietung_geraet_start",)),
+        Pruefung("flotten_auslastung_iststunden",
+                 mit_session(lambda s: f.flotten_auslastung_iststunden(s, date(2025, 1, 1), date(2025, 1, 31))),
+                 max_statements=3),
+        Pruefung("kunden_konto", mit_session(lambda s: f.kunden_konto(s, ids["kunde"], date(2025, 3, 1))),
+                 max_statements=5, indizes=("ix_vermietung_kunde_start", "ix_rechnung_vermietung_konto")),
+        Pruefung("GET /vermietungen", get("/vermietungen"), max_statements=1, indizes=("ix_vermietung_start_id",)),
+        Pruefung("GET /vermietungen?cursor", get(f"/vermietungen?limit=20&cursor={ids['cursor']}"),
+                 max_statements=1, indizes=("ix_vermietung_start_id",)),
+        Pruefung("GET /vermietungen?fields", get("/vermietungen?fields=id,status,start_datum"),
+                 max_statements=1, indizes=("ix_vermietung_start_id",)),
+        Pruefung("GET /vermietungen?fields=archiviert", get("/vermietungen?fields=archiviert", status=400),
+                 max_statements=0),   # abgeleitetes Feld ohne Spalte: 400 vor jeder Abfrage, kein 500
+        Pruefung("GET /vermietungen?geraet_id", get(f"/vermietungen?geraet_id={ids['geraet']}"),
+                 max_statements=1, indizes=("ix_vermietung_geraet_start",)),
+        Pruefung("GET /vermietungen?kunde_id", get(f"/vermietungen?kunde_id={ids['kunde']}"),
+                 max_statements=1, indizes=("ix_vermietung_kunde_start",)),
+        Pruefung("GET /vermietungen?status", get("/vermietungen?status=OFFEN"),
+                 max_statements=1, indizes=("ix_vermietung_status_start",)),
+        Pruefung("GET /geraete?status&cursor", get(f"/geraete?status=VERFUEGBAR&cursor={ids['geraet_cursor']}"),
+                 max_statements=1, indizes=("ix_geraet_status",)),
+        Pruefung("GET /vermietungen/{id}/positionen", get(f"/vermietungen/{ids['vermietung']}/positionen"),
+                 max_statements=1, indizes=("ix_position_vermietung",)),
+        Pruefung("GET /vermietungen/{id}/rechnungen", get(f"/vermietungen/{ids['vermietung']}/rechnungen"),
+                 max_statements=1, indizes=("ix_rechnung_vermietung_konto", "ix_rechnung_archiv_vermietung")),
+        Pruefung("GET /berichte/auslastung", get("/berichte/auslastung?fenster_start=2025-01-01&fenster_ende=2025-01-31"),
+                 max_statements=3),
+        Pruefung("GET /berichte/geraete/{id}/finanzen", get(f"/berichte/geraete/{ids['geraet']}/finanzen"),
+                 max_statements=4, indizes=("ix_vermietung_geraet_start", "ix_position_vermietung")),
+        Pruefung("GET /geraete/stand", get("/geraete/stand?datum=2024-06-10"),
+                 max_statements=1, indizes=("ix_geraet_historie_stichtag",)),
+        Pruefung("GET /kunden/{id}/konto", get(f"/kunden/{ids['kunde']}/konto"),
+                 max_statements=5, indizes=("ix_rechnung_vermietung_konto",)),
+    ]
+
+def main() -> int:
+    ids = _testbestand()
+    engine = f.ENGINE
+    fehler = 0
+    for p in pruefungen(ids):
+        e = pruefen(p, engine)
+        fehler += not e.ok
+        print(f"{'OK    ' if e.ok else 'FEHLER'} {p.name:<40} {e.statements}/{p.max_statements} Statements")
+        for scan in e.scans:
+            print(f"         Full-Scan {scan}")
+        for ix in e.fehlende_indizes:
+            print(f"         Index nicht genutzt: {ix}")
+    print(f"{fehler} Verstoesse")
+    return 1 if fehler else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
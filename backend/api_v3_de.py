@@ -1,24 +1,75 @@
 # api_v3_de.py - RENDER.COM CORS FIX
-from datetime import date, datetime
-from typing import Optional, List, Dict
+import time
+_IMPORT_START = time.perf_counter()   # Kaltstart-Messung (siehe /health, kaltstart.py)
 
-from fastapi import FastAPI, HTTPException, Query
+import asyncio
+import base64
+import gzip
+import json
+import os
+from contextlib import asynccontextmanager
+from collections import deque
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from typing import Any, Optional, List, Dict
+
+from fastapi import FastAPI, HTTPException, Query, Request, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import literal, select, tuple_, union_all
+from sqlalchemy.exc import OperationalError
+from starlette.datastructures import Headers, MutableHeaders
+
+try:   # optional: Brotli komprimiert JSON ~15-20 % besser als gzip
+    import brotli
+except ImportError:
+    brotli = None
 
 from flotte_v3_de import (
-    SessionLocal, init_db,
+    SessionLocal, lese_session, commit_positionen, init_db, BuchungsKonflikt,
     GeraetStatus, StandortTyp, SatzEinheit, VermietStatus, PosTyp,
     mietpark_anlegen, firma_anlegen, geraet_anlegen, kunde_anlegen, baustelle_anlegen,
     vermietung_anlegen, reservierung_starten, vermietung_schliessen, wartung_hinzufuegen,
-    position_hinzufuegen, rechnung_hinzufuegen,
-    vermietung_abrechnung, geraet_finanz_uebersicht, flotten_auslastung_iststunden,
-    Geraet, Kunde, Mietpark, Baustelle, Vermietung, VermietungPosition, Rechnung, Firma
+    vermietungen_bulk_starten, vermietungen_bulk_schliessen,
+    position_hinzufuegen, rechnung_hinzufuegen, ereignisse_seit, letzte_ereignis_position,
+    vermietung_abrechnung, geraet_finanz_uebersicht, flotten_auslastung_iststunden, umsatz_prognose,
+    auslastung_wuerfel, WUERFEL_DIMENSIONEN,
+    kunden_konto, offene_posten, stammdaten_seit, flotten_stand, stammsatz, stammsatz_statistik,
+    Geraet, Kunde, Mietpark, Baustelle, Vermietung, VermietungPosition, Rechnung, Firma,
+    VermietungArchiv, RechnungArchiv
 )
 
+# Kaltstart: import_ms (Modul-Import), start_ms (Schema-Pruefung im Lifespan), erste_anfrage_ms
+_KALTSTART: Dict[str, Any] = {"import_ms": None, "start_ms": None, "erste_anfrage_ms": None, "schema_version": None}
+
+def _schema_pruefen() -> None:
+    """Schema kommt out-of-band aus `python -m migrationen` (Pre-Deploy). Liegt die DB dahinter, startet
+    der Prozess nicht, statt spaeter bei jedem Schreibzugriff zu scheitern; FLOTTE_AUTO_MIGRATION=1
+    migriert stattdessen beim Start (lokal/Demo)."""
+    from migrationen import MIGRATIONEN, aktuelle_version
+    from flotte_v3_de import ENGINE
+    ziel = MIGRATIONEN[-1][0]
+    with ENGINE.begin() as conn:
+        stand = aktuelle_version(conn)
+    if stand < ziel and os.environ.get("FLOTTE_AUTO_MIGRATION") == "1":
+        init_db()
+        stand = ziel
+    if stand < ziel:
+        raise RuntimeError(f"Schema-Version {stand} hinter {ziel}: vor dem Start `python -m migrationen` ausfuehren")
+    _KALTSTART["schema_version"] = stand
+
+@asynccontextmanager
+async def _lebenszyklus(app):
+    t0 = time.perf_counter()
+    await run_in_threadpool(_schema_pruefen)
+    _KALTSTART["start_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    yield
+
 # 🚨 KRITISCH: App VOR Middleware erstellen
-app = FastAPI(title="Flotten-Management API (DE)", version="0.5.0")
+app = FastAPI(title="Flotten-Management API (DE)", version="0.5.0", lifespan=_lebenszyklus)
 
 # 🚨 KRITISCH: Standard CORS-Middleware (funktioniert auf Render)
 app.add_middleware(
@@ -27,10 +78,122 @@ app.add_middleware(
     allow_credentials=False,  # Wichtig für Render!
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Konsistenz-Position", "X-Next-Cursor"],
 )
 
-# DB initialisieren
-init_db()
+# Komprimierung: gzip/br nach Accept-Encoding, erst ab FLOTTE_KOMPRESSION_MIN_BYTES; Streams (SSE) bleiben roh
+KOMPRESSION_MIN_BYTES = int(os.environ.get("FLOTTE_KOMPRESSION_MIN_BYTES", "1024"))
+
+def _kodierung_waehlen(accept_encoding: str) -> Optional[str]:
+    angeboten: Dict[str, float] = {}
+    for teil in accept_encoding.lower().split(","):
+        name, _, param = teil.strip().partition(";")
+        q = 1.0
+        if param.strip().startswith("q="):
+            try:
+                q = float(param.strip()[2:])
+            except ValueError:
+                q = 0.0
+        angeboten[name.strip()] = q
+    for kodierung in (("br", "gzip") if brotli else ("gzip",)):
+        if angeboten.get(kodierung, angeboten.get("*", 0.0)) > 0:
+            return kodierung
+    return None
+
+_KOMPRIMIERBAR = ("application/json", "text/", "application/javascript", "application/xml", "image/svg+xml")
+
+class Komprimierung:
+    """ASGI-Middleware. Entscheidet beim ``http.response.start``: Antworten mit bekannter Laenge ab ``minimum``
+    und komprimierbarem Typ werden gepuffert und komprimiert. Streams (ohne Content-Length, SSE) und alles
+    andere gehen sofort samt Headern unveraendert durch. Jede komprimierbare Antwort traegt
+    ``Vary: Accept-Encoding``, auch unkomprimiert (zu klein, Client ohne gzip/br), damit Caches die
+    Varianten auseinanderhalten."""
+
+    def __init__(self, app, minimum: int = KOMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum = minimum
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        kodierung = _kodierung_waehlen(Headers(scope=scope).get("accept-encoding", ""))
+        start: Optional[dict] = None
+        teile: List[bytes] = []
+
+        async def senden(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                laenge, typ = headers.get("content-length"), headers.get("content-type", "")
+                if ("content-encoding" in headers or typ.startswith("text/event-stream")
+                        or not typ.startswith(_KOMPRIMIERBAR)):
+                    await send(message)   # durchreichen, Header sofort
+                    return
+                headers.add_vary_header("Accept-Encoding")
+                if kodierung and laenge is not None and laenge.isdigit() and int(laenge) >= self.minimum:
+                    start = message
+                else:
+                    await send(message)
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            teile.append(message.get("body", b""))
+            if message.get("more_body"):
+                return
+            body = b"".join(teile)
+            body = brotli.compress(body, quality=4) if kodierung == "br" else gzip.compress(body, compresslevel=6)
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = kodierung
+            headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, senden)
+
+app.add_middleware(Komprimierung)
+
+# Read-your-writes: Schreibantworten tragen X-Konsistenz-Position (Outbox-Position ihres Commits, Commit-geordnet).
+# Schickt der Client die hoechste erhaltene Position zurueck, liest er von der Replika nur, wenn diese die Position
+# bereits angewendet hat, sonst vom Primaer. "X-Konsistenz: primaer" erzwingt den Primaer fuer einzelne Anfragen.
+_primaer_lesen: ContextVar[bool] = ContextVar("_primaer_lesen", default=False)
+_lese_position: ContextVar[Optional[int]] = ContextVar("_lese_position", default=None)
+
+class LeseRouting:
+    """ASGI-Middleware wie Komprimierung (kein BaseHTTPMiddleware, das Streams ueber eine eigene Task
+    umleitet): setzt _primaer_lesen/_lese_position fuer die Dauer der Anfrage, der Kontext reicht so bis in
+    Threadpool und Stream-Generatoren. Erfolgreiche Schreibantworten erhalten X-Konsistenz-Position."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        primaer = headers.get("x-konsistenz", "").lower() == "primaer"
+        position = headers.get("x-konsistenz-position", "")
+        position = int(position) if position.isdigit() else None
+        positionen: List[int] = []   # vom Commit-Hook befuellt (auch aus dem Threadpool: gleiche Liste)
+
+        async def senden(message):
+            if message["type"] == "http.response.start" and message["status"] < 400 and positionen:
+                MutableHeaders(scope=message)["X-Konsistenz-Position"] = str(max(positionen))
+            await send(message)
+
+        schreibend = scope["method"] in ("POST", "PUT", "PATCH", "DELETE")
+        tokens = (_primaer_lesen.set(primaer), _lese_position.set(position), commit_positionen.set(positionen))
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, senden if schreibend else send)
+        finally:
+            _primaer_lesen.reset(tokens[0]); _lese_position.reset(tokens[1]); commit_positionen.reset(tokens[2])
+            if _KALTSTART["erste_anfrage_ms"] is None:
+                _KALTSTART["erste_anfrage_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+app.add_middleware(LeseRouting)
 
 # -----------------------------------------------------------------------------
 # Schemas
@@ -41,6 +204,7 @@ class IdOut(BaseModel):
 class RechnungsSucheOut(BaseModel):
     rechnung_id: int
     vermietung_id: int
+    archiviert: bool = False
 
 class MietparkCreate(BaseModel):
     name: str
@@ -90,6 +254,16 @@ class GeraetOut(BaseModel):
     akt_baustelle_id: Optional[int] = None
     eigentuemer_firma_id: Optional[int] = None
 
+class GeraetStandOut(BaseModel):
+    geraet_id: int
+    name: str
+    kategorie: str
+    gueltig_ab: date
+    status: GeraetStatus
+    standort_typ: StandortTyp
+    akt_mietpark_id: Optional[int] = None
+    akt_baustelle_id: Optional[int] = None
+
 class KundeCreate(BaseModel):
     name: str
     email: Optional[str] = None
@@ -143,6 +317,22 @@ class VermietungClose(BaseModel):
     stunden_ist: Optional[float] = None
     rueckgabe_mietpark_id: Optional[int] = None
 
+class BulkStartPosten(VermietungStart):
+    vermietung_id: int
+
+class BulkClosePosten(VermietungClose):
+    vermietung_id: int
+
+class BulkErgebnisOut(BaseModel):
+    vermietung_id: int
+    ok: bool
+    fehler: Optional[str] = None
+
+class BulkOut(BaseModel):
+    erfolgreich: int
+    fehlgeschlagen: int
+    ergebnisse: List[BulkErgebnisOut]
+
 class VermietungOut(BaseModel):
     id: int
     geraet_id: int
@@ -157,6 +347,7 @@ class VermietungOut(BaseModel):
     zaehler_start: Optional[float] = None
     zaehler_ende: Optional[float] = None
     notizen: Optional[str] = None
+    archiviert: bool = False   # aus den Archivtabellen (kompakt: ohne Zaehler/Notizen/Positionen)
 
 class PositionCreate(BaseModel):
     typ: PosTyp
@@ -203,6 +394,93 @@ class AbrechnungOut(BaseModel):
     kosten_gesamt: float
     marge: float
 
+class UmsatzPeriodeOut(BaseModel):
+    periode_start: date
+    periode_ende: date
+    aufgelaufen: float
+    prognose: float
+
+class UmsatzPrognoseOut(BaseModel):
+    stichtag: date
+    horizont_ende: date
+    raster: str
+    anzahl_offen: int
+    anzahl_reserviert: int
+    aufgelaufen: float
+    prognose: float
+    perioden: List[UmsatzPeriodeOut]
+
+class WuerfelZelleOut(BaseModel):
+    periode_start: date
+    periode_ende: date
+    kategorie: Optional[str] = None
+    mietpark: Optional[int] = None
+    eigentuemer: Optional[int] = None
+    kunde: Optional[int] = None
+    verfuegbar_stunden: Optional[float] = None
+    vermietet_stunden: float
+    auslastung: Optional[float] = None
+    umsatz_miete: float
+    anzahl_vermietungen: int
+
+class WuerfelOut(BaseModel):
+    von: date
+    bis: date
+    raster: str
+    dimensionen: List[str]
+    perioden_aus_cache: int
+    zellen: List[WuerfelZelleOut]
+
+class SyncTabelleOut(BaseModel):
+    spalten: List[str]
+    zeilen: List[List[Any]]
+    geloescht: List[int]
+
+class SyncOut(BaseModel):
+    version: int
+    voll: bool
+    tabellen: Dict[str, SyncTabelleOut]
+
+class AltersstrukturOut(BaseModel):
+    tage_0_30: float
+    tage_31_60: float
+    tage_61_90: float
+    tage_ueber_90: float
+
+class OffeneRechnungOut(BaseModel):
+    rechnung_id: int
+    vermietung_id: int
+    nummer: str
+    datum: date
+    betrag_netto: Optional[float] = None
+    alter_tage: int
+
+class KundenKontoOut(BaseModel):
+    kunde_id: int
+    name: str
+    stichtag: date
+    anzahl_rechnungen: int
+    summe_rechnungen: float
+    summe_bezahlt: float
+    anzahl_offen: int
+    offener_saldo: float
+    aelteste_offene: Optional[date] = None
+    altersstruktur: AltersstrukturOut
+    offene_rechnungen: List[OffeneRechnungOut]
+
+class OffenePostenKundeOut(AltersstrukturOut):
+    kunde_id: int
+    name: str
+    anzahl_offen: int
+    offener_saldo: float
+    aelteste_offene: Optional[date] = None
+
+class OffenePostenOut(BaseModel):
+    stichtag: date
+    offener_saldo: float
+    altersstruktur: AltersstrukturOut
+    kunden: List[OffenePostenKundeOut]
+
 class GeraetFinanzenOut(BaseModel):
     einnahmen_brutto: float
     kosten_intern: float
@@ -217,6 +495,97 @@ class GeraetFinanzenOut(BaseModel):
 def _session():
     return SessionLocal()
 
+# Sperr-Timeouts/Serialisierungsabbrueche sind voruebergehend: 503 + Retry-After statt 500 - aber kein 409,
+# denn ob ueberhaupt ein Buchungskonflikt vorliegt, ist nicht entschieden
+_VORUEBERGEHEND = ("40001", "40P01", "55P03")   # serialization_failure, deadlock_detected, lock_not_available
+
+@app.exception_handler(OperationalError)
+async def _db_voruebergehend(request: Request, ex: OperationalError):
+    if "database is locked" in str(ex.orig) or getattr(ex.orig, "pgcode", None) in _VORUEBERGEHEND:
+        return JSONResponse({"detail": "Datenbank ausgelastet, bitte erneut versuchen"}, status_code=503,
+                            headers={"Retry-After": "1"})
+    raise ex
+
+def _lese_session():
+    # Listen, Einzel-GETs & Berichte -> Lese-Engine (Replika), ausser Read-your-writes greift
+    return lese_session(primaer=_primaer_lesen.get(), position=_lese_position.get())
+
+def _stammsatz_out(modell, id: int, out, fehlt: str):
+    # Einzel-GETs aus dem prozessweiten Stammsatz-Cache; Fehlgriffe lesen vom Primaer, damit kein
+    # verzoegerter Replika-Stand eingelagert wird. Konsistenz-Token bzw. "X-Konsistenz: primaer" gelten auch
+    # hier: ein Schreibzugriff in einem anderen Worker ist sofort sichtbar, nicht erst nach dem naechsten Abgleich
+    with _session() as s:
+        satz = stammsatz(s, modell, id, position=_lese_position.get(), frisch=_primaer_lesen.get())
+    if satz is None:
+        raise HTTPException(404, fehlt)
+    return out(**satz._asdict())
+
+# Berichts-Cache: ein Eintrag bleibt gueltig, solange keine neue Outbox-Aenderung geschrieben wurde
+_BERICHT_CACHE: Dict[tuple, tuple] = {}
+
+def _bericht_gecacht(key: tuple, berechnen):
+    with _lese_session() as s:
+        stand = letzte_ereignis_position(s)
+        treffer = _BERICHT_CACHE.get(key)
+        if treffer and treffer[0] == stand:
+            return treffer[1]
+        wert = berechnen(s)
+    if len(_BERICHT_CACHE) > 256:
+        _BERICHT_CACHE.clear()
+    _BERICHT_CACHE[key] = (stand, wert)
+    return wert
+
+def _felder(fields: Optional[str], out, modell) -> Optional[List[str]]:
+    """``fields=id,name,status`` -> geprueft gegen das Ausgabe-Schema und die Tabellenspalten (die Projektion
+    selektiert Spalten; abgeleitete Felder wie ``archiviert`` gibt es nur in der vollen Antwort); id ist immer dabei."""
+    if not fields:
+        return None
+    felder = ["id"] + [f for f in dict.fromkeys(x.strip() for x in fields.split(",")) if f and f != "id"]
+    unbekannt = [f for f in felder if f not in out.model_fields]
+    if unbekannt:
+        raise HTTPException(400, f"Unbekannte Felder: {', '.join(unbekannt)}")
+    abgeleitet = [f for f in felder if f not in modell.__table__.c]
+    if abgeleitet:
+        raise HTTPException(400, f"Nicht per fields= waehlbar: {', '.join(abgeleitet)}")
+    return felder
+
+# Keyset-Paginierung: ORDER BY auf einen indizierten Schluessel, die Folgeseite beginnt per
+# WHERE (schluessel) > (letzte Werte) statt OFFSET -> jede Seite kostet gleich viel, nichts wird doppelt/uebersprungen
+CURSOR_DOKU = "Opaker Cursor aus dem Header X-Next-Cursor der vorigen Seite (ersetzt offset)"
+
+def _cursor_lesen(cursor: str, schluessel: tuple) -> list:
+    try:
+        werte = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(werte) != len(schluessel): raise ValueError
+        return [date.fromisoformat(w) if c.type.python_type is date else c.type.python_type(w)
+                for c, w in zip(schluessel, werte)]
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Ungueltiger Cursor")
+
+def _seite(q, schluessel: tuple, limit: int, offset: int = 0, cursor: Optional[str] = None):
+    if cursor:
+        werte = _cursor_lesen(cursor, schluessel)
+        q = q.where(tuple_(*schluessel) > tuple_(*[literal(w, c.type) for c, w in zip(schluessel, werte)]))
+    elif offset:
+        q = q.offset(offset)   # veraltet, bleibt fuer bestehende Clients
+    return q.order_by(*schluessel).limit(limit)
+
+def _naechster_cursor(response: Response, zeilen: list, schluessel: tuple, limit: int) -> None:
+    if len(zeilen) < limit:
+        return
+    letzte = zeilen[-1]
+    werte = [letzte[c.key] if isinstance(letzte, dict) else getattr(letzte, c.key) for c in schluessel]
+    response.headers["X-Next-Cursor"] = base64.urlsafe_b64encode(
+        json.dumps(werte, default=str, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def _projektion(s, modell, felder: List[str], q, schluessel: tuple, limit: int) -> JSONResponse:
+    # nur die angefragten Spalten (+ Cursor-Schluessel) selektieren, ohne ORM-Objekte & Pydantic-Validierung
+    spalten = list(dict.fromkeys(felder + [c.key for c in schluessel]))
+    zeilen = [dict(zip(spalten, z)) for z in s.execute(q.with_only_columns(*[modell.__table__.c[f] for f in spalten]))]
+    response = JSONResponse(jsonable_encoder([{f: z[f] for f in felder} for z in zeilen]))
+    _naechster_cursor(response, zeilen, schluessel, limit)
+    return response
+
 def _vm_to_out(v: Vermietung):
     return {
         "id": v.id,
@@ -237,7 +606,8 @@ def _vm_to_out(v: Vermietung):
 # 🚨 HEALTH-CHECK mit CORS-Test
 @app.get("/health")
 def health():
-    return {"status": "ok", "time": datetime.utcnow().isoformat() + "Z", "cors": "fixed"}
+    return {"status": "ok", "time": datetime.utcnow().isoformat() + "Z", "cors": "fixed",
+            "kaltstart": _KALTSTART, "stammsatz_cache": stammsatz_statistik()}
 
 # -----------------------------------------------------------------------------
 # Basis
@@ -275,12 +645,17 @@ def api_mietpark_anlegen(payload: MietparkCreate):
         return IdOut(id=mp.id)
 
 @app.get("/mietparks", response_model=List[MietparkOut])
-def api_mietparks_list(limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0)):
-    with _session() as s:
-        q = select(Mietpark).offset(offset).limit(limit)
-        mps = list(s.scalars(q))
+def api_mietparks_list(response: Response, limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0, deprecated=True),
+                       cursor: Optional[str] = Query(default=None, description=CURSOR_DOKU)):
+    with _lese_session() as s:
+        mps = list(s.scalars(_seite(select(Mietpark), (Mietpark.id,), limit, offset, cursor)))
+        _naechster_cursor(response, mps, (Mietpark.id,), limit)
         return [MietparkOut(id=m.id, name=m.name, adresse=m.adresse) for m in mps]
 
+@app.get("/mietparks/{mietpark_id}", response_model=MietparkOut)
+def api_mietpark_get(mietpark_id: int):
+    return _stammsatz_out(Mietpark, mietpark_id, MietparkOut, "Mietpark nicht gefunden")
+
 @app.post("/firmen", response_model=IdOut)
 def api_firma_anlegen(payload: FirmaCreate):
     with _session() as s:
@@ -288,12 +663,21 @@ def api_firma_anlegen(payload: FirmaCreate):
         return IdOut(id=f.id)
 
 @app.get("/firmen", response_model=List[FirmaOut])
-def api_firmen_list(limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0)):
-    with _session() as s:
-        q = select(Firma).offset(offset).limit(limit)
-        fs = list(s.scalars(q))
+def api_firmen_list(response: Response, limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0, deprecated=True),
+                    cursor: Optional[str] = Query(default=None, description=CURSOR_DOKU)):
+    with _lese_session() as s:
+        fs = list(s.scalars(_seite(select(Firma), (Firma.id,), limit, offset, cursor)))
+        _naechster_cursor(response, fs, (Firma.id,), limit)
         return [FirmaOut(id=f.id, name=f.name, land=f.land) for f in fs]
 
+# -----------------------------------------------------------------------------
+# Delta-Sync (Stammdaten fuer den Client-Cache)
+# -----------------------------------------------------------------------------
+@app.get("/sync", response_model=SyncOut)
+def api_sync(since: int = Query(0, ge=0, description="Zuletzt erhaltene version; 0 = Vollabgleich")):
+    with _lese_session() as s:
+        return stammdaten_seit(s, since)
+
 # -----------------------------------------------------------------------------
 # Geräte
 # -----------------------------------------------------------------------------
@@ -311,19 +695,26 @@ def api_geraet_anlegen(payload: GeraetCreate):
 
 @app.get("/geraete", response_model=List[GeraetOut])
 def api_geraete_list(
+    response: Response,
     status: Optional[GeraetStatus] = Query(default=None),
     standort_typ: Optional[StandortTyp] = Query(default=None),
     limit: int = Query(50, ge=1, le=500),
-    offset: int = Query(0, ge=0),
+    offset: int = Query(0, ge=0, deprecated=True),
+    cursor: Optional[str] = Query(default=None, description=CURSOR_DOKU),
+    fields: Optional[str] = Query(default=None, description="Kommagetrennte Spaltenauswahl, z.B. id,name,status"),
 ):
-    with _session() as s:
+    felder = _felder(fields, GeraetOut, Geraet)
+    with _lese_session() as s:
         q = select(Geraet)
         if status:
             q = q.where(Geraet.status == status)
         if standort_typ:
             q = q.where(Geraet.standort_typ == standort_typ)
-        q = q.offset(offset).limit(limit)
+        q = _seite(q, (Geraet.id,), limit, offset, cursor)
+        if felder:
+            return _projektion(s, Geraet, felder, q, (Geraet.id,), limit)
         gs = list(s.scalars(q))
+        _naechster_cursor(response, gs, (Geraet.id,), limit)
         out: List[GeraetOut] = []
         for g in gs:
             out.append(GeraetOut(
@@ -336,20 +727,15 @@ def api_geraete_list(
             ))
         return out
 
+# vor /geraete/{geraet_id} registriert, sonst greift dessen Pfadmuster
+@app.get("/geraete/stand", response_model=List[GeraetStandOut])
+def api_geraete_stand(datum: date = Query(..., description="Stichtag")):
+    with _lese_session() as s:
+        return flotten_stand(s, datum)
+
 @app.get("/geraete/{geraet_id}", response_model=GeraetOut)
 def api_geraet_get(geraet_id: int):
-    with _session() as s:
-        g = s.get(Geraet, geraet_id)
-        if not g:
-            raise HTTPException(404, "Geraet nicht gefunden")
-        return GeraetOut(
-            id=g.id, name=g.name, kategorie=g.kategorie, modell=g.modell, seriennummer=g.seriennummer,
-            status=g.status, stundenzaehler=g.stundenzaehler, stunden_pro_tag=g.stunden_pro_tag,
-            kauf_datum=g.kauf_datum, anschaffungspreis=g.anschaffungspreis,
-            standort_typ=g.standort_typ, heim_mietpark_id=g.heim_mietpark_id,
-            akt_mietpark_id=g.akt_mietpark_id, akt_baustelle_id=g.akt_baustelle_id,
-            eigentuemer_firma_id=g.eigentuemer_firma_id
-        )
+    return _stammsatz_out(Geraet, geraet_id, GeraetOut, "Geraet nicht gefunden")
 
 # -----------------------------------------------------------------------------
 # Kunden / Baustellen
@@ -361,13 +747,27 @@ def api_kunde_anlegen(payload: KundeCreate):
         return IdOut(id=k.id)
 
 @app.get("/kunden", response_model=List[KundeOut])
-def api_kunden_list(limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0)):
-    with _session() as s:
-        q = select(Kunde).offset(offset).limit(limit)
-        ks = list(s.scalars(q))
+def api_kunden_list(response: Response, limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0, deprecated=True),
+                    cursor: Optional[str] = Query(default=None, description=CURSOR_DOKU)):
+    with _lese_session() as s:
+        ks = list(s.scalars(_seite(select(Kunde), (Kunde.id,), limit, offset, cursor)))
+        _naechster_cursor(response, ks, (Kunde.id,), limit)
         return [KundeOut(id=k.id, name=k.name, email=k.email, telefon=k.telefon,
                          rechnungsadresse=k.rechnungsadresse, ust_id=k.ust_id) for k in ks]
 
+@app.get("/kunden/{kunde_id}", response_model=KundeOut)
+def api_kunde_get(kunde_id: int):
+    return _stammsatz_out(Kunde, kunde_id, KundeOut, "Kunde nicht gefunden")
+
+@app.get("/kunden/{kunde_id}/konto", response_model=KundenKontoOut)
+def api_kunden_konto(kunde_id: int, stichtag: Optional[date] = Query(default=None),
+                     offene_limit: int = Query(100, ge=0, le=1000)):
+    with _lese_session() as s:
+        try:
+            return kunden_konto(s, kunde_id, stichtag, offene_limit)
+        except ValueError as ex:
+            raise HTTPException(404, str(ex))
+
 @app.post("/baustellen", response_model=IdOut)
 def api_baustelle_anlegen(payload: BaustelleCreate):
     with _session() as s:
@@ -376,17 +776,23 @@ def api_baustelle_anlegen(payload: BaustelleCreate):
 
 @app.get("/baustellen", response_model=List[BaustelleOut])
 def api_baustellen_list(
+    response: Response,
     kunde_id: Optional[int] = None,
-    limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0)
+    limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0, deprecated=True),
+    cursor: Optional[str] = Query(default=None, description=CURSOR_DOKU),
 ):
-    with _session() as s:
+    with _lese_session() as s:
         q = select(Baustelle)
         if kunde_id:
             q = q.where(Baustelle.kunde_id == kunde_id)
-        q = q.offset(offset).limit(limit)
-        bs = list(s.scalars(q))
+        bs = list(s.scalars(_seite(q, (Baustelle.id,), limit, offset, cursor)))
+        _naechster_cursor(response, bs, (Baustelle.id,), limit)
         return [BaustelleOut(id=b.id, kunde_id=b.kunde_id, name=b.name, adresse=b.adresse, stadt=b.stadt, land=b.land) for b in bs]
 
+@app.get("/baustellen/{baustelle_id}", response_model=BaustelleOut)
+def api_baustelle_get(baustelle_id: int):
+    return _stammsatz_out(Baustelle, baustelle_id, BaustelleOut, "Baustelle nicht gefunden")
+
 # -----------------------------------------------------------------------------
 # Vermietungen
 # -----------------------------------------------------------------------------
@@ -400,9 +806,38 @@ def api_vermietung_anlegen(payload: VermietungCreate):
                 payload.baustelle_id, payload.notizen, payload.status
             )
             return IdOut(id=v.id)
+        except BuchungsKonflikt as ex:
+            raise HTTPException(409, str(ex))
         except ValueError as ex:
             raise HTTPException(400, str(ex))
 
+# Bulk-Routen vor den /{vermietung_id}/-Routen registrieren, sonst greift dort "bulk" als ID
+BULK_MAX = 500
+
+def _bulk_out(ergebnisse) -> BulkOut:
+    ok = sum(1 for e in ergebnisse if e["ok"])
+    return BulkOut(erfolgreich=ok, fehlgeschlagen=len(ergebnisse) - ok, ergebnisse=ergebnisse)
+
+@app.post("/vermietungen/bulk/starten", response_model=BulkOut)
+def api_vermietungen_bulk_starten(payload: List[BulkStartPosten]):
+    if len(payload) > BULK_MAX:
+        raise HTTPException(400, f"Maximal {BULK_MAX} Posten je Anfrage")
+    with _session() as s:
+        try:
+            return _bulk_out(vermietungen_bulk_starten(s, [p.model_dump() for p in payload]))
+        except BuchungsKonflikt as ex:
+            raise HTTPException(409, str(ex))
+
+@app.post("/vermietungen/bulk/schliessen", response_model=BulkOut)
+def api_vermietungen_bulk_schliessen(payload: List[BulkClosePosten]):
+    if len(payload) > BULK_MAX:
+        raise HTTPException(400, f"Maximal {BULK_MAX} Posten je Anfrage")
+    with _session() as s:
+        try:
+            return _bulk_out(vermietungen_bulk_schliessen(s, [p.model_dump() for p in payload]))
+        except BuchungsKonflikt as ex:
+            raise HTTPException(409, str(ex))
+
 @app.post("/vermietungen/{vermietung_id}/starten", response_model=VermietungOut)
 def api_reservierung_starten(vermietung_id: int, payload: VermietungStart):
     with _session() as s:
@@ -412,6 +847,8 @@ def api_reservierung_starten(vermietung_id: int, payload: VermietungStart):
                 zaehler_start=payload.zaehler_start, baustelle_id=payload.baustelle_id
             )
             return _vm_to_out(v)
+        except BuchungsKonflikt as ex:
+            raise HTTPException(409, str(ex))
         except ValueError as ex:
             raise HTTPException(400, str(ex))
 
@@ -425,17 +862,26 @@ def api_vermietung_schliessen(vermietung_id: int, payload: VermietungClose):
                 rueckgabe_mietpark_id=payload.rueckgabe_mietpark_id
             )
             return _vm_to_out(v)
+        except BuchungsKonflikt as ex:
+            raise HTTPException(409, str(ex))
         except ValueError as ex:
             raise HTTPException(400, str(ex))
 
+# passt zu ix_vermietung_start_id bzw. (status|geraet_id|kunde_id, start_datum, id)
+VERMIETUNG_SCHLUESSEL = (Vermietung.start_datum, Vermietung.id)
+
 @app.get("/vermietungen", response_model=List[VermietungOut])
 def api_vermietungen_list(
+    response: Response,
     status: Optional[VermietStatus] = Query(default=None),
     geraet_id: Optional[int] = Query(default=None),
     kunde_id: Optional[int] = Query(default=None),
-    limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0, deprecated=True),
+    cursor: Optional[str] = Query(default=None, description=CURSOR_DOKU),
+    fields: Optional[str] = Query(default=None, description="Kommagetrennte Spaltenauswahl, z.B. id,name,status"),
 ):
-    with _session() as s:
+    felder = _felder(fields, VermietungOut, Vermietung)
+    with _lese_session() as s:
         q = select(Vermietung)
         if status:
             q = q.where(Vermietung.status == status)
@@ -443,17 +889,27 @@ def api_vermietungen_list(
             q = q.where(Vermietung.geraet_id == geraet_id)
         if kunde_id:
             q = q.where(Vermietung.kunde_id == kunde_id)
-        q = q.offset(offset).limit(limit)
+        q = _seite(q, VERMIETUNG_SCHLUESSEL, limit, offset, cursor)
+        if felder:
+            return _projektion(s, Vermietung, felder, q, VERMIETUNG_SCHLUESSEL, limit)
         vs = list(s.scalars(q))
+        _naechster_cursor(response, vs, VERMIETUNG_SCHLUESSEL, limit)
         return [_vm_to_out(v) for v in vs]
 
 @app.get("/vermietungen/{vermietung_id}", response_model=VermietungOut)
 def api_vermietung_get(vermietung_id: int):
-    with _session() as s:
+    with _lese_session() as s:
         v = s.get(Vermietung, vermietung_id)
-        if not v:
+        if v:
+            return _vm_to_out(v)
+        va = s.get(VermietungArchiv, vermietung_id)
+        if not va:
             raise HTTPException(404, "Vermietung nicht gefunden")
-        return _vm_to_out(v)
+        return VermietungOut(
+            id=va.id, geraet_id=va.geraet_id, kunde_id=va.kunde_id, baustelle_id=va.baustelle_id,
+            start_datum=va.start_datum, end_datum=va.end_datum, satz_wert=va.satz_wert, satz_einheit=va.satz_einheit,
+            status=VermietStatus.GESCHLOSSEN, stunden_ist=va.stunden_ist, archiviert=True,
+        )
 
 # -----------------------------------------------------------------------------
 # Positionen & Rechnungen
@@ -471,10 +927,12 @@ def api_position_hinzufuegen(vermietung_id: int, payload: PositionCreate):
             raise HTTPException(400, str(ex))
 
 @app.get("/vermietungen/{vermietung_id}/positionen", response_model=List[PositionOut])
-def api_positionen_list(vermietung_id: int, limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
-    with _session() as s:
-        q = select(VermietungPosition).where(VermietungPosition.vermietung_id == vermietung_id).offset(offset).limit(limit)
-        ps = list(s.scalars(q))
+def api_positionen_list(vermietung_id: int, response: Response, limit: int = Query(100, ge=1, le=1000),
+                        offset: int = Query(0, ge=0, deprecated=True), cursor: Optional[str] = Query(default=None, description=CURSOR_DOKU)):
+    with _lese_session() as s:
+        q = select(VermietungPosition).where(VermietungPosition.vermietung_id == vermietung_id)
+        ps = list(s.scalars(_seite(q, (VermietungPosition.id,), limit, offset, cursor)))
+        _naechster_cursor(response, ps, (VermietungPosition.id,), limit)
         return [PositionOut(
             id=p.id, vermietung_id=p.vermietung_id, typ=p.typ, text=p.text,
             menge=p.menge, einheit=p.einheit, preis_einzel=p.preis_einzel, kosten_einzel=p.kosten_einzel
@@ -493,10 +951,14 @@ def api_rechnung_hinzufuegen(vermietung_id: int, payload: RechnungCreate):
             raise HTTPException(400, str(ex))
 
 @app.get("/vermietungen/{vermietung_id}/rechnungen", response_model=List[RechnungOut])
-def api_rechnungen_list(vermietung_id: int, limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
-    with _session() as s:
-        q = select(Rechnung).where(Rechnung.vermietung_id == vermietung_id).offset(offset).limit(limit)
-        rs = list(s.scalars(q))
+def api_rechnungen_list(vermietung_id: int, response: Response, limit: int = Query(100, ge=1, le=1000),
+                        offset: int = Query(0, ge=0, deprecated=True), cursor: Optional[str] = Query(default=None, description=CURSOR_DOKU)):
+    with _lese_session() as s:
+        # heisse und archivierte Rechnungen in einem Statement (IDs ueber beide Ebenen eindeutig)
+        u = union_all(*[select(m.id, m.vermietung_id, m.nummer, m.datum, m.betrag_netto, m.bezahlt)
+                        .where(m.vermietung_id == vermietung_id) for m in (Rechnung, RechnungArchiv)]).subquery()
+        rs = list(s.execute(_seite(select(u), (u.c.id,), limit, offset, cursor)))
+        _naechster_cursor(response, rs, (u.c.id,), limit)
         return [RechnungOut(
             id=r.id, vermietung_id=r.vermietung_id, nummer=r.nummer, datum=r.datum,
             betrag_netto=r.betrag_netto, bezahlt=bool(r.bezahlt)
@@ -504,11 +966,14 @@ def api_rechnungen_list(vermietung_id: int, limit: int = Query(100, ge=1, le=100
 
 @app.get("/rechnungen/suche", response_model=RechnungsSucheOut)
 def api_rechnung_suche(nummer: str = Query(..., min_length=1, max_length=60)):
-    with _session() as s:
+    with _lese_session() as s:
         r = s.scalar(select(Rechnung).where(Rechnung.nummer == nummer))
-        if not r:
+        if r:
+            return RechnungsSucheOut(rechnung_id=r.id, vermietung_id=r.vermietung_id)
+        ra = s.scalar(select(RechnungArchiv).where(RechnungArchiv.nummer == nummer))
+        if not ra:
             raise HTTPException(404, "Rechnungsnummer nicht gefunden")
-        return RechnungsSucheOut(rechnung_id=r.id, vermietung_id=r.vermietung_id)
+        return RechnungsSucheOut(rechnung_id=ra.id, vermietung_id=ra.vermietung_id, archiviert=True)
 
 # -----------------------------------------------------------------------------
 # Berichte
@@ -517,7 +982,7 @@ def api_rechnung_suche(nummer: str = Query(..., min_length=1, max_length=60)):
 def api_auslastung(fenster_start: date = Query(...), fenster_ende: date = Query(...)):
     if fenster_ende < fenster_start:
         raise HTTPException(400, "fenster_ende muss >= fenster_start sein")
-    with _session() as s:
+    with _lese_session() as s:
         flotte, pro = flotten_auslastung_iststunden(s, fenster_start, fenster_ende)
         return AuslastungOut(
             fenster_start=fenster_start,
@@ -526,9 +991,39 @@ def api_auslastung(fenster_start: date = Query(...), fenster_ende: date = Query(
             pro_geraet={str(k): round(v, 6) for k, v in pro.items()}  # Keys als Strings
         )
 
+@app.get("/berichte/umsatzprognose", response_model=UmsatzPrognoseOut)
+def api_umsatzprognose(
+    stichtag: Optional[date] = Query(default=None),
+    horizont_ende: Optional[date] = Query(default=None),
+    raster: str = Query("monat", pattern="^(tag|woche|monat|quartal)$"),
+):
+    stichtag = stichtag or date.today()
+    horizont_ende = horizont_ende or stichtag + timedelta(days=90)
+    if horizont_ende < stichtag:
+        raise HTTPException(400, "horizont_ende muss >= stichtag sein")
+    return _bericht_gecacht(("umsatzprognose", stichtag, horizont_ende, raster),
+                            lambda s: umsatz_prognose(s, stichtag, horizont_ende, raster))
+
+@app.get("/berichte/wuerfel", response_model=WuerfelOut)
+def api_wuerfel(
+    von: date = Query(...), bis: date = Query(...),
+    dimensionen: str = Query("kategorie", description=f"Kommagetrennt aus {', '.join(WUERFEL_DIMENSIONEN)}"),
+    raster: str = Query("monat", pattern="^(woche|monat|quartal)$"),
+):
+    with _lese_session() as s:
+        try:
+            return auslastung_wuerfel(s, von, bis, [d.strip() for d in dimensionen.split(",") if d.strip()], raster)
+        except ValueError as ex:
+            raise HTTPException(400, str(ex))
+
+@app.get("/berichte/offene_posten", response_model=OffenePostenOut)
+def api_offene_posten(stichtag: Optional[date] = Query(default=None)):
+    stichtag = stichtag or date.today()
+    return _bericht_gecacht(("offene_posten", stichtag), lambda s: offene_posten(s, stichtag))
+
 @app.get("/berichte/vermietungen/{vermietung_id}/abrechnung", response_model=AbrechnungOut)
 def api_vermietung_abrechnung(vermietung_id: int):
-    with _session() as s:
+    with _lese_session() as s:
         try:
             abr = vermietung_abrechnung(s, vermietung_id)
             return AbrechnungOut(**abr)
@@ -537,9 +1032,107 @@ def api_vermietung_abrechnung(vermietung_id: int):
 
 @app.get("/berichte/geraete/{geraet_id}/finanzen", response_model=GeraetFinanzenOut)
 def api_geraet_finanzen(geraet_id: int):
-    with _session() as s:
+    with _lese_session() as s:
         try:
             data = geraet_finanz_uebersicht(s, geraet_id)
             return GeraetFinanzenOut(**data)
         except ValueError as ex:
             raise HTTPException(404, str(ex))
+
+# -----------------------------------------------------------------------------
+# Live-Ereignisse (SSE)
+# -----------------------------------------------------------------------------
+EREIGNIS_POLL_S = float(os.environ.get("FLOTTE_EREIGNIS_POLL_S", "1"))
+EREIGNIS_BATCH = 500
+
+def _sse(e) -> str:
+    daten = {"entitaet": e.entitaet, "entitaet_id": e.entitaet_id,
+             "zeitpunkt": e.zeitpunkt.isoformat() + "Z", **json.loads(e.daten or "{}")}
+    return f"id: {e.position}\nevent: {e.typ}\ndata: {json.dumps(daten, separators=(',', ':'))}\n\n"
+
+def _ereignisse_laden(seit: int, limit: int = EREIGNIS_BATCH):
+    with _lese_session() as s:
+        return [(e.position, _sse(e)) for e in ereignisse_seit(s, seit, limit)]
+
+class EreignisVerteiler:
+    """Ein Outbox-Poller pro Prozess; alle SSE-Abonnenten lesen aus dessen Ringpuffer.
+
+    Die DB-Last haengt damit nur vom Poll-Intervall ab, nicht von der Zahl offener Dashboards.
+    Abonnenten, die weiter zurueckliegen als der Puffer reicht, holen den Rueckstand einmalig aus der DB.
+    Fortgesetzt wird ueber die Outbox-Position (Commit-Reihenfolge), sie ist auch die SSE-``id``.
+    """
+
+    def __init__(self, intervall: float = EREIGNIS_POLL_S, puffer: int = 2000):
+        self.intervall = intervall
+        self.puffer: deque = deque(maxlen=puffer)   # (position, sse-text)
+        self.letzte_position = 0
+        self._bedingung: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()   # sonst starten zwei erste Abonnenten je einen Poller
+
+    async def _starten(self):
+        async with self._start_lock:
+            if self._task is None or self._task.done():
+                self._bedingung = asyncio.Condition()
+                def _max_position():
+                    with _lese_session() as s:
+                        return letzte_ereignis_position(s)
+                self.letzte_position = await run_in_threadpool(_max_position)
+                self._task = asyncio.create_task(self._pollen())
+
+    async def _pollen(self):
+        while True:
+            try:
+                neue = await run_in_threadpool(_ereignisse_laden, self.letzte_position)
+            except Exception:
+                neue = []
+            if neue:
+                async with self._bedingung:
+                    self.puffer.extend(neue)
+                    self.letzte_position = neue[-1][0]
+                    self._bedingung.notify_all()
+                if len(neue) == EREIGNIS_BATCH:
+                    continue
+            await asyncio.sleep(self.intervall)
+
+    async def abonnieren(self, seit: Optional[int]):
+        await self._starten()
+        pos = self.letzte_position if seit is None else seit
+        while True:
+            if pos < self.letzte_position and (not self.puffer or pos < self.puffer[0][0] - 1):
+                rueckstand = await run_in_threadpool(_ereignisse_laden, pos)
+                for p, text in rueckstand:
+                    yield text
+                    pos = p
+                if rueckstand:
+                    continue
+            async with self._bedingung:
+                neue = [(p, text) for p, text in self.puffer if p > pos]
+                if not neue:
+                    try:
+                        await asyncio.wait_for(self._bedingung.wait(), timeout=15)
+                    except asyncio.TimeoutError:
+                        neue = None
+            if neue is None:
+                yield ": ping\n\n"   # Keep-alive fuer Proxies
+                continue
+            for p, text in neue:
+                yield text
+                pos = p
+
+_verteiler = EreignisVerteiler()
+
+@app.get("/events")
+async def api_events(
+    seit: Optional[int] = Query(default=None, ge=0),
+    last_event_id: Optional[str] = Header(default=None),
+):
+    """SSE-Strom der Outbox. Fortsetzen per ?seit=<position> oder Last-Event-ID (EventSource-Reconnect)."""
+    if seit is None and last_event_id and last_event_id.isdigit():
+        seit = int(last_event_id)
+    return StreamingResponse(
+        _verteiler.abonnieren(seit), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+_KALTSTART["import_ms"] = round((time.perf_counter() - _IMPORT_START) * 1000, 1)
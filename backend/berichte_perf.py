@@ -0,0 +1,80 @@
+# berichte_perf.py
+"""Laufzeit-Grenzen der Berichte ueber vielen langlaufenden Vermietungen.
+
+    python berichte_perf.py [--offen 1000] [--jahre 3]
+
+Ohne FLOTTE_DB_URL laeuft der Test gegen eine temporaere SQLite-Datei. Bestand: ``--offen`` offene
+MONATLICH-Vermietungen (je Geraet eine), Starttage gleichverteilt ueber die letzten ``--jahre`` Jahre.
+Gemessen wird die reine Berechnung (ohne Bericht-Cache). Exit-Code 1, sobald ein Szenario seine
+Grenze ueberschreitet.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Callable, List, Tuple
+
+if "FLOTTE_DB_URL" not in os.environ:
+    os.environ["FLOTTE_DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "berichte_perf.db")
+
+from sqlalchemy import insert, select
+
+import flotte_v3_de as f
+
+STICHTAG = date(2026, 6, 30)
+
+def befuellen(n_offen: int, jahre: int, seed: int = 11) -> None:
+    rnd = random.Random(seed)
+    f.init_db()
+    with f.SessionLocal() as s:
+        kid = f.kunde_anlegen(s, "Perf GmbH").id
+        gs = [dict(name=f"Perf {i}", kategorie=("bagger", "kran", "walze")[i % 3], status=f.GeraetStatus.VERMIETET,
+                   stundenzaehler=0.0, stunden_pro_tag=8, anschaffungspreis=0.0, standort_typ=f.StandortTyp.KUNDE)
+              for i in range(n_offen)]
+        s.execute(insert(f.Geraet), gs); s.commit()
+        gids = list(s.scalars(select(f.Geraet.id)))
+        s.execute(insert(f.Vermietung), [dict(
+            geraet_id=g, kunde_id=kid, start_datum=STICHTAG - timedelta(days=rnd.randrange(1, 365 * jahre)),
+            end_datum=None, satz_wert=float(rnd.randrange(1500, 6000)), satz_einheit=f.SatzEinheit.MONATLICH,
+            status=f.VermietStatus.OFFEN,
+        ) for g in gids])
+        s.commit()
+
+def _wuerfel(s: f.Session, dimensionen: Tuple[str, ...]) -> object:
+    f._WUERFEL_CACHE.clear()
+    return f.auslastung_wuerfel(s, STICHTAG - timedelta(days=730), STICHTAG, dimensionen, "woche", heute=STICHTAG)
+
+def szenarien() -> List[Tuple[str, float, Callable[[f.Session], object]]]:
+    """(Name, Grenze in Sekunden, Aufruf)."""
+    horizont = STICHTAG + timedelta(days=90)
+    return [
+        ("umsatz_prognose raster=tag", 1.0, lambda s: f.umsatz_prognose(s, STICHTAG, horizont, "tag")),
+        ("umsatz_prognose raster=monat", 1.0, lambda s: f.umsatz_prognose(s, STICHTAG, horizont, "monat")),
+        ("auslastung_wuerfel woche 2 Jahre", 1.0, lambda s: _wuerfel(s, ("kategorie",))),
+        ("auslastung_wuerfel woche 2 J. kunde", 1.0, lambda s: _wuerfel(s, ("kategorie", "kunde"))),
+    ]
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--offen", type=int, default=1000)
+    ap.add_argument("--jahre", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    befuellen(args.offen, args.jahre)
+    verstoesse = 0
+    with f.SessionLocal() as s:
+        for name, grenze, aufruf in szenarien():
+            t0 = time.perf_counter(); aufruf(s); dauer = time.perf_counter() - t0
+            ok = dauer <= grenze
+            verstoesse += not ok
+            print(f"{'OK    ' if ok else 'FEHLER'} {name:<36} {dauer:7.2f} s  (Grenze {grenze:.1f} s)")
+    print(f"{verstoesse} Verstoesse")
+    return 1 if verstoesse else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
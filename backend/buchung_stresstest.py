@@ -0,0 +1,147 @@
+# buchung_stresstest.py
+"""Nebenlaeufiger Stresstest fuer alle Buchungspfade: beweist 0 Doppelbuchungen.
+
+    python buchung_stresstest.py [--threads 32] [--versuche 4000] [--geraete 5]
+
+Phase 1 legt parallel Reservierungen an. Phase 2 mischt weitere Reservierungen mit Einzel- und
+Bulk-Starts (teils vorgezogen) sowie Einzel- und Bulk-Rueckgaben (teils verspaetet) auf denselben
+Geraeten - jeder dieser Pfade kann einen belegten Zeitraum erweitern.
+
+Ohne FLOTTE_DB_URL laeuft der Test gegen eine temporaere SQLite-Datei; mit
+FLOTTE_DB_URL=postgresql://... gegen eine (leere) lokale Postgres-DB.
+Exit-Code 1, sobald sich zwei aktive Vermietungen eines Geraets ueberlappen, eine Vermietung
+doppelt gestartet/geschlossen wurde oder ein Pfad mit etwas anderem als Konflikt/Ablehnung endet.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+if "FLOTTE_DB_URL" not in os.environ:
+    os.environ["FLOTTE_DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stresstest.db")
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import aliased
+
+from flotte_v3_de import (
+    SessionLocal, init_db, AenderungEreignis, BuchungsKonflikt, SatzEinheit, VermietStatus, Vermietung,
+    geraet_anlegen, kunde_anlegen, vermietung_anlegen, reservierung_starten, vermietung_schliessen,
+    vermietungen_bulk_starten, vermietungen_bulk_schliessen,
+)
+
+def doppelbuchungen(s) -> int:
+    a, b = aliased(Vermietung), aliased(Vermietung)
+    aktiv = [VermietStatus.RESERVIERT, VermietStatus.OFFEN, VermietStatus.GESCHLOSSEN]
+    q = select(func.count()).select_from(a).join(b, and_(a.geraet_id == b.geraet_id, a.id < b.id)).where(
+        a.status.in_(aktiv), b.status.in_(aktiv),
+        a.start_datum <= func.coalesce(b.end_datum, date.max),
+        or_(a.end_datum == None, a.end_datum >= b.start_datum),
+    )
+    return s.scalar(q) or 0
+
+def doppelte_uebergaenge(s) -> int:
+    """Vermietungen, die mehr als einmal gestartet oder geschlossen wurden (laut Outbox)."""
+    je = select(AenderungEreignis.typ, AenderungEreignis.entitaet_id).where(
+        AenderungEreignis.typ.in_(["vermietung_gestartet", "vermietung_geschlossen"])
+    ).group_by(AenderungEreignis.typ, AenderungEreignis.entitaet_id).having(func.count() > 1).subquery()
+    return s.scalar(select(func.count()).select_from(je)) or 0
+
+def _ausfuehren(aufruf) -> str:
+    try:
+        aufruf()
+        return "ok"
+    except BuchungsKonflikt:
+        return "konflikt"
+    except ValueError:   # fachlich abgelehnt, z.B. bereits gestartet
+        return "abgelehnt"
+    except Exception as ex:
+        return _unerwartet(ex)
+
+def _unerwartet(ex: Exception) -> str:
+    if isinstance(ex, OperationalError) and "database is locked" in str(ex.orig):
+        return "voruebergehend"   # SQLite-Sperr-Timeout, die API antwortet 503 + Retry-After
+    return f"fehler: {type(ex).__name__}: {ex}"   # alles andere ist ein Testfehler
+
+def _bulk(ergebnisse) -> str:
+    """Ein Bulk-Aufruf zaehlt als erfolgreich, sobald ein Posten durchging."""
+    if any(e["ok"] for e in ergebnisse): return "ok"
+    fehler = [e["fehler"] for e in ergebnisse]
+    return "konflikt" if any("parallel" in x or "ueberl" in x.lower() for x in fehler) else "abgelehnt"
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--versuche", type=int, default=4000)
+    ap.add_argument("--geraete", type=int, default=5, help="wenige Geraete = viele Konflikte")
+    args = ap.parse_args(argv)
+
+    init_db()
+    with SessionLocal() as s:
+        kid = kunde_anlegen(s, "Stresstest GmbH").id
+        gids = [geraet_anlegen(s, f"Stress {i}", "test").id for i in range(args.geraete)]
+
+    basis = date(2030, 1, 1)
+    def buchen(i: int) -> str:
+        rnd = random.Random(i)
+        start = basis + timedelta(days=rnd.randrange(0, 365))
+        ende = start + timedelta(days=rnd.randrange(0, 14))
+        with SessionLocal() as s:
+            return _ausfuehren(lambda: vermietung_anlegen(s, rnd.choice(gids), kid, start, ende, 100.0,
+                                                          SatzEinheit.TAEGLICH, status=VermietStatus.RESERVIERT))
+
+    zeitraeume: dict = {}   # Stand nach Phase 1
+    def mischen(i: int) -> str:
+        # Reservierungen werden oft mehrfach und parallel gestartet/geschlossen; vorgezogene Starts und
+        # verspaetete Rueckgaben stossen an die Nachbarbuchung desselben Geraets
+        rnd = random.Random(args.versuche + i)
+        ids = list(zeitraeume) or [0]
+        wahl = [rnd.choice(ids) for _ in range(rnd.randrange(2, 6))]
+        versatz = lambda: timedelta(days=rnd.choice((0, rnd.randrange(1, 10))))
+        start = lambda vid: zeitraeume.get(vid, (basis, basis))[0] - versatz()
+        ende = lambda vid: zeitraeume.get(vid, (basis, basis))[1] + versatz()
+        art = rnd.randrange(5)
+        with SessionLocal() as s:
+            if art == 0: return buchen(i + 10 * args.versuche)
+            if art == 1: return _ausfuehren(lambda: reservierung_starten(s, wahl[0], start(wahl[0])))
+            if art == 2: return _ausfuehren(lambda: vermietung_schliessen(s, wahl[0], ende(wahl[0]), stunden_ist=8.0))
+            try:
+                if art == 3:
+                    return _bulk(vermietungen_bulk_starten(s, [dict(vermietung_id=v, start_datum=start(v)) for v in wahl]))
+                return _bulk(vermietungen_bulk_schliessen(
+                    s, [dict(vermietung_id=v, end_datum=ende(v), stunden_ist=8.0) for v in wahl]))
+            except BuchungsKonflikt:
+                return "konflikt"
+            except Exception as ex:
+                return _unerwartet(ex)
+
+    fehler: list = []
+    for phase, aufgabe in (("anlegen", buchen), ("starten/schliessen/bulk", mischen)):
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            ergebnisse = list(pool.map(aufgabe, range(args.versuche)))
+        dauer = time.perf_counter() - t0
+        with SessionLocal() as s:
+            zeitraeume.update((v.id, (v.start_datum, v.end_datum)) for v in s.scalars(select(Vermietung)))
+        fehler += [e for e in ergebnisse if e.startswith("fehler")]
+        print(f"{phase}: {args.versuche} Versuche in {dauer:.2f}s ({args.versuche / dauer:.0f}/s), "
+              f"{args.threads} Threads, {args.geraete} Geraete")
+        print(f"  erfolgreich: {ergebnisse.count('ok')}  Konflikte (409): {ergebnisse.count('konflikt')}  "
+              f"abgelehnt (400): {ergebnisse.count('abgelehnt')}  voruebergehend (503): {ergebnisse.count('voruebergehend')}  "
+              f"Fehler: {sum(e.startswith('fehler') for e in ergebnisse)}")
+
+    with SessionLocal() as s:
+        doppelt, doppelt_uebergang = doppelbuchungen(s), doppelte_uebergaenge(s)
+    print(f"Doppelbuchungen: {doppelt}  doppelte Starts/Rueckgaben: {doppelt_uebergang}")
+    for f in sorted(set(fehler))[:5]:
+        print("  " + f)
+    return 1 if doppelt or doppelt_uebergang or fehler else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,74 @@
 # flotte_v3_de.py
 from __future__ import annotations
 
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import nullcontext
+from contextvars import ContextVar
 from datetime import date, datetime, timedelta
 from enum import Enum
-from typing import Optional, Iterable, Dict, Tuple, List
+from typing import Optional, Iterable, Iterator, Dict, Tuple, List
 
 from sqlalchemy import (
     create_engine, String, Enum as SAEnum, Integer, Float, Date, DateTime,
-    ForeignKey, CheckConstraint, UniqueConstraint, select, func, or_
+    ForeignKey, CheckConstraint, UniqueConstraint, Index, event, select, update, delete, insert, func, or_, case
 )
 from sqlalchemy.orm import (
-    DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker, Session
+    DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker, Session, selectinload, aliased
 )
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
 
 # ================== DB ==================
-ENGINE = create_engine("sqlite:///flotte_v3.db", echo=False, future=True)
+DB_URL = os.environ.get("FLOTTE_DB_URL", "sqlite:///flotte_v3.db")
+# Optionale Lese-Replika (z.B. Postgres-Standby) fuer Listen & Berichte; ohne Angabe = Primaer
+LESE_DB_URL = os.environ.get("FLOTTE_LESE_DB_URL") or DB_URL
+
+ENGINE = create_engine(DB_URL, echo=False, future=True)
+LESE_ENGINE = ENGINE if LESE_DB_URL == DB_URL else create_engine(LESE_DB_URL, echo=False, future=True)
 SessionLocal = sessionmaker(bind=ENGINE, autoflush=False, expire_on_commit=False, future=True)
+LeseSessionLocal = sessionmaker(bind=LESE_ENGINE, autoflush=False, expire_on_commit=False, future=True)
+
+def engines_verwerfen() -> None:
+    """Nach fork() in Worker-Prozessen: geerbte Pool-Verbindungen nicht weiterverwenden (neue Pools)."""
+    for e in {ENGINE, LESE_ENGINE}:
+        e.dispose(close=False)
+
+# Zuletzt gesehene Outbox-Position der Replika; steigt nur (die Replika spielt Commits in Reihenfolge ein)
+_REPLIKA_STAND: Dict[str, int] = {"position": 0}
+_REPLIKA_LOCK = threading.Lock()
+
+def replika_aktuell(position: int) -> bool:
+    """True, wenn die Lese-Replika die Outbox-Position ``position`` schon angewendet hat. Positionen werden in
+    Commit-Reihenfolge vergeben: ist p auf der Replika sichtbar, sind es alle Commits davor auch."""
+    if LESE_ENGINE is ENGINE or position <= _REPLIKA_STAND["position"]:
+        return True
+    with LeseSessionLocal() as s:
+        stand = letzte_ereignis_position(s)
+    with _REPLIKA_LOCK:
+        _REPLIKA_STAND["position"] = max(_REPLIKA_STAND["position"], stand)
+    return stand >= position
+
+def lese_session(primaer: bool = False, position: Optional[int] = None) -> Session:
+    """Session fuer reine Lesezugriffe. Primaer bei primaer=True oder solange die Replika das Konsistenz-Token
+    ``position`` (Outbox-Position des letzten eigenen Schreibzugriffs) noch nicht erreicht hat."""
+    if primaer or (position and not replika_aktuell(position)):
+        return SessionLocal()
+    return LeseSessionLocal()
+
+# Konsistenz-Token: der Aufrufer setzt eine Liste, jeder Commit im Kontext haengt seine hoechste Outbox-Position an
+commit_positionen: ContextVar[Optional[List[int]]] = ContextVar("commit_positionen", default=None)
 # ========================================
 
 class Base(DeclarativeBase):
     pass
 
+class BuchungsKonflikt(ValueError):
+    """Zeitraum ist belegt oder wurde parallel gebucht (API: 409)."""
+
 # -------------------- Enums --------------------
 
 class GeraetStatus(str, Enum):
@@ -64,12 +111,16 @@ class Firma(Base):
     name: Mapped[str] = mapped_column(String(160), nullable=False)
     land: Mapped[Optional[str]] = mapped_column(String(2))
     geraete: Mapped[List["Geraet"]] = relationship(back_populates="eigentuemer")
+    aenderungs_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    __table_args__ = (Index("ix_firma_aenderung", "aenderungs_version"),)
 
 class Mietpark(Base):
     __tablename__ = "mietpark"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(160), nullable=False)
     adresse: Mapped[Optional[str]] = mapped_column(String(260))
+    aenderungs_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    __table_args__ = (Index("ix_mietpark_aenderung", "aenderungs_version"),)
 
 class Geraet(Base):
     __tablename__ = "geraet"
@@ -84,6 +135,10 @@ class Geraet(Base):
     stunden_pro_tag: Mapped[int] = mapped_column(Integer, default=8, nullable=False)
     kauf_datum: Mapped[Optional[date]] = mapped_column(Date)
     anschaffungspreis: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    # Optimistische Sperre fuer Buchungen: jede neue Vermietung erhoeht die Version (siehe vermietung_anlegen)
+    buchungs_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    # Delta-Sync (/sync): Outbox-ID der letzten Aenderung, gesetzt von den Schreib-Helpern (_stempeln)
+    aenderungs_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
 
     # Standortführung
     standort_typ: Mapped[StandortTyp] = mapped_column(SAEnum(StandortTyp), default=StandortTyp.MIETPARK, nullable=False)
@@ -95,6 +150,9 @@ class Geraet(Base):
     vermietungen: Mapped[List["Vermietung"]] = relationship(back_populates="geraet", cascade="all, delete-orphan")
     wartungen: Mapped[List["Wartung"]] = relationship(back_populates="geraet", cascade="all, delete-orphan")
     zaehlerstaende: Mapped[List["Zaehlerstand"]] = relationship(back_populates="geraet", cascade="all, delete-orphan")
+    __table_args__ = (Index("ix_geraet_aenderung", "aenderungs_version"),
+                      Index("ix_geraet_status", "status", "id"),   # Listenfilter in Keyset-Reihenfolge
+                      Index("ix_geraet_standort", "standort_typ", "id"))
 
 class Kunde(Base):
     __tablename__ = "kunde"
@@ -104,6 +162,8 @@ class Kunde(Base):
     telefon: Mapped[Optional[str]] = mapped_column(String(60))
     rechnungsadresse: Mapped[Optional[str]] = mapped_column(String(260))
     ust_id: Mapped[Optional[str]] = mapped_column(String(40))
+    aenderungs_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    __table_args__ = (Index("ix_kunde_aenderung", "aenderungs_version"),)
 
 class Baustelle(Base):
     __tablename__ = "baustelle"
@@ -113,6 +173,9 @@ class Baustelle(Base):
     adresse: Mapped[Optional[str]] = mapped_column(String(260))
     stadt: Mapped[Optional[str]] = mapped_column(String(120))
     land: Mapped[Optional[str]] = mapped_column(String(2))
+    aenderungs_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
+    __table_args__ = (Index("ix_baustelle_aenderung", "aenderungs_version"),
+                      Index("ix_baustelle_kunde", "kunde_id", "id"))
 
 class Vermietung(Base):
     __tablename__ = "vermietung"
@@ -141,6 +204,12 @@ class Vermietung(Base):
     __table_args__ = (
         CheckConstraint("(zaehler_ende IS NULL) OR (zaehler_start IS NULL) OR (zaehler_ende >= zaehler_start)",
                         name="ck_zaehler_nichtnegativ"),
+        Index("ix_vermietung_geraet_start", "geraet_id", "start_datum"),   # _ueberlappung
+        # (filter, start_datum, id): Listenfilter + Keyset-Reihenfolge der Vermietungsliste ohne Sortierschritt
+        Index("ix_vermietung_kunde_start", "kunde_id", "start_datum", "id"),
+        Index("ix_vermietung_status_start", "status", "start_datum", "id"),
+        Index("ix_vermietung_start_id", "start_datum", "id"),              # Auslastungsfenster, ungefilterte Liste
+        Index("ix_vermietung_ende", "end_datum"),
     )
 
 class VermietungPosition(Base):
@@ -154,6 +223,7 @@ class VermietungPosition(Base):
     preis_einzel: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)   # Einnahmen
     kosten_einzel: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)  # interne Kosten
     vermietung: Mapped[Vermietung] = relationship(back_populates="positionen")
+    __table_args__ = (Index("ix_position_vermietung", "vermietung_id"),)
 
 class Rechnung(Base):
     __tablename__ = "rechnung"
@@ -163,7 +233,10 @@ class Rechnung(Base):
     datum: Mapped[date] = mapped_column(Date, default=date.today, nullable=False)
     betrag_netto: Mapped[Optional[float]] = mapped_column(Float)
     bezahlt: Mapped[bool] = mapped_column(Integer, default=0)  # 0/1
-    __table_args__ = (UniqueConstraint("nummer", name="uq_rechnung_nummer"),)
+    __table_args__ = (UniqueConstraint("nummer", name="uq_rechnung_nummer"),
+                      # abdeckend fuer Kundenkonto (je Vermietung) bzw. offene Posten (flottenweit)
+                      Index("ix_rechnung_vermietung_konto", "vermietung_id", "bezahlt", "datum", "betrag_netto"),
+                      Index("ix_rechnung_offen", "bezahlt", "datum", "vermietung_id", "betrag_netto"))
     vermietung: Mapped[Vermietung] = relationship(back_populates="rechnungen")
 
 class Wartung(Base):
@@ -175,6 +248,7 @@ class Wartung(Base):
     grund: Mapped[Optional[str]] = mapped_column(String(160))
     notizen: Mapped[Optional[str]] = mapped_column(String(500))
     geraet: Mapped[Geraet] = relationship(back_populates="wartungen")
+    __table_args__ = (Index("ix_wartung_geraet", "geraet_id"),)
 
 class Zaehlerstand(Base):
     __tablename__ = "zaehlerstand"
@@ -184,19 +258,110 @@ class Zaehlerstand(Base):
     art: Mapped[ZaehlerArt] = mapped_column(SAEnum(ZaehlerArt), nullable=False, default=ZaehlerArt.PERIODISCH)
     stand: Mapped[float] = mapped_column(Float, nullable=False)
     geraet: Mapped[Geraet] = relationship(back_populates="zaehlerstaende")
+    __table_args__ = (Index("ix_zaehlerstand_geraet_zeit", "geraet_id", "zeitpunkt"),)
+
+class GeraetHistorie(Base):
+    """Gueltigkeitszeitliche Status-/Standort-Historie: eine Zeile je Uebergang, gilt ab ``gueltig_ab``
+    bis zur naechsten Zeile des Geraets (bei gleichem Tag gewinnt die hoehere id)."""
+    __tablename__ = "geraet_historie"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    geraet_id: Mapped[int] = mapped_column(ForeignKey("geraet.id", ondelete="CASCADE"), nullable=False)
+    gueltig_ab: Mapped[date] = mapped_column(Date, nullable=False)
+    status: Mapped[GeraetStatus] = mapped_column(SAEnum(GeraetStatus), nullable=False)
+    standort_typ: Mapped[StandortTyp] = mapped_column(SAEnum(StandortTyp), nullable=False)
+    akt_mietpark_id: Mapped[Optional[int]] = mapped_column(Integer)
+    akt_baustelle_id: Mapped[Optional[int]] = mapped_column(Integer)
+    __table_args__ = (Index("ix_geraet_historie_stichtag", "geraet_id", "gueltig_ab", "id"),)
+
+class AenderungEreignis(Base):
+    """Transaktionale Outbox: wird in derselben Transaktion wie die fachliche Aenderung geschrieben."""
+    __tablename__ = "aenderung_ereignis"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    zeitpunkt: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    typ: Mapped[str] = mapped_column(String(40), nullable=False)
+    entitaet: Mapped[str] = mapped_column(String(40), nullable=False)
+    entitaet_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    daten: Mapped[Optional[str]] = mapped_column(String(500))  # kompaktes JSON
+    # Resume-Offset (SSE, /sync, Caches): in Commit-Reihenfolge vergeben (_positionen_vergeben). Die ID taugt
+    # dafuer nicht: sie wird beim INSERT vergeben, und auf Postgres committet eine hoehere ID oft frueher.
+    position: Mapped[Optional[int]] = mapped_column(Integer)
+    __table_args__ = (Index("ux_aenderung_ereignis_position", "position", unique=True), {"sqlite_autoincrement": True})
+
+class EreignisPosition(Base):
+    """Einzeiliger Zaehler (id=1) fuer aenderung_ereignis.position."""
+    __tablename__ = "ereignis_position"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    wert: Mapped[int] = mapped_column(Integer, nullable=False)
+
+class ArchivStand(Base):
+    """Einzeilige Markierung im Arbeitsbestand: bis zu welchem end_datum Vermietungen im Archiv liegen."""
+    __tablename__ = "archiv_stand"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)  # immer 1
+    bis_datum: Mapped[Optional[date]] = mapped_column(Date)
+    aktualisiert_am: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+# -------------------- Archiv (kalte Tabellen im Primaer) --------------------
+
+class VermietungArchiv(Base):
+    """Kompakt: eine Zeile je geschlossener Vermietung, Positionen als vorberechnete Summen."""
+    __tablename__ = "vermietung_archiv"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)  # = vermietung.id
+    geraet_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    kunde_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    baustelle_id: Mapped[Optional[int]] = mapped_column(Integer)
+    start_datum: Mapped[date] = mapped_column(Date, nullable=False)
+    end_datum: Mapped[date] = mapped_column(Date, nullable=False)
+    stunden_ist: Mapped[Optional[float]] = mapped_column(Float)
+    satz_wert: Mapped[float] = mapped_column(Float, nullable=False)
+    satz_einheit: Mapped[SatzEinheit] = mapped_column(SAEnum(SatzEinheit), nullable=False)
+    miete: Mapped[float] = mapped_column(Float, nullable=False)
+    positionen_einnahmen: Mapped[float] = mapped_column(Float, nullable=False)
+    kosten_gesamt: Mapped[float] = mapped_column(Float, nullable=False)
+    archiviert_am: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    __table_args__ = (
+        Index("ix_vermietung_archiv_geraet_start", "geraet_id", "start_datum"),   # Ueberlappungspruefung
+        Index("ix_vermietung_archiv_kunde", "kunde_id"),
+        Index("ix_vermietung_archiv_zeitraum", "start_datum", "end_datum"),
+    )
+
+class RechnungArchiv(Base):
+    __tablename__ = "rechnung_archiv"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    vermietung_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    nummer: Mapped[str] = mapped_column(String(60), nullable=False)
+    datum: Mapped[date] = mapped_column(Date, nullable=False)
+    betrag_netto: Mapped[Optional[float]] = mapped_column(Float)
+    bezahlt: Mapped[bool] = mapped_column(Integer, default=1)
+    __table_args__ = (Index("ix_rechnung_archiv_vermietung", "vermietung_id"),
+                      Index("ux_rechnung_archiv_nummer", "nummer", unique=True))
+
+class ZaehlerstandArchiv(Base):
+    __tablename__ = "zaehlerstand_archiv"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    geraet_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    zeitpunkt: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    art: Mapped[ZaehlerArt] = mapped_column(SAEnum(ZaehlerArt), nullable=False)
+    stand: Mapped[float] = mapped_column(Float, nullable=False)
+    __table_args__ = (Index("ix_zaehlerstand_archiv_geraet_zeit", "geraet_id", "zeitpunkt"),)
 
 # -------------------- Setup --------------------
 
 def init_db() -> None:
-    Base.metadata.create_all(ENGINE)
+    """Bringt das Schema auf den neuesten Stand (Entwicklung/Demo; produktiv: python -m migrationen)."""
+    from migrationen import migrieren
+    migrieren(ENGINE)
 
 # -------------------- Helper & CRUD --------------------
 
 def mietpark_anlegen(s: Session, name: str, adresse: Optional[str] = None) -> Mietpark:
-    m = Mietpark(name=name, adresse=adresse); s.add(m); s.commit(); s.refresh(m); return m
+    m = Mietpark(name=name, adresse=adresse); s.add(m); s.flush()
+    _stempeln(s, _ereignis(s, "mietpark_angelegt", "mietpark", m.id, name=name), m)
+    s.commit(); s.refresh(m); return m
 
 def firma_anlegen(s: Session, name: str, land: Optional[str] = None) -> Firma:
-    f = Firma(name=name, land=land); s.add(f); s.commit(); s.refresh(f); return f
+    f = Firma(name=name, land=land); s.add(f); s.flush()
+    _stempeln(s, _ereignis(s, "firma_angelegt", "firma", f.id, name=name), f)
+    s.commit(); s.refresh(f); return f
 
 def geraet_anlegen(
     s: Session, name: str, kategorie: str, modell: Optional[str] = None, seriennummer: Optional[str] = None,
@@ -211,39 +376,267 @@ def geraet_anlegen(
         heim_mietpark_id=heim_mietpark_id, akt_mietpark_id=akt_mietpark_id or heim_mietpark_id,
         standort_typ=StandortTyp.MIETPARK, eigentuemer_firma_id=eigentuemer_firma_id
     )
-    s.add(g); s.commit(); s.refresh(g); return g
+    s.add(g); s.flush()
+    _historie(s, g, kauf_datum or date.min)
+    _stempeln(s, _ereignis(s, "geraet_angelegt", "geraet", g.id, kategorie=kategorie), g)
+    s.commit(); s.refresh(g); return g
 
 def kunde_anlegen(s: Session, name: str, email: Optional[str] = None, telefon: Optional[str] = None,
                   rechnungsadresse: Optional[str] = None, ust_id: Optional[str] = None) -> Kunde:
     k = Kunde(name=name, email=email, telefon=telefon, rechnungsadresse=rechnungsadresse, ust_id=ust_id)
-    s.add(k); s.commit(); s.refresh(k); return k
+    s.add(k); s.flush()
+    _stempeln(s, _ereignis(s, "kunde_angelegt", "kunde", k.id, name=name), k)
+    s.commit(); s.refresh(k); return k
 
 def baustelle_anlegen(s: Session, kunde_id: int, name: str, adresse: Optional[str] = None,
                       stadt: Optional[str] = None, land: Optional[str] = None) -> Baustelle:
     b = Baustelle(kunde_id=kunde_id, name=name, adresse=adresse, stadt=stadt, land=land)
-    s.add(b); s.commit(); s.refresh(b); return b
-
-def _ueberlappung(s: Session, geraet_id: int, start: date, ende: Optional[date]) -> bool:
-    v = Vermietung; e2 = ende or date.max
-    q = select(func.count(v.id)).where(
+    s.add(b); s.flush()
+    _stempeln(s, _ereignis(s, "baustelle_angelegt", "baustelle", b.id, kunde_id=kunde_id, name=name), b)
+    s.commit(); s.refresh(b); return b
+
+# ---- Outbox ----
+
+def _ereignis(s: Session, typ: str, entitaet: str, entitaet_id: int, **daten) -> AenderungEreignis:
+    """Haengt ein Aenderungsereignis an die laufende Transaktion an (kein eigener Commit)."""
+    e = AenderungEreignis(typ=typ, entitaet=entitaet, entitaet_id=entitaet_id,
+                          daten=json.dumps(daten, default=str, separators=(",", ":")))
+    s.add(e); s.info.setdefault("outbox", []).append(e); return e
+
+def _historie(s: Session, g: Geraet, gueltig_ab: date) -> None:
+    """Schreibt den aktuellen Status/Standort von ``g`` als neue Historienzeile (kein eigener Commit)."""
+    s.add(GeraetHistorie(geraet_id=g.id, gueltig_ab=gueltig_ab, status=g.status, standort_typ=g.standort_typ,
+                         akt_mietpark_id=g.akt_mietpark_id, akt_baustelle_id=g.akt_baustelle_id))
+
+def _stempeln(s: Session, e: AenderungEreignis, *objekte) -> None:
+    """Setzt aenderungs_version der geaenderten Stammdaten beim Commit auf die Position ihres Outbox-Ereignisses."""
+    s.info.setdefault("gestempelt", []).extend((e, o) for o in objekte)
+
+@event.listens_for(Session, "before_commit")
+def _positionen_vergeben(s: Session) -> None:
+    """Vergibt die Positionen der Outbox-Ereignisse dieser Transaktion erst unmittelbar vor dem Commit. Die
+    Zeilensperre auf dem Zaehler haelt bis zum Commit, parallele Schreiber warten dort: eine sichtbare
+    Position p heisst, alle Positionen < p sind bereits committet. Leser koennen ab p fortsetzen."""
+    neue = s.info.pop("outbox", None)
+    if not neue:
+        return
+    zaehler = EreignisPosition.__table__
+    bis = s.execute(update(zaehler).where(zaehler.c.id == 1)
+                    .values(wert=zaehler.c.wert + len(neue)).returning(zaehler.c.wert)).scalar_one()
+    for pos, e in enumerate(neue, bis - len(neue) + 1):
+        e.position = pos
+    for e, o in s.info.pop("gestempelt", ()):
+        o.aenderungs_version = e.position
+    s.info["commit_position"] = bis
+
+@event.listens_for(Session, "after_commit")
+def _position_melden(s: Session) -> None:
+    position, merker = s.info.pop("commit_position", None), commit_positionen.get()
+    if position is not None and merker is not None:
+        merker.append(position)
+
+@event.listens_for(Session, "after_transaction_end")
+def _outbox_verwerfen(s: Session, transaktion) -> None:
+    if transaktion.parent is None:   # Rollback/close: Ereignisse der verworfenen Transaktion vergessen
+        s.info.pop("outbox", None); s.info.pop("gestempelt", None); s.info.pop("commit_position", None)
+
+def ereignisse_seit(s: Session, seit: int, limit: int = 500) -> List[AenderungEreignis]:
+    """Committete Ereignisse nach Position ``seit``, in Commit-Reihenfolge."""
+    e = AenderungEreignis
+    return list(s.scalars(select(e).where(e.position > seit).order_by(e.position).limit(limit)))
+
+def letzte_ereignis_position(s: Session) -> int:
+    return s.scalar(select(func.max(AenderungEreignis.position))) or 0
+
+# ---- Delta-Sync der Stammdaten ----
+
+SYNC_TABELLEN: Dict[str, Tuple[type, Tuple[str, ...]]] = {
+    "mietparks": (Mietpark, ("id", "name", "adresse")),
+    "firmen": (Firma, ("id", "name", "land")),
+    "kunden": (Kunde, ("id", "name", "email", "telefon", "rechnungsadresse", "ust_id")),
+    "baustellen": (Baustelle, ("id", "kunde_id", "name", "adresse", "stadt", "land")),
+    "geraete": (Geraet, ("id", "name", "kategorie", "modell", "seriennummer", "status", "stundenzaehler",
+                         "stunden_pro_tag", "kauf_datum", "anschaffungspreis", "standort_typ", "heim_mietpark_id",
+                         "akt_mietpark_id", "akt_baustelle_id", "eigentuemer_firma_id")),
+}
+
+def stammdaten_seit(s: Session, seit: int = 0) -> Dict[str, object]:
+    """Spaltenorientierter Schnappschuss (seit <= 0 bzw. unbekannte Version) oder nur die seit ``seit``
+    geaenderten Zeilen je Tabelle. ``version`` ist die hoechste committete Outbox-Position und wird vor dem
+    Lesen ermittelt; aenderungs_version traegt die Position der Aenderung. Positionen werden in
+    Commit-Reihenfolge vergeben, eine spaeter committete Aenderung liegt also immer ueber ``version`` und
+    kommt beim naechsten Abgleich (schlimmstenfalls doppelt, nie verloren). Geloeschte IDs stammen aus
+    ``*_geloescht``-Ereignissen der Outbox (derzeit gibt es keine Loeschpfade)."""
+    version = letzte_ereignis_position(s)
+    voll = seit <= 0 or seit > version
+    geloescht: Dict[str, List[int]] = {}
+    if not voll:
+        e = AenderungEreignis
+        for entitaet, eid in s.execute(select(e.entitaet, e.entitaet_id).where(e.position > seit, e.typ.like("%_geloescht"))):
+            geloescht.setdefault(entitaet, []).append(eid)
+    tabellen: Dict[str, Dict[str, object]] = {}
+    for name, (modell, spalten) in SYNC_TABELLEN.items():
+        q = select(*[getattr(modell, sp) for sp in spalten]).order_by(modell.id)
+        if not voll:
+            q = q.where(modell.aenderungs_version > seit)
+        tabellen[name] = {"spalten": list(spalten), "zeilen": [list(z) for z in s.execute(q)],
+                          "geloescht": geloescht.get(modell.__tablename__, [])}
+    return {"version": version, "voll": voll, "tabellen": tabellen}
+
+# ---- Stammsatz-Cache (prozessweit, read-through) ----
+
+STAMMSATZ_CACHE_MAX = int(os.environ.get("FLOTTE_STAMMSATZ_CACHE_MAX", "20000"))
+STAMMSATZ_ABGLEICH_S = float(os.environ.get("FLOTTE_STAMMSATZ_ABGLEICH_S", "1.0"))
+# Obergrenze fuer Aenderungen ohne Outbox-Ereignis (z.B. manuelles SQL): danach wird neu gelesen
+STAMMSATZ_TTL_S = float(os.environ.get("FLOTTE_STAMMSATZ_TTL_S", "300"))
+
+# Saetze sind namedtuples (tuple-basiert, __slots__ = ()) mit den Spalten aus SYNC_TABELLEN: unveraenderlich,
+# ohne Session/Identity-Map zwischen Threads teilbar und deutlich kleiner als ORM-Objekte
+_STAMMSATZ_TYPEN: Dict[type, Tuple[str, type]] = {
+    modell: (modell.__tablename__, namedtuple(f"{modell.__name__}Satz", spalten))
+    for modell, spalten in (SYNC_TABELLEN[n] for n in ("geraete", "kunden", "mietparks", "baustellen"))
+}
+# (tabelle, id) -> (Satz, eingelagert um time.monotonic()), LRU-Reihenfolge
+_STAMMSATZ_CACHE: "OrderedDict[Tuple[str, int], Tuple[tuple, float]]" = OrderedDict()
+_STAMMSATZ_STAND: Dict[str, object] = {"epoche": 0, "position": None, "abgleich": 0.0, "treffer": 0,
+                                       "fehlgriffe": 0, "verdraengt": 0, "verworfen": 0, "abgelaufen": 0}
+_STAMMSATZ_LOCK = threading.Lock()
+
+def _stammsatz_verwerfen(*schluessel: Tuple[str, int]) -> None:
+    """Erst nach dem Commit aufrufen, sonst lagert ein paralleler Leser den alten Stand gleich wieder ein.
+    Die Epoche verhindert, dass ein Fehlgriff, der vor dem Verwerfen gelesen hat, danach noch einlagert."""
+    with _STAMMSATZ_LOCK:
+        _STAMMSATZ_STAND["epoche"] += 1
+        for k in schluessel:
+            if _STAMMSATZ_CACHE.pop(k, None) is not None:
+                _STAMMSATZ_STAND["verworfen"] += 1
+
+def _stammsatz_abgleichen(s: Session, erzwingen: bool = False) -> None:
+    """Schreibzugriffe anderer Prozesse (weitere Worker, nachtlauf) ueber die Outbox nachziehen,
+    hoechstens alle STAMMSATZ_ABGLEICH_S Sekunden (``erzwingen``: sofort); eigene Schreibzugriffe verwerfen
+    sofort. Die Marke ist die Outbox-Position (Commit-Reihenfolge): ein spaeter committetes Ereignis liegt
+    immer darueber."""
+    with _STAMMSATZ_LOCK:
+        jetzt = time.monotonic()
+        if not erzwingen and jetzt - _STAMMSATZ_STAND["abgleich"] < STAMMSATZ_ABGLEICH_S:
+            return
+        _STAMMSATZ_STAND["abgleich"] = jetzt   # nur ein Thread gleicht ab
+        seit = _STAMMSATZ_STAND["position"]
+    if seit is None:   # erster Abgleich: ab hier kommt alles ueber die Outbox, vorher Eingelagertes verwerfen
+        marke = letzte_ereignis_position(s)
+        with _STAMMSATZ_LOCK:
+            _STAMMSATZ_CACHE.clear()
+            _STAMMSATZ_STAND.update(position=marke, epoche=_STAMMSATZ_STAND["epoche"] + 1)
+        return
+    while True:
+        neue = ereignisse_seit(s, seit, limit=1000)
+        if not neue: break
+        betroffen = {(e.entitaet, e.entitaet_id) for e in neue}
+        betroffen |= {("geraet", gid) for e in neue if e.entitaet == "vermietung"
+                      for gid in [json.loads(e.daten or "{}").get("geraet_id")] if gid}
+        _stammsatz_verwerfen(*betroffen)
+        seit = neue[-1].position
+        with _STAMMSATZ_LOCK:   # erzwungene Abgleiche laufen parallel: die Marke steigt nur
+            _STAMMSATZ_STAND["position"] = max(_STAMMSATZ_STAND["position"] or 0, seit)
+
+def stammsatz(s: Session, modell: type, id: int, position: Optional[int] = None, frisch: bool = False) -> Optional[tuple]:
+    """Geraet/Kunde/Mietpark/Baustelle als unveraenderlicher Satz aus dem Prozess-Cache, bei Fehlgriff per
+    Primaerschluessel ueber ``s`` gelesen (None, falls unbekannt). ``s`` sollte auf den Primaer zeigen,
+    sonst kann ein verzoegerter Replika-Stand im Cache landen. Nur fuer Anzeigen: Schreibpfade entscheiden
+    nie anhand eines Cache-Satzes, sondern lesen selbst aus der DB.
+
+    Read-your-writes ueber Prozessgrenzen: liegt ``position`` (Konsistenz-Token des Clients) ueber dem
+    abgeglichenen Outbox-Stand des Caches, wird sofort abgeglichen statt erst nach STAMMSATZ_ABGLEICH_S;
+    ``frisch`` liest am Cache vorbei (und lagert das Ergebnis ein)."""
+    tabelle, typ = _STAMMSATZ_TYPEN[modell]
+    erzwingen = position is not None and position > (_STAMMSATZ_STAND["position"] or 0)
+    _stammsatz_abgleichen(s, erzwingen)
+    k = (tabelle, id)
+    with _STAMMSATZ_LOCK:
+        eintrag = None if frisch else _STAMMSATZ_CACHE.get(k)
+        if eintrag is not None:
+            if time.monotonic() - eintrag[1] <= STAMMSATZ_TTL_S:
+                _STAMMSATZ_CACHE.move_to_end(k)
+                _STAMMSATZ_STAND["treffer"] += 1
+                return eintrag[0]
+            del _STAMMSATZ_CACHE[k]
+            _STAMMSATZ_STAND["abgelaufen"] += 1
+        _STAMMSATZ_STAND["fehlgriffe"] += 1
+        epoche = _STAMMSATZ_STAND["epoche"]
+    zeile = s.execute(select(*[getattr(modell, sp) for sp in typ._fields]).where(modell.id == id)).first()
+    if zeile is None:
+        return None
+    satz = typ(*zeile)
+    with _STAMMSATZ_LOCK:
+        if _STAMMSATZ_STAND["epoche"] == epoche:
+            _STAMMSATZ_CACHE[k] = (satz, time.monotonic())
+            if len(_STAMMSATZ_CACHE) > STAMMSATZ_CACHE_MAX:
+                _STAMMSATZ_CACHE.popitem(last=False)
+                _STAMMSATZ_STAND["verdraengt"] += 1
+    return satz
+
+def stammsatz_statistik() -> Dict[str, object]:
+    with _STAMMSATZ_LOCK:
+        st = dict(_STAMMSATZ_STAND, eintraege=len(_STAMMSATZ_CACHE))
+    zugriffe = st["treffer"] + st["fehlgriffe"]
+    return {"eintraege": st["eintraege"], "max": STAMMSATZ_CACHE_MAX, "treffer": st["treffer"],
+            "fehlgriffe": st["fehlgriffe"], "trefferquote": round(st["treffer"] / zugriffe, 4) if zugriffe else None,
+            "verdraengt": st["verdraengt"], "verworfen": st["verworfen"], "abgelaufen": st["abgelaufen"],
+            "ttl_s": STAMMSATZ_TTL_S}
+
+def _ueberlappung(s: Session, geraet_id: int, start: date, ende: Optional[date], ohne_id: Optional[int] = None) -> bool:
+    v, va = Vermietung, VermietungArchiv; e2 = ende or date.max
+    heiss = select(v.id).where(
         v.geraet_id == geraet_id,
         v.status.in_([VermietStatus.RESERVIERT, VermietStatus.OFFEN, VermietStatus.GESCHLOSSEN]),
-        v.start_datum <= e2, or_(v.end_datum == None, v.end_datum >= start)
-    )
-    return (s.scalar(q) or 0) > 0
+        v.start_datum <= e2, or_(v.end_datum == None, v.end_datum >= start),
+        *([v.id != ohne_id] if ohne_id is not None else [])
+    ).exists()
+    # archivierte Vermietungen sind geschlossen und belegen ihren Zeitraum weiterhin
+    kalt = select(va.id).where(va.geraet_id == geraet_id, va.start_datum <= e2, va.end_datum >= start).exists()
+    return bool(s.scalar(select(or_(heiss, kalt))))
+
+NICHT_BUCHBAR = (GeraetStatus.AUSGEMUSTERT, GeraetStatus.WARTUNG)
+
+def _buchung_sichern(s: Session, geraet_id: int, version: int, buchbar: bool = True,
+                     vermietung: Optional[Vermietung] = None) -> None:
+    """Pruefen & Schreiben sind zwei Schritte: nur wer die vor der Ueberlappungspruefung gelesene buchungs_version
+    hochzaehlt, darf den Belegungszustand des Geraets aendern. Eine parallele Buchung findet 0 Zeilen (Postgres:
+    wartet auf die Zeilensperre, SQLite: auf den Schreib-Lock) -> Konflikt statt Doppelbuchung. Mit ``vermietung``
+    muss deren gelesener Status noch gelten (sie kann vor der Version geladen worden sein)."""
+    bedingungen = [Geraet.id == geraet_id, Geraet.buchungs_version == version]
+    if buchbar: bedingungen.append(Geraet.status.notin_(NICHT_BUCHBAR))
+    if vermietung is not None:
+        bedingungen.append(select(Vermietung.id).where(
+            Vermietung.id == vermietung.id, Vermietung.status == vermietung.status).exists())
+    n = s.execute(update(Geraet).where(*bedingungen).values(buchungs_version=version + 1)).rowcount
+    if n != 1:
+        aktuell = s.scalar(select(Geraet.status).where(Geraet.id == geraet_id))
+        if buchbar and aktuell in NICHT_BUCHBAR: raise ValueError(f"Status {aktuell}: Vermietung unmoeglich")
+        raise BuchungsKonflikt("Geraet wurde parallel gebucht, bitte erneut versuchen")
+
+def _zeitraum_konflikt(s: Session, ex: IntegrityError) -> None:
+    """Postgres meldet Ueberlappungen (Exclusion-Constraint) erst bei flush/commit: als Buchungskonflikt melden."""
+    s.rollback()
+    if "ex_vermietung_zeitraum" in str(ex.orig):
+        raise BuchungsKonflikt("Ueberlappende Reservierung/Vermietung vorhanden") from ex
+    raise ex
 
 def vermietung_anlegen(
     s: Session, geraet_id: int, kunde_id: int, start_datum: date, end_datum: Optional[date],
     satz_wert: float, satz_einheit: SatzEinheit = SatzEinheit.TAEGLICH, zaehler_start: Optional[float] = None,
     baustelle_id: Optional[int] = None, notizen: Optional[str] = None, status: VermietStatus = VermietStatus.OFFEN
 ) -> Vermietung:
-    g = s.get(Geraet, geraet_id)
-    if not g: raise ValueError("Geraet nicht gefunden")
-    if g.status in (GeraetStatus.AUSGEMUSTERT, GeraetStatus.WARTUNG):
-        raise ValueError(f"Status {g.status}: Vermietung unmoeglich")
+    # Geraetezustand immer aus der DB (nie aus dem Stammsatz-Cache): Status & Version in einem Zugriff
+    gs = s.execute(select(Geraet.status, Geraet.buchungs_version).where(Geraet.id == geraet_id)).first()
+    if not gs: raise ValueError("Geraet nicht gefunden")
+    if gs.status in NICHT_BUCHBAR:
+        raise ValueError(f"Status {gs.status}: Vermietung unmoeglich")
     if _ueberlappung(s, geraet_id, start_datum, end_datum):
-        raise ValueError("Ueberlappende Reservierung/Vermietung vorhanden")
+        raise BuchungsKonflikt("Ueberlappende Reservierung/Vermietung vorhanden")
+    _buchung_sichern(s, geraet_id, gs.buchungs_version)
 
+    g = None if status == VermietStatus.RESERVIERT else s.get(Geraet, geraet_id)   # Reservierung aendert das Geraet nicht
     v = Vermietung(
         geraet_id=geraet_id, kunde_id=kunde_id, baustelle_id=baustelle_id,
         start_datum=start_datum, end_datum=end_datum,
@@ -258,17 +651,33 @@ def vermietung_anlegen(
         g.standort_typ = StandortTyp.KUNDE
         g.akt_baustelle_id = baustelle_id
         s.add(Zaehlerstand(geraet_id=geraet_id, art=ZaehlerArt.ABGABE, stand=v.zaehler_start or g.stundenzaehler))
+        _historie(s, g, start_datum)
 
-    s.commit(); s.refresh(v); return v
+    try:
+        s.flush()
+        e = _ereignis(s, "vermietung_angelegt", "vermietung", v.id, geraet_id=geraet_id, kunde_id=kunde_id,
+                      status=v.status, geraet_status=g.status if g else gs.status, start=start_datum, ende=end_datum)
+        if status == VermietStatus.OFFEN:
+            _stempeln(s, e, g)
+        s.commit()
+    except IntegrityError as ex:
+        _zeitraum_konflikt(s, ex)
+    if status == VermietStatus.OFFEN:
+        _stammsatz_verwerfen(("geraet", geraet_id))
+    s.refresh(v); return v
 
-def reservierung_starten(
-    s: Session, vermietung_id: int, start_datum: date, zaehler_start: Optional[float] = None, baustelle_id: Optional[int] = None
-) -> Vermietung:
-    v = s.get(Vermietung, vermietung_id)
-    if not v: raise ValueError("Vermietung/Reservierung nicht gefunden")
+def _starten_anwenden(s: Session, v: Vermietung, start_datum: date, zaehler_start: Optional[float] = None,
+                      baustelle_id: Optional[int] = None) -> None:
+    """Reservierung -> OFFEN (ohne Commit); gemeinsam fuer Einzel- und Bulk-Start. Prueft und sichert die
+    Buchung vor der ersten Aenderung, damit ein abgelehnter Bulk-Posten nichts in der Session hinterlaesst."""
     if v.status != VermietStatus.RESERVIERT:
         raise ValueError("Nur Reservierungen koennen gestartet werden")
     g = v.geraet
+    if v.end_datum is not None and start_datum > v.end_datum: raise ValueError("start_datum nach end_datum")
+    version = g.buchungs_version
+    if start_datum < v.start_datum and _ueberlappung(s, g.id, start_datum, v.end_datum, ohne_id=v.id):
+        raise BuchungsKonflikt("Ueberlappende Reservierung/Vermietung vorhanden")
+    _buchung_sichern(s, g.id, version, vermietung=v)
     v.start_datum = start_datum
     v.status = VermietStatus.OFFEN
     v.baustelle_id = baustelle_id if baustelle_id is not None else v.baustelle_id
@@ -278,48 +687,134 @@ def reservierung_starten(
     g.standort_typ = StandortTyp.KUNDE
     g.akt_baustelle_id = v.baustelle_id
     s.add(Zaehlerstand(geraet_id=g.id, art=ZaehlerArt.ABGABE, stand=v.zaehler_start or g.stundenzaehler))
-    s.commit(); s.refresh(v); return v
+    _historie(s, g, start_datum)
+    _stempeln(s, _ereignis(s, "vermietung_gestartet", "vermietung", v.id, geraet_id=g.id, status=v.status,
+                           geraet_status=g.status, start=start_datum, baustelle_id=v.baustelle_id), g)
 
-def vermietung_schliessen(
-    s: Session, vermietung_id: int, end_datum: date, zaehler_ende: Optional[float] = None,
-    stunden_ist: Optional[float] = None, rueckgabe_mietpark_id: Optional[int] = None
+def reservierung_starten(
+    s: Session, vermietung_id: int, start_datum: date, zaehler_start: Optional[float] = None, baustelle_id: Optional[int] = None
 ) -> Vermietung:
     v = s.get(Vermietung, vermietung_id)
-    if not v: raise ValueError("Vermietung nicht gefunden")
+    if not v: raise ValueError("Vermietung/Reservierung nicht gefunden")
+    try:
+        _starten_anwenden(s, v, start_datum, zaehler_start, baustelle_id)
+        s.commit()
+    except IntegrityError as ex:
+        _zeitraum_konflikt(s, ex)
+    _stammsatz_verwerfen(("geraet", v.geraet_id))
+    s.refresh(v); return v
+
+def _schliessen_anwenden(s: Session, v: Vermietung, end_datum: date, zaehler_ende: Optional[float] = None,
+                         stunden_ist: Optional[float] = None, rueckgabe_mietpark_id: Optional[int] = None) -> None:
+    """OFFEN -> GESCHLOSSEN (ohne Commit). Prueft alles vor der ersten Aenderung, damit ein
+    fehlerhafter Bulk-Posten keine halb geschlossene Vermietung in der Session hinterlaesst."""
     if v.status not in (VermietStatus.OFFEN,): raise ValueError("Nur OFFENE Vermietungen koennen geschlossen werden")
     if end_datum < v.start_datum: raise ValueError("end_datum vor start_datum")
-    v.end_datum = end_datum
-
     if zaehler_ende is not None:
         if v.zaehler_start is None: raise ValueError("zaehler_start fehlt")
         if zaehler_ende < v.zaehler_start: raise ValueError("zaehler_ende < zaehler_start")
-        v.zaehler_ende = zaehler_ende
-        v.stunden_ist = round(zaehler_ende - v.zaehler_start, 2)
-        g = v.geraet; g.stundenzaehler = zaehler_ende
-        s.add(Zaehlerstand(geraet_id=g.id, art=ZaehlerArt.RUECKNAHME, stand=zaehler_ende))
     elif stunden_ist is not None:
         if stunden_ist < 0: raise ValueError("stunden_ist negativ")
-        v.stunden_ist = float(stunden_ist)
     else:
         raise ValueError("zaehler_ende ODER stunden_ist angeben")
 
+    g = v.geraet
+    version = g.buchungs_version
+    ende_vorher = v.end_datum   # bisheriges Ende der aufgelaufenen Miete (offen: bis heute), fuer den Wuerfel-Cache
+    # Rueckgabe nach dem geplanten Ende belegt zusaetzliche Tage
+    if (v.end_datum is not None and end_datum > v.end_datum
+            and _ueberlappung(s, g.id, v.start_datum, end_datum, ohne_id=v.id)):
+        raise BuchungsKonflikt("Rueckgabe ueberschneidet eine folgende Reservierung/Vermietung")
+    _buchung_sichern(s, g.id, version, buchbar=False, vermietung=v)   # Rueckgabe auch bei zwischenzeitlich ausgemustertem Geraet
+    v.end_datum = end_datum
+    if zaehler_ende is not None:
+        v.zaehler_ende = zaehler_ende
+        v.stunden_ist = round(zaehler_ende - v.zaehler_start, 2)
+        g.stundenzaehler = zaehler_ende
+        s.add(Zaehlerstand(geraet_id=g.id, art=ZaehlerArt.RUECKNAHME, stand=zaehler_ende))
+    else:
+        v.stunden_ist = float(stunden_ist)
+
     v.status = VermietStatus.GESCHLOSSEN
 
     # Standort zurück in den Mietpark
-    g = v.geraet
     g.status = GeraetStatus.VERFUEGBAR
     g.standort_typ = StandortTyp.MIETPARK
     g.akt_baustelle_id = None
     g.akt_mietpark_id = rueckgabe_mietpark_id or g.heim_mietpark_id
+    _historie(s, g, end_datum + timedelta(days=1))   # end_datum ist der letzte Miettag
 
-    s.commit(); s.refresh(v); return v
+    _stempeln(s, _ereignis(s, "vermietung_geschlossen", "vermietung", v.id, geraet_id=g.id, status=v.status,
+                           geraet_status=g.status, start=v.start_datum, ende=end_datum, ende_vorher=ende_vorher,
+                           stunden_ist=v.stunden_ist, mietpark_id=g.akt_mietpark_id), g)
+
+def vermietung_schliessen(
+    s: Session, vermietung_id: int, end_datum: date, zaehler_ende: Optional[float] = None,
+    stunden_ist: Optional[float] = None, rueckgabe_mietpark_id: Optional[int] = None
+) -> Vermietung:
+    v = s.get(Vermietung, vermietung_id)
+    if not v: raise ValueError("Vermietung nicht gefunden")
+    try:
+        _schliessen_anwenden(s, v, end_datum, zaehler_ende, stunden_ist, rueckgabe_mietpark_id)
+        s.commit()
+    except IntegrityError as ex:
+        _zeitraum_konflikt(s, ex)
+    _stammsatz_verwerfen(("geraet", v.geraet_id))
+    s.refresh(v); return v
+
+# ---- Bulk (z.B. Baustellenende: 30-50 Maschinen am selben Tag) ----
+
+def _bulk_anwenden(s: Session, posten: List[Dict], anwenden) -> List[Dict[str, object]]:
+    ids = [p["vermietung_id"] for p in posten]
+    # Eine Abfrage fuer alle Vermietungen samt Geraeten, ein Commit am Ende
+    vs = {v.id: v for v in s.scalars(
+        select(Vermietung).where(Vermietung.id.in_(ids)).options(selectinload(Vermietung.geraet))
+    )}
+    # Savepoint je Posten: auf Postgres bricht eine Exclusion-Verletzung sonst den ganzen Batch ab. pysqlite
+    # wuerde mit RELEASE des ersten Savepoints bereits committen; SQLite hat den Constraint ohnehin nicht.
+    savepoints = s.get_bind().dialect.name != "sqlite"
+    ergebnisse: List[Dict[str, object]] = []
+    try:
+        for p in posten:
+            v = vs.get(p["vermietung_id"])
+            outbox, gestempelt = s.info.setdefault("outbox", []), s.info.setdefault("gestempelt", [])
+            stand = len(outbox), len(gestempelt)
+            try:   # Buchungskonflikte (ValueError) je Posten; die Pruefungen laufen vor jeder Aenderung
+                with s.begin_nested() if savepoints else nullcontext():
+                    if v is None: raise ValueError("Vermietung nicht gefunden")
+                    anwenden(v, p)
+                    s.flush()   # die Ueberlappungspruefung folgender Posten sieht diese Aenderung
+                ergebnisse.append({"vermietung_id": p["vermietung_id"], "ok": True, "fehler": None})
+            except (ValueError, IntegrityError) as ex:
+                if isinstance(ex, IntegrityError) and "ex_vermietung_zeitraum" not in str(ex.orig):
+                    raise
+                del outbox[stand[0]:], gestempelt[stand[1]:]   # Ereignisse des verworfenen Postens
+                fehler = "Ueberlappende Reservierung/Vermietung vorhanden" if isinstance(ex, IntegrityError) else str(ex)
+                ergebnisse.append({"vermietung_id": p["vermietung_id"], "ok": False, "fehler": fehler})
+        s.commit()
+    except IntegrityError as ex:
+        _zeitraum_konflikt(s, ex)
+    _stammsatz_verwerfen(*{("geraet", v.geraet_id) for v in vs.values()})
+    return ergebnisse
+
+def vermietungen_bulk_starten(s: Session, posten: List[Dict]) -> List[Dict[str, object]]:
+    """posten: dicts mit vermietung_id, start_datum, optional zaehler_start/baustelle_id. Fehler je Posten."""
+    return _bulk_anwenden(s, posten, lambda v, p: _starten_anwenden(
+        s, v, p["start_datum"], p.get("zaehler_start"), p.get("baustelle_id")))
+
+def vermietungen_bulk_schliessen(s: Session, posten: List[Dict]) -> List[Dict[str, object]]:
+    """posten: dicts mit vermietung_id, end_datum, zaehler_ende ODER stunden_ist, optional rueckgabe_mietpark_id."""
+    return _bulk_anwenden(s, posten, lambda v, p: _schliessen_anwenden(
+        s, v, p["end_datum"], p.get("zaehler_ende"), p.get("stunden_ist"), p.get("rueckgabe_mietpark_id")))
 
 def wartung_hinzufuegen(s: Session, geraet_id: int, start_datum: date, end_datum: date,
                         grund: Optional[str] = None, notizen: Optional[str] = None) -> Wartung:
     if end_datum < start_datum: raise ValueError("end_datum >= start_datum erforderlich")
     if not s.get(Geraet, geraet_id): raise ValueError("Geraet nicht gefunden")
     w = Wartung(geraet_id=geraet_id, start_datum=start_datum, end_datum=end_datum, grund=grund, notizen=notizen)
-    s.add(w); s.commit(); s.refresh(w); return w
+    s.add(w); s.flush()
+    _ereignis(s, "wartung_angelegt", "wartung", w.id, geraet_id=geraet_id, start=start_datum, ende=end_datum)
+    s.commit(); s.refresh(w); return w
 
 # ---- Positionen & Rechnungen ----
 
@@ -331,7 +826,9 @@ def position_hinzufuegen(
     if not v: raise ValueError("Vermietung nicht gefunden")
     p = VermietungPosition(vermietung_id=vermietung_id, typ=typ, text=text, menge=menge,
                            einheit=einheit, preis_einzel=preis_einzel, kosten_einzel=kosten_einzel)
-    s.add(p); s.commit(); s.refresh(p); return p
+    s.add(p); s.flush()
+    _ereignis(s, "position_angelegt", "position", p.id, vermietung_id=vermietung_id, pos_typ=typ)
+    s.commit(); s.refresh(p); return p
 
 def rechnung_hinzufuegen(
     s: Session, vermietung_id: int, nummer: str, datum: Optional[date] = None,
@@ -341,8 +838,16 @@ def rechnung_hinzufuegen(
                  betrag_netto=betrag_netto, bezahlt=1 if bezahlt else 0)
     s.add(r)
     try:
-        s.commit()
+        s.flush()   # belegt die Nummer in uq_rechnung_nummer bis zum Commit
+        # archivierte Rechnungen liegen ausserhalb von uq_rechnung_nummer
+        doppelt = s.scalar(select(RechnungArchiv.id).where(RechnungArchiv.nummer == nummer)) is not None
+        if not doppelt:
+            _ereignis(s, "rechnung_angelegt", "rechnung", r.id, vermietung_id=vermietung_id, nummer=nummer,
+                      betrag_netto=betrag_netto, bezahlt=bool(bezahlt))
+            s.commit()
     except IntegrityError:
+        doppelt = True
+    if doppelt:
         s.rollback()
         raise ValueError(f"Rechnungsnummer '{nummer}' existiert bereits.")
     s.refresh(r); return r
@@ -373,21 +878,41 @@ def _add_monat_mit_anker(d: date, anchor_day: int, n: int = 1) -> date:
     return date(y, m, day)
 
 def betrag_rollierender_monat(satz_wert: float, start: date, ende: date) -> float:
-    if ende < start: return 0.0
+    return round(_rollierend_summe(satz_wert, start, ende), 2)
+
+def _rollierend_summe(satz_wert: float, start: date, ende: date) -> float:
+    return _rollierend_segment(satz_wert, start, start, ende)
+
+def _zyklus_start(start: date, d: date) -> date:
+    """Beginn des Abrechnungszyklus (Anker = start.day), in dem ``d`` liegt, ohne die Zyklen davor abzulaufen."""
+    n = (d.year - start.year) * 12 + d.month - start.month
+    z = _add_monat_mit_anker(start, start.day, n)
+    return z if z <= d else _add_monat_mit_anker(start, start.day, n - 1)
+
+def _zyklus_stuecke(start: date, seg_start: date, seg_ende: date) -> Iterator[Tuple[date, date, int]]:
+    """Teilt [seg_start, seg_ende] an den Zyklusgrenzen (Anker = start.day): (von, bis, Tage im Zyklus).
+    Aufwand nur fuer die beruehrten Zyklen, nicht fuer die seit ``start``."""
+    if seg_ende < seg_start: return
     anchor_day = start.day
-    gesamt = 0.0
-    zyklus_start = start
-    while zyklus_start <= ende:
+    zyklus_start = _zyklus_start(start, max(start, seg_start))
+    while zyklus_start <= seg_ende:
         naechster_zyklus_start = _add_monat_mit_anker(zyklus_start, anchor_day, 1)
         zyklus_ende = naechster_zyklus_start - timedelta(days=1)
-        seg_start = max(start, zyklus_start)
-        seg_ende = min(ende, zyklus_ende)
-        if seg_ende >= seg_start:
-            tage_im_zyklus = (zyklus_ende - zyklus_start).days + 1
-            genutzt = (seg_ende - seg_start).days + 1
-            gesamt += satz_wert * (genutzt / tage_im_zyklus)
+        von = max(seg_start, zyklus_start)
+        bis = min(seg_ende, zyklus_ende)
+        if bis >= von:
+            yield von, bis, (zyklus_ende - zyklus_start).days + 1
         zyklus_start = naechster_zyklus_start
-    return round(gesamt, 2)
+
+def _rollierend_segment(satz_wert: float, start: date, seg_start: date, seg_ende: date) -> float:
+    return sum(satz_wert * (((bis - von).days + 1) / tage) for von, bis, tage in _zyklus_stuecke(start, seg_start, seg_ende))
+
+def _miete_segment(satz_wert: float, einheit: SatzEinheit, start: date, seg_start: date, seg_ende: date) -> float:
+    """Ungerundete Miete fuer [seg_start, seg_ende] einer Vermietung ab ``start`` (Anker bleibt der Starttag).
+    Kosten proportional zur Segmentlaenge, nicht zum Alter der Vermietung (Berichte zerlegen in viele Perioden)."""
+    if seg_ende < seg_start: return 0.0
+    if einheit == SatzEinheit.TAEGLICH: return satz_wert * _tage_in_klammer(seg_start, seg_ende)
+    return _rollierend_segment(satz_wert, start, seg_start, seg_ende)
 
 def miete_betrag(v: Vermietung, kalendermonat_proration: bool = False) -> float:
     if v.end_datum is None: raise ValueError("Vermietung noch offen")
@@ -395,13 +920,8 @@ def miete_betrag(v: Vermietung, kalendermonat_proration: bool = False) -> float:
         return betrag_30_tage_monat(v.satz_wert, v.satz_einheit, v.start_datum, v.end_datum)
     return betrag_rollierender_monat(v.satz_wert, v.start_datum, v.end_datum)
 
-def vermietung_abrechnung(s: Session, vermietung_id: int) -> Dict[str, float]:
-    v = s.get(Vermietung, vermietung_id)
-    if not v or v.end_datum is None: raise ValueError("Vermietung nicht gefunden oder offen")
-    miete = miete_betrag(v)
-    pos_summe = sum(p.preis_einzel * p.menge for p in v.positionen)
+def _abrechnung(miete: float, pos_summe: float, kosten: float) -> Dict[str, float]:
     einnahmen = miete + pos_summe
-    kosten = sum(p.kosten_einzel * p.menge for p in v.positionen)
     marge = einnahmen - kosten
     return {
         "miete": round(miete, 2),
@@ -411,15 +931,39 @@ def vermietung_abrechnung(s: Session, vermietung_id: int) -> Dict[str, float]:
         "marge": round(marge, 2)
     }
 
+def _abrechnung_vermietung(v: Vermietung) -> Dict[str, float]:
+    return _abrechnung(miete_betrag(v), sum(p.preis_einzel * p.menge for p in v.positionen),
+                       sum(p.kosten_einzel * p.menge for p in v.positionen))
+
+def vermietung_abrechnung(s: Session, vermietung_id: int) -> Dict[str, float]:
+    v = s.get(Vermietung, vermietung_id)
+    if v is None:
+        va = s.get(VermietungArchiv, vermietung_id)
+        if va is not None:
+            return _abrechnung(va.miete, va.positionen_einnahmen, va.kosten_gesamt)
+    if not v or v.end_datum is None: raise ValueError("Vermietung nicht gefunden oder offen")
+    return _abrechnung_vermietung(v)
+
 def geraet_finanz_uebersicht(s: Session, geraet_id: int) -> Dict[str, float]:
     g = s.get(Geraet, geraet_id)
     if not g: raise ValueError("Geraet nicht gefunden")
-    verm: Iterable[Vermietung] = s.scalars(select(Vermietung).where(Vermietung.geraet_id == g.id, Vermietung.status == VermietStatus.GESCHLOSSEN))
+    verm: Iterable[Vermietung] = s.scalars(
+        select(Vermietung).where(Vermietung.geraet_id == g.id, Vermietung.status == VermietStatus.GESCHLOSSEN)
+        .options(selectinload(Vermietung.positionen))
+    )
     sum_einnahmen = 0.0; sum_kosten = 0.0
     for v in verm:
-        abr = vermietung_abrechnung(s, v.id)
+        abr = _abrechnung_vermietung(v)
         sum_einnahmen += abr["einnahmen_gesamt"]
         sum_kosten += abr["kosten_gesamt"]
+    if _archiv_bis(s) is not None:
+        va = VermietungArchiv
+        for miete, pos, kosten in s.execute(
+            select(va.miete, va.positionen_einnahmen, va.kosten_gesamt).where(va.geraet_id == g.id)
+        ):
+            abr = _abrechnung(miete, pos, kosten)
+            sum_einnahmen += abr["einnahmen_gesamt"]
+            sum_kosten += abr["kosten_gesamt"]
     netto = sum_einnahmen - sum_kosten
     roi_vs_einkauf = None; payback_erreicht = None
     if g.anschaffungspreis > 0:
@@ -440,21 +984,21 @@ def _ueberlapp_tage(a_start: date, a_ende: date, b_start: date, b_ende: date) ->
     s_ = max(a_start, b_start); e_ = min(a_ende, b_ende)
     return 0 if e_ < s_ else (e_ - s_).days + 1
 
-def flotten_auslastung_iststunden(s: Session, fenster_start: date, fenster_ende: date) -> Tuple[float, Dict[int, float]]:
+def flotten_auslastung_iststunden(s: Session, fenster_start: date, fenster_ende: date,
+                                  geraet_ids: Optional[Iterable[int]] = None) -> Tuple[float, Dict[int, float]]:
+    """Ist-Auslastung je Geraet im Fenster; ``geraet_ids`` beschraenkt auf eine Teilmenge (z.B. Batch-Worker)."""
     if fenster_ende < fenster_start: raise ValueError("fenster_ende >= fenster_start erforderlich")
     total_tage = (fenster_ende - fenster_start).days + 1
-    geraete: list[Geraet] = list(s.scalars(select(Geraet).where(Geraet.status != GeraetStatus.AUSGEMUSTERT)))
+    ids = None if geraet_ids is None else list(geraet_ids)
+    q = select(Geraet).where(Geraet.status != GeraetStatus.AUSGEMUSTERT)
+    geraete: list[Geraet] = list(s.scalars(q if ids is None else q.where(Geraet.id.in_(ids))))
 
     avail: Dict[int, float] = {g.id: float(g.stunden_pro_tag * total_tage) for g in geraete}
     rented: Dict[int, float] = {g.id: 0.0 for g in geraete}
 
     v = Vermietung
-    vermietungen: Iterable[Vermietung] = s.scalars(
-        select(v).where(
-            v.start_datum <= fenster_ende,
-            or_(v.end_datum == None, v.end_datum >= fenster_start),
-        )
-    )
+    q = select(v).where(v.start_datum <= fenster_ende, or_(v.end_datum == None, v.end_datum >= fenster_start))
+    vermietungen: List[Vermietung] = list(s.scalars(q if ids is None else q.where(v.geraet_id.in_(ids))))
 
     for m in vermietungen:
         ov = _ueberlapp_tage(m.start_datum, m.end_datum or fenster_ende, fenster_start, fenster_ende)
@@ -464,6 +1008,18 @@ def flotten_auslastung_iststunden(s: Session, fenster_start: date, fenster_ende:
             anteil = ov / gesamt if gesamt > 0 else 0.0
             rented[m.geraet_id] += float(m.stunden_ist * anteil)
 
+    # Fenster reicht in die archivierte Historie -> Archiv mitlesen
+    archiv_bis = _archiv_bis(s)
+    if archiv_bis is not None and fenster_start <= archiv_bis:
+        va = VermietungArchiv
+        for gid, start, ende, stunden in s.execute(
+            select(va.geraet_id, va.start_datum, va.end_datum, va.stunden_ist)
+            .where(va.start_datum <= fenster_ende, va.end_datum >= fenster_start)
+        ):
+            if gid not in rented or stunden is None: continue
+            ov = _ueberlapp_tage(start, ende, fenster_start, fenster_ende)
+            rented[gid] += float(stunden * ov / ((ende - start).days + 1))
+
     per_eq = {}
     sum_rent = sum(rented.values())
     sum_av = sum(avail.values())
@@ -473,6 +1029,455 @@ def flotten_auslastung_iststunden(s: Session, fenster_start: date, fenster_ende:
     fleet = 0.0 if sum_av <= 0 else min(sum_rent / sum_av, 1.0)
     return fleet, per_eq
 
+# -------------------- Flottenstand zum Stichtag --------------------
+
+def flotten_stand(s: Session, datum: date) -> List[Dict[str, object]]:
+    """Status & Standort aller Geraete am ``datum`` aus geraet_historie: je Geraet ein Index-Seek
+    (ix_geraet_historie_stichtag) auf die juengste Zeile mit gueltig_ab <= datum."""
+    h, h2, g = GeraetHistorie, aliased(GeraetHistorie), Geraet
+    juengste = (select(h2.id).where(h2.geraet_id == g.id, h2.gueltig_ab <= datum)
+                .order_by(h2.gueltig_ab.desc(), h2.id.desc()).limit(1).correlate(g).scalar_subquery())
+    zeilen = s.execute(
+        select(g.id, g.name, g.kategorie, h.gueltig_ab, h.status, h.standort_typ, h.akt_mietpark_id, h.akt_baustelle_id)
+        .join(h, h.id == juengste).order_by(g.id)
+    )
+    return [
+        {"geraet_id": z[0], "name": z[1], "kategorie": z[2], "gueltig_ab": z[3], "status": z[4],
+         "standort_typ": z[5], "akt_mietpark_id": z[6], "akt_baustelle_id": z[7]}
+        for z in zeilen
+    ]
+
+# -------------------- Umsatzprognose (OFFEN & RESERVIERT) --------------------
+
+RASTER = ("tag", "woche", "monat", "quartal")
+
+def _periode_start(d: date, raster: str) -> date:
+    if raster == "tag": return d
+    if raster == "woche": return d - timedelta(days=d.weekday())
+    if raster == "monat": return d.replace(day=1)
+    if raster == "quartal": return date(d.year, (d.month - 1) // 3 * 3 + 1, 1)
+    raise ValueError(f"unbekanntes Raster '{raster}' (erlaubt: {', '.join(RASTER)})")
+
+def _perioden(von: date, bis: date, raster: str) -> List[Tuple[date, date]]:
+    """Lueckenlose Perioden (Start, Ende) im Raster, die [von, bis] abdecken."""
+    out: List[Tuple[date, date]] = []
+    p = _periode_start(von, raster)
+    while p <= bis:
+        if raster == "tag": nxt = p + timedelta(days=1)
+        elif raster == "woche": nxt = p + timedelta(days=7)
+        else: nxt = _add_monat_mit_anker(p, 1, 1 if raster == "monat" else 3)
+        out.append((p, nxt - timedelta(days=1)))
+        p = nxt
+    return out
+
+# Tagessaetze als duenn besetztes Differenzfeld (Tag ab ``lo`` -> Aenderung des Tageswerts): je Vermietung ein
+# Eintrag pro Abrechnungszyklus (Tagessatz dort konstant) statt einer Berechnung pro Periode; _je_periode
+# integriert die stueckweise konstanten Tageswerte einmal ueber alle Perioden.
+
+def _miete_eintragen(diff: Dict[int, float], lo: date, satz_wert: float, einheit: SatzEinheit, v_start: date,
+                     seg_start: date, seg_ende: date) -> float:
+    """Traegt die Miete von [seg_start, seg_ende] (innerhalb des Feldes) ein und gibt die Summe zurueck."""
+    if seg_ende < seg_start: return 0.0
+    stuecke = ([(seg_start, seg_ende, 1)] if einheit == SatzEinheit.TAEGLICH
+               else _zyklus_stuecke(v_start, seg_start, seg_ende))
+    gesamt = 0.0
+    for von, bis, tage in stuecke:
+        _tageswert_eintragen(diff, lo, satz_wert / tage, von, bis)
+        gesamt += satz_wert * (((bis - von).days + 1) / tage)
+    return gesamt
+
+def _tageswert_eintragen(diff: Dict[int, float], lo: date, wert: float, von: date, bis: date) -> None:
+    diff[(von - lo).days] += wert; diff[(bis - lo).days + 1] -= wert
+
+def _je_periode(diff: Dict[int, float], lo: date, perioden: List[Tuple[date, date]]) -> List[float]:
+    """Summe der Tageswerte je Periode (aufsteigend, Luecken erlaubt)."""
+    punkte = sorted(diff.items())
+    out: List[float] = []
+    laufend = 0.0; j = 0
+    for p_start, p_ende in perioden:
+        pos, ende = (p_start - lo).days, (p_ende - lo).days + 1
+        summe = 0.0
+        while j < len(punkte) and punkte[j][0] < ende:
+            tag, delta = punkte[j]
+            if tag > pos: summe += laufend * (tag - pos); pos = tag
+            laufend += delta; j += 1
+        out.append(summe + laufend * (ende - pos))
+    return out
+
+def umsatz_prognose(s: Session, stichtag: date, horizont_ende: date, raster: str = "monat") -> Dict[str, object]:
+    """Aufgelaufene Miete laufender (OFFEN) und erwartete Miete kuenftiger Tage (OFFEN-Rest & RESERVIERT).
+
+    aufgelaufen: OFFEN von start_datum bis stichtag. prognose: ab stichtag+1 bis end_datum bzw. horizont_ende.
+    Eine Abfrage nur der benoetigten Spalten fuer alle aktiven Vermietungen; je Vermietung ein Eintrag pro
+    Abrechnungszyklus, die Verteilung auf die Perioden laeuft einmal ueber alle Tage.
+    """
+    if horizont_ende < stichtag: raise ValueError("horizont_ende >= stichtag erforderlich")
+    _periode_start(stichtag, raster)   # Raster validieren
+    v = Vermietung
+    zeilen = list(s.execute(
+        select(v.status, v.start_datum, v.end_datum, v.satz_wert, v.satz_einheit)
+        .where(v.status.in_([VermietStatus.OFFEN, VermietStatus.RESERVIERT]), v.start_datum <= horizont_ende)
+    ))
+    morgen = stichtag + timedelta(days=1)
+    von = min([z.start_datum for z in zeilen if z.status == VermietStatus.OFFEN] + [stichtag])
+    perioden = _perioden(von, horizont_ende, raster)
+    lo = perioden[0][0]
+    auf_diff: Dict[int, float] = defaultdict(float); prog_diff: Dict[int, float] = defaultdict(float)
+    sum_auf = sum_prog = 0.0; n_offen = n_res = 0
+    for st, start, ende, satz, einheit in zeilen:
+        plan_ende = min(ende or horizont_ende, horizont_ende)
+        if st == VermietStatus.OFFEN:
+            n_offen += 1
+            sum_auf += _miete_eintragen(auf_diff, lo, satz, einheit, start, start, stichtag)
+        else:
+            n_res += 1
+        sum_prog += _miete_eintragen(prog_diff, lo, satz, einheit, start, max(start, morgen), plan_ende)
+    aufgelaufen, prognose = _je_periode(auf_diff, lo, perioden), _je_periode(prog_diff, lo, perioden)
+    return {
+        "stichtag": stichtag, "horizont_ende": horizont_ende, "raster": raster,
+        "anzahl_offen": n_offen, "anzahl_reserviert": n_res,
+        "aufgelaufen": round(sum_auf, 2), "prognose": round(sum_prog, 2),
+        "perioden": [
+            {"periode_start": p[0], "periode_ende": p[1], "aufgelaufen": round(a, 2), "prognose": round(b, 2)}
+            for p, a, b in zip(perioden, aufgelaufen, prognose) if round(a, 2) or round(b, 2)
+        ],
+    }
+
+# -------------------- Auslastungs-/Umsatzwuerfel --------------------
+
+WUERFEL_DIMENSIONEN = ("kategorie", "mietpark", "eigentuemer", "kunde")
+WUERFEL_RASTER = ("woche", "monat", "quartal")
+WUERFEL_CACHE_MAX = 4096
+
+# Zellen abgeschlossener Perioden: (dimensionen, raster, periode_start, periode_ende) -> Zellen. Ein Eintrag faellt
+# weg, sobald ein Vermietungs-Ereignis der Outbox seinen Zeitraum beruehrt oder sich der Geraetebestand aendert.
+_WUERFEL_CACHE: Dict[tuple, List[Dict[str, object]]] = {}
+_WUERFEL_STAND: Dict[str, object] = {"position": None, "geraete": None}
+_WUERFEL_LOCK = threading.Lock()
+
+def _wuerfel_abgleichen(s: Session) -> None:
+    """Verwirft Cache-Eintraege, deren Zeitraum seit dem letzten Abgleich von Schreibzugriffen betroffen ist."""
+    geraete = tuple(s.execute(
+        select(func.count(Geraet.id), func.max(Geraet.id), func.sum(Geraet.stunden_pro_tag))
+        .where(Geraet.status != GeraetStatus.AUSGEMUSTERT)
+    ).one())
+    with _WUERFEL_LOCK:
+        if _WUERFEL_STAND["position"] is None or geraete != _WUERFEL_STAND["geraete"]:
+            _WUERFEL_CACHE.clear()
+            _WUERFEL_STAND.update(position=letzte_ereignis_position(s), geraete=geraete)
+            return
+        while True:
+            neue = ereignisse_seit(s, _WUERFEL_STAND["position"], limit=1000)
+            if not neue: return
+            for e in neue:
+                if e.entitaet != "vermietung": continue
+                d = json.loads(e.daten or "{}")
+                von = date.fromisoformat(d["start"]) if d.get("start") else date.min
+                bis = date.fromisoformat(d["ende"]) if d.get("ende") else date.max
+                if "ende_vorher" in d:   # rueckdatiert geschlossen: Miete lief bisher bis zum alten Ende (offen: heute)
+                    bis = max(bis, date.fromisoformat(d["ende_vorher"]) if d["ende_vorher"] else date.max)
+                for k in [k for k in _WUERFEL_CACHE if k[2] <= bis and k[3] >= von]:
+                    del _WUERFEL_CACHE[k]
+            _WUERFEL_STAND["position"] = neue[-1].position
+
+def _wuerfel_berechnen(s: Session, perioden: List[Tuple[date, date]], dimensionen: Tuple[str, ...],
+                       heute: date) -> List[List[Dict[str, object]]]:
+    """Verfuegbarkeit per GROUP BY je Zelle; Vermietungen (Dimensionen per Join) je Abrechnungszyklus als Tageswert
+    in ein Differenzfeld der Zelle, Anzahl als Differenz ueber Periodenindizes. Aufwand O(Zyklen + Perioden),
+    unabhaengig davon, wie viele Perioden eine Vermietung beruehrt. ``perioden`` aufsteigend, Luecken erlaubt."""
+    lo, hi = perioden[0][0], perioden[-1][1]
+    starts, enden = [p[0] for p in perioden], [p[1] for p in perioden]
+    g = Geraet
+    dim_spalten = {"kategorie": g.kategorie, "mietpark": g.heim_mietpark_id, "eigentuemer": g.eigentuemer_firma_id}
+    def schluessel_spalten(kunde_spalte) -> list:
+        return [dim_spalten.get(d, kunde_spalte) for d in dimensionen]
+
+    # je Zelle: Stunden/Tag verfuegbar, Differenzfelder (Tag) fuer vermietete Stunden & Umsatz, (Periode) fuer Anzahl
+    verfuegbar: Dict[tuple, float] = {}
+    if "kunde" not in dimensionen:   # Verfuegbarkeit laesst sich nicht auf Kunden aufteilen
+        dims = schluessel_spalten(None)
+        for *k, stunden_pro_tag in s.execute(
+            select(*dims, func.sum(g.stunden_pro_tag)).where(g.status != GeraetStatus.AUSGEMUSTERT).group_by(*dims)
+        ):
+            verfuegbar[tuple(k)] = float(stunden_pro_tag or 0)
+    vermietet: Dict[tuple, Dict[int, float]] = {}
+    umsatz: Dict[tuple, Dict[int, float]] = {}
+    anzahl: Dict[tuple, Dict[int, int]] = {}
+
+    def buchen(k, start, ende, status, stunden, satz, einheit) -> None:
+        bis = ende if status == VermietStatus.GESCHLOSSEN else min(ende or hi, heute)   # OFFEN: aufgelaufen
+        von, bis = max(start, lo), min(bis, hi)
+        if von > bis: return   # OFFEN mit Start nach heute: noch nichts aufgelaufen
+        i0, i1 = bisect_left(enden, von), bisect_right(starts, bis) - 1
+        if i0 > i1: return   # beruehrt keine Periode (z.B. in einer Luecke)
+        n = anzahl.setdefault(k, defaultdict(int)); n[i0] += 1; n[i1 + 1] -= 1
+        if status == VermietStatus.GESCHLOSSEN and stunden is not None:
+            _tageswert_eintragen(vermietet.setdefault(k, defaultdict(float)), lo,
+                                 stunden / _tage_in_klammer(start, ende), von, bis)
+        _miete_eintragen(umsatz.setdefault(k, defaultdict(float)), lo, satz, einheit, start, von, bis)
+
+    v = Vermietung
+    for *k, start, ende, status, stunden, satz, einheit in s.execute(
+        select(*schluessel_spalten(v.kunde_id), v.start_datum, v.end_datum, v.status, v.stunden_ist, v.satz_wert,
+               v.satz_einheit)
+        .join(g, g.id == v.geraet_id)
+        .where(g.status != GeraetStatus.AUSGEMUSTERT, v.status.in_([VermietStatus.OFFEN, VermietStatus.GESCHLOSSEN]),
+               v.start_datum <= hi, or_(v.end_datum == None, v.end_datum >= lo))
+    ):
+        buchen(tuple(k), start, ende, status, stunden, satz, einheit)
+    archiv_bis = _archiv_bis(s)
+    if archiv_bis is not None and lo <= archiv_bis:
+        va = VermietungArchiv
+        for *k, start, ende, stunden, satz, einheit in s.execute(
+            select(*schluessel_spalten(va.kunde_id), va.start_datum, va.end_datum, va.stunden_ist, va.satz_wert,
+                   va.satz_einheit)
+            .join(g, g.id == va.geraet_id)
+            .where(g.status != GeraetStatus.AUSGEMUSTERT, va.start_datum <= hi, va.end_datum >= lo)
+        ):
+            buchen(tuple(k), start, ende, VermietStatus.GESCHLOSSEN, stunden, satz, einheit)
+
+    # [verfuegbar, vermietet, umsatz, anzahl] je Periode und Zelle
+    zellen: List[Dict[tuple, List[float]]] = [{} for _ in perioden]
+    for k, stunden_pro_tag in verfuegbar.items():
+        for i, (p_start, p_ende) in enumerate(perioden):
+            zellen[i][k] = [stunden_pro_tag * _tage_in_klammer(p_start, p_ende), 0.0, 0.0, 0]
+    for k, n_diff in anzahl.items():
+        verm = _je_periode(vermietet[k], lo, perioden) if k in vermietet else None
+        ums = _je_periode(umsatz[k], lo, perioden)
+        n = 0
+        for i in range(len(perioden)):
+            n += n_diff.get(i, 0)
+            if n <= 0: continue
+            c = zellen[i].setdefault(k, [0.0, 0.0, 0.0, 0])
+            c[1] += verm[i] if verm else 0.0; c[2] += ums[i]; c[3] += n
+
+    out: List[List[Dict[str, object]]] = []
+    for (p_start, p_ende), pz in zip(perioden, zellen):
+        liste = []
+        for k, (verf, verm, umsatz, anzahl) in sorted(pz.items(), key=lambda x: tuple((w is None, str(w)) for w in x[0])):
+            liste.append({
+                "periode_start": p_start, "periode_ende": p_ende, **dict(zip(dimensionen, k)),
+                "verfuegbar_stunden": round(verf, 2) if "kunde" not in dimensionen else None,
+                "vermietet_stunden": round(verm, 2), "umsatz_miete": round(umsatz, 2), "anzahl_vermietungen": anzahl,
+                "auslastung": (round(min(verm / verf, 1.0), 4) if verf > 0 else 0.0) if "kunde" not in dimensionen else None,
+            })
+        out.append(liste)
+    return out
+
+def auslastung_wuerfel(s: Session, von: date, bis: date, dimensionen: Iterable[str] = ("kategorie",),
+                       raster: str = "monat", heute: Optional[date] = None) -> Dict[str, object]:
+    """Auslastung, vermietete Ist-Stunden und Mietumsatz je Periode, gruppiert nach beliebigen Dimensionen.
+
+    Verfuegbar = stunden_pro_tag x Tage (aktive Geraete), vermietet = stunden_ist GESCHLOSSENER Vermietungen
+    tagesanteilig, Umsatz = Miete GESCHLOSSENER sowie aufgelaufene Miete OFFENER Vermietungen (bis ``heute``).
+    Mit Dimension ``kunde`` entfallen Verfuegbarkeit und Auslastung. Abgeschlossene, vollstaendig im Fenster
+    liegende Perioden werden im Prozess gecacht; nur fehlende Perioden werden in einem Durchlauf berechnet.
+    """
+    if bis < von: raise ValueError("bis >= von erforderlich")
+    if raster not in WUERFEL_RASTER: raise ValueError(f"unbekanntes Raster '{raster}' (erlaubt: {', '.join(WUERFEL_RASTER)})")
+    dimensionen = tuple(dict.fromkeys(dimensionen))
+    unbekannt = [d for d in dimensionen if d not in WUERFEL_DIMENSIONEN]
+    if unbekannt: raise ValueError(f"unbekannte Dimension(en) {', '.join(unbekannt)} (erlaubt: {', '.join(WUERFEL_DIMENSIONEN)})")
+    heute = heute or date.today()
+    voll = _perioden(von, bis, raster)
+    perioden = [(max(p, von), min(e, bis)) for p, e in voll]
+    ganz = set(voll)   # nur nicht angeschnittene Perioden sind cachebar
+
+    _wuerfel_abgleichen(s)
+    ergebnis: Dict[Tuple[date, date], List[Dict[str, object]]] = {}
+    with _WUERFEL_LOCK:
+        for p in perioden:
+            treffer = _WUERFEL_CACHE.get((dimensionen, raster) + p)
+            if treffer is not None: ergebnis[p] = treffer
+    fehlend = [p for p in perioden if p not in ergebnis]
+    if fehlend:
+        for p, liste in zip(fehlend, _wuerfel_berechnen(s, fehlend, dimensionen, heute)):
+            ergebnis[p] = liste
+            if p in ganz and p[1] < heute:
+                with _WUERFEL_LOCK:
+                    if len(_WUERFEL_CACHE) >= WUERFEL_CACHE_MAX: _WUERFEL_CACHE.clear()
+                    _WUERFEL_CACHE[(dimensionen, raster) + p] = liste
+    return {
+        "von": von, "bis": bis, "raster": raster, "dimensionen": list(dimensionen),
+        "perioden_aus_cache": len(perioden) - len(fehlend),
+        "zellen": [z for p in perioden for z in ergebnis[p]],
+    }
+
+# -------------------- Abrechnungsvorschau (OFFEN bis Stichtag) --------------------
+
+def abrechnung_vorschau(s: Session, stichtag: date, kunde_ids: Optional[Iterable[int]] = None) -> List[Dict[str, object]]:
+    """Je OFFENER Vermietung: aufgelaufene Miete bis ``stichtag`` + Positionen abzueglich bereits berechneter
+    Rechnungen = noch zu berechnen. Drei Abfragen, unabhaengig von der Anzahl Vermietungen."""
+    v, p, r = Vermietung, VermietungPosition, Rechnung
+    q = select(v.id, v.kunde_id, v.geraet_id, v.start_datum, v.satz_wert, v.satz_einheit).where(
+        v.status == VermietStatus.OFFEN, v.start_datum <= stichtag)
+    if kunde_ids is not None:
+        q = q.where(v.kunde_id.in_(list(kunde_ids)))
+    zeilen = list(s.execute(q.order_by(v.kunde_id, v.id)))
+    ids = [z.id for z in zeilen]
+    pos = dict(s.execute(select(p.vermietung_id, func.sum(p.preis_einzel * p.menge))
+                         .where(p.vermietung_id.in_(ids)).group_by(p.vermietung_id)).all()) if ids else {}
+    berechnet = dict(s.execute(select(r.vermietung_id, func.sum(func.coalesce(r.betrag_netto, 0.0)))
+                               .where(r.vermietung_id.in_(ids)).group_by(r.vermietung_id)).all()) if ids else {}
+    out = []
+    for z in zeilen:
+        miete = _miete_segment(z.satz_wert, z.satz_einheit, z.start_datum, z.start_datum, stichtag)
+        summe = miete + (pos.get(z.id) or 0.0)
+        out.append({
+            "kunde_id": z.kunde_id, "vermietung_id": z.id, "geraet_id": z.geraet_id, "start_datum": z.start_datum,
+            "tage": _tage_in_klammer(z.start_datum, stichtag), "miete_aufgelaufen": round(miete, 2),
+            "positionen": round(pos.get(z.id) or 0.0, 2), "berechnet": round(berechnet.get(z.id) or 0.0, 2),
+            "zu_berechnen": round(summe - (berechnet.get(z.id) or 0.0), 2),
+        })
+    return out
+
+# -------------------- Debitoren: Kundenkonto & offene Posten --------------------
+
+ALTERSKLASSEN = ("tage_0_30", "tage_31_60", "tage_61_90", "tage_ueber_90")
+
+def _altersklassen(r, stichtag: date) -> list:
+    """SUM(CASE ...) je Altersklasse (Tage seit Rechnungsdatum) fuer offene Rechnungen, portabel ueber Datumsgrenzen."""
+    betrag = func.coalesce(r.betrag_netto, 0.0)
+    klasse = case(
+        (r.datum >= stichtag - timedelta(days=30), 0),
+        (r.datum >= stichtag - timedelta(days=60), 1),
+        (r.datum >= stichtag - timedelta(days=90), 2),
+        else_=3,
+    )
+    return [func.coalesce(func.sum(case((klasse == i, betrag), else_=0.0)), 0.0).label(n)
+            for i, n in enumerate(ALTERSKLASSEN)]
+
+def kunden_konto(s: Session, kunde_id: int, stichtag: Optional[date] = None, offene_limit: int = 100) -> Dict[str, object]:
+    k = s.get(Kunde, kunde_id)
+    if not k: raise ValueError("Kunde nicht gefunden")
+    stichtag = stichtag or date.today()
+    r, v = Rechnung, Vermietung
+    betrag = func.coalesce(r.betrag_netto, 0.0)
+    # IN (Vermietungen des Kunden) statt JOIN: erzwingt den Weg ueber ix_vermietung_kunde_start -> ix_rechnung_vermietung_konto
+    des_kunden = r.vermietung_id.in_(select(v.id).where(v.kunde_id == kunde_id))
+    gesamt = s.execute(
+        select(func.count(r.id), func.coalesce(func.sum(betrag), 0.0),
+               func.coalesce(func.sum(case((r.bezahlt == 1, betrag), else_=0.0)), 0.0)).where(des_kunden)
+    ).one()
+    offen = s.execute(
+        select(func.count(r.id), func.coalesce(func.sum(betrag), 0.0), func.min(r.datum), *_altersklassen(r, stichtag))
+        .where(des_kunden, r.bezahlt == 0)
+    ).one()
+    anzahl, summe, bezahlt = gesamt
+    if _archiv_bis(s) is not None:   # archivierte Rechnungen sind immer bezahlt
+        ra, va = RechnungArchiv, VermietungArchiv
+        a_anzahl, a_summe = s.execute(
+            select(func.count(ra.id), func.coalesce(func.sum(func.coalesce(ra.betrag_netto, 0.0)), 0.0))
+            .join(va, va.id == ra.vermietung_id).where(va.kunde_id == kunde_id)
+        ).one()
+        anzahl += a_anzahl; summe += a_summe; bezahlt += a_summe
+    offene = s.execute(
+        select(r.id, r.vermietung_id, r.nummer, r.datum, r.betrag_netto)
+        .where(des_kunden, r.bezahlt == 0)
+        .order_by(r.datum, r.id).limit(offene_limit)
+    )
+    return {
+        "kunde_id": k.id, "name": k.name, "stichtag": stichtag,
+        "anzahl_rechnungen": anzahl, "summe_rechnungen": round(summe, 2), "summe_bezahlt": round(bezahlt, 2),
+        "anzahl_offen": offen[0], "offener_saldo": round(offen[1], 2), "aelteste_offene": offen[2],
+        "altersstruktur": {n: round(offen[3 + i], 2) for i, n in enumerate(ALTERSKLASSEN)},
+        "offene_rechnungen": [
+            {"rechnung_id": x.id, "vermietung_id": x.vermietung_id, "nummer": x.nummer, "datum": x.datum,
+             "betrag_netto": x.betrag_netto, "alter_tage": (stichtag - x.datum).days}
+            for x in offene
+        ],
+    }
+
+def offene_posten(s: Session, stichtag: Optional[date] = None) -> Dict[str, object]:
+    """Flottenweite Altersstruktur offener Rechnungen je Kunde (eine gruppierte Abfrage)."""
+    stichtag = stichtag or date.today()
+    r, v = Rechnung, Vermietung
+    zeilen = list(s.execute(
+        select(v.kunde_id, Kunde.name, func.count(r.id), func.coalesce(func.sum(func.coalesce(r.betrag_netto, 0.0)), 0.0),
+               func.min(r.datum), *_altersklassen(r, stichtag))
+        .join(v, v.id == r.vermietung_id).join(Kunde, Kunde.id == v.kunde_id)
+        .where(r.bezahlt == 0).group_by(v.kunde_id, Kunde.name)
+    ))
+    kunden = [
+        {"kunde_id": z[0], "name": z[1], "anzahl_offen": z[2], "offener_saldo": round(z[3], 2), "aelteste_offene": z[4],
+         **{n: round(z[5 + i], 2) for i, n in enumerate(ALTERSKLASSEN)}}
+        for z in zeilen
+    ]
+    kunden.sort(key=lambda x: x["offener_saldo"], reverse=True)
+    return {
+        "stichtag": stichtag,
+        "offener_saldo": round(sum(x["offener_saldo"] for x in kunden), 2),
+        "altersstruktur": {n: round(sum(x[n] for x in kunden), 2) for n in ALTERSKLASSEN},
+        "kunden": kunden,
+    }
+
+# -------------------- Archivierung (heiss/kalt) --------------------
+
+def _archiv_bis(s: Session) -> Optional[date]:
+    return s.scalar(select(ArchivStand.bis_datum).where(ArchivStand.id == 1))
+
+def archivieren(s: Session, monate: int = 24, stichtag: Optional[date] = None, batch: int = 500) -> Dict[str, int]:
+    """Verschiebt geschlossene, vollstaendig bezahlte Vermietungen (end_datum aelter als ``monate``) samt
+    Rechnungen sowie alte Zaehlerstaende in die Archivtabellen. Kopieren und Loeschen laufen je Batch in
+    einer Transaktion; ein Abbruch hinterlaesst keine halb archivierten Zeilen."""
+    stichtag = stichtag or date.today()
+    grenze = _add_monat_mit_anker(stichtag, stichtag.day, -monate)
+
+    v, r, z = Vermietung, Rechnung, Zaehlerstand
+    hat_rechnung = select(r.id).where(r.vermietung_id == v.id).exists()
+    hat_offene = select(r.id).where(r.vermietung_id == v.id, r.bezahlt == 0).exists()
+    # SQLite vergibt eine geloeschte Hoechst-ID neu -> die juengste Zeile je Tabelle bleibt im Bestand,
+    # damit Archiv-IDs eindeutig bleiben
+    hat_max_rechnung = select(r.id).where(r.vermietung_id == v.id,
+                                          r.id >= select(func.max(r.id)).scalar_subquery()).exists()
+    kandidaten = select(v.id).where(
+        v.status == VermietStatus.GESCHLOSSEN, v.end_datum < grenze, hat_rechnung, ~hat_offene,
+        v.id < select(func.max(v.id)).scalar_subquery(), ~hat_max_rechnung,
+    ).order_by(v.id).limit(batch)
+
+    n_verm = n_rech = n_zs = 0
+    while True:
+        ids = list(s.scalars(kandidaten))
+        if not ids: break
+        vs = list(s.scalars(select(v).where(v.id.in_(ids))
+                            .options(selectinload(v.positionen), selectinload(v.rechnungen))))
+        zeilen, rechnungen = [], []
+        for m in vs:
+            abr = _abrechnung_vermietung(m)
+            zeilen.append(dict(
+                id=m.id, geraet_id=m.geraet_id, kunde_id=m.kunde_id, baustelle_id=m.baustelle_id,
+                start_datum=m.start_datum, end_datum=m.end_datum, stunden_ist=m.stunden_ist,
+                satz_wert=m.satz_wert, satz_einheit=m.satz_einheit, miete=abr["miete"],
+                positionen_einnahmen=abr["positionen_einnahmen"], kosten_gesamt=abr["kosten_gesamt"],
+            ))
+            rechnungen += [dict(id=x.id, vermietung_id=m.id, nummer=x.nummer, datum=x.datum,
+                                betrag_netto=x.betrag_netto, bezahlt=x.bezahlt) for x in m.rechnungen]
+        s.execute(insert(VermietungArchiv), zeilen)
+        if rechnungen: s.execute(insert(RechnungArchiv), rechnungen)
+        bis = max(m.end_datum for m in vs)
+        stand = s.get(ArchivStand, 1) or ArchivStand(id=1)
+        stand.bis_datum = max(stand.bis_datum or bis, bis); stand.aktualisiert_am = datetime.utcnow()
+        s.add(stand)
+        s.execute(delete(VermietungPosition).where(VermietungPosition.vermietung_id.in_(ids)))
+        s.execute(delete(Rechnung).where(Rechnung.vermietung_id.in_(ids)))
+        s.execute(delete(Vermietung).where(Vermietung.id.in_(ids)))
+        s.commit()
+        n_verm += len(ids); n_rech += len(rechnungen)
+
+    zs_grenze = datetime(grenze.year, grenze.month, grenze.day)
+    while True:
+        zs = list(s.execute(select(z.id, z.geraet_id, z.zeitpunkt, z.art, z.stand)
+                            .where(z.zeitpunkt < zs_grenze, z.id < select(func.max(z.id)).scalar_subquery())
+                            .order_by(z.id).limit(batch)))
+        if not zs: break
+        ids = [row.id for row in zs]
+        s.execute(insert(ZaehlerstandArchiv), [row._asdict() for row in zs])
+        s.execute(delete(z).where(z.id.in_(ids)))
+        s.commit()
+        n_zs += len(ids)
+
+    return {"vermietungen": n_verm, "rechnungen": n_rech, "zaehlerstaende": n_zs}
+
 # -------------------- Demo (optional) --------------------
 def _demo():
     init_db()
@@ -503,5 +1508,11 @@ def _demo():
         print("Abrechnung:", abr)  # Monatsrate rollierend ab 23.
 
 if __name__ == "__main__":
-    _demo()
+    import sys
+    if sys.argv[1:2] == ["archivieren"]:
+        # python flotte_v3_de.py archivieren [monate]
+        with SessionLocal() as s:
+            print("Archiviert:", archivieren(s, monate=int(sys.argv[2]) if len(sys.argv) > 2 else 24))
+    else:
+        _demo()
 
@@ -0,0 +1,107 @@
+# kaltstart.py
+"""Kaltstart-Messung: frischer uvicorn-Prozess je Lauf, Zeiten bis zur ersten Antwort gegen ein Budget.
+
+    python kaltstart.py [--laeufe 5] [--pfad /geraete?limit=50]
+
+Je Lauf: Prozess starten, warten bis der Port annimmt (``bereit_ms`` ab Spawn: Interpreter, Import,
+Lifespan mit Schema-Pruefung), dann genau eine Anfrage auf ``--pfad`` (``erste_anfrage_ms``, clientseitig,
+inkl. Engine-Connect und erstem Statement-Compile). Danach liefert /health die serverseitigen Werte
+``import_ms`` (Modul-Import api_v3_de) und ``start_ms`` (Lifespan). Ausgegeben werden die Mediane.
+
+Referenz auf der Entwicklungsmaschine (SQLite, 5 Laeufe):
+
+    vorher  (create_all beim Import)     import ~955 ms (-X importtime), bereit ~1050 ms, erste Anfrage ~61 ms
+    nachher (Migrationen out-of-band)    import ~920 ms, start ~27 ms, bereit ~1180 ms, erste Anfrage ~54 ms
+
+Der Import wird von fastapi/pydantic/sqlalchemy bestimmt (~600 ms ohne eigenen Code); der eigene Anteil
+ist die Modell-Deklaration (~135 ms fuer die gemappten Klassen). Das Budget deckt deshalb die erste
+Anfrage nach dem Kaltstart ab (niedrige hundert ms), fuer den Import gilt eine Obergrenze gegen Regressionen.
+Exit-Code 1, wenn ein Median sein Budget reisst.
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+HIER = os.path.dirname(os.path.abspath(__file__))
+
+BUDGET_MS = {"import_ms": 1500.0, "start_ms": 100.0, "erste_anfrage_ms": 300.0}
+
+def _freier_port() -> int:
+    with socket.socket() as so:
+        so.bind(("127.0.0.1", 0))
+        return so.getsockname()[1]
+
+def _anfrage(port: int, pfad: str) -> Dict:
+    c = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    c.request("GET", pfad)
+    r = c.getresponse()
+    body = r.read()
+    if r.status != 200:
+        raise RuntimeError(f"GET {pfad}: HTTP {r.status} {body[:200]!r}")
+    return json.loads(body)
+
+def lauf(pfad: str) -> Dict[str, float]:
+    port = _freier_port()
+    t0 = time.perf_counter()
+    p = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_v3_de:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HIER, env=dict(os.environ),
+    )
+    try:
+        while True:   # nur TCP pruefen, damit die erste HTTP-Anfrage die gemessene ist
+            if p.poll() is not None:
+                raise RuntimeError(f"uvicorn beendet (Exit {p.returncode})")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.05).close()
+                break
+            except OSError:
+                time.sleep(0.005)
+            if time.perf_counter() - t0 > 30:
+                raise RuntimeError("uvicorn startet nicht")
+        bereit = time.perf_counter()
+        _anfrage(port, pfad)
+        erste = time.perf_counter()
+        server = _anfrage(port, "/health").get("kaltstart", {})
+        return {"bereit_ms": (bereit - t0) * 1000, "erste_anfrage_ms": (erste - bereit) * 1000,
+                "import_ms": server.get("import_ms"), "start_ms": server.get("start_ms")}
+    finally:
+        p.terminate(); p.wait(10)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--laeufe", type=int, default=5)
+    ap.add_argument("--pfad", default="/geraete?limit=50")
+    args = ap.parse_args(argv)
+
+    if "FLOTTE_DB_URL" not in os.environ:
+        os.environ["FLOTTE_DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "kaltstart.db")
+    subprocess.run([sys.executable, "-m", "migrationen"], cwd=HIER, env=dict(os.environ), check=True,
+                   stdout=subprocess.DEVNULL)
+
+    laeufe = [lauf(args.pfad) for _ in range(args.laeufe)]
+    verstoesse = 0
+    print(f"{'Messgroesse':<20}{'Median':>10}{'Min':>10}{'Max':>10}{'Budget':>10}")
+    for name in ("bereit_ms", "import_ms", "start_ms", "erste_anfrage_ms"):
+        werte = [l[name] for l in laeufe if l[name] is not None]
+        if not werte:
+            continue
+        median = statistics.median(werte)
+        budget = BUDGET_MS.get(name)
+        zu_langsam = budget is not None and median > budget
+        verstoesse += zu_langsam
+        print(f"{name:<20}{median:>10.1f}{min(werte):>10.1f}{max(werte):>10.1f}"
+              f"{budget if budget is not None else '-':>10}  {'UEBER BUDGET' if zu_langsam else ''}")
+    return 1 if verstoesse else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
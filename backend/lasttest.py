@@ -0,0 +1,228 @@
+# lasttest.py
+"""HTTP-Lasttest: synthetische DB, echter uvicorn-Prozess, gemischte Last, SLO-Bericht.
+
+    python lasttest.py [--dauer 30] [--clients 20] [--geraete 300] [--historie 20000]
+                       [--mix geraete_list=40,vermietung_anlegen=15,vermietung_schliessen=15,abrechnung=20,auslastung=10]
+                       [--slo lasttest_slo.json]
+
+Ablauf: temporaere SQLite-DB anlegen (oder FLOTTE_DB_URL), migrieren und befuellen, ``api_v3_de:app``
+per uvicorn auf einem freien Port starten, dann ``--clients`` Threads mit je einer Keep-Alive-Verbindung
+laufen lassen. Ausgabe je Operation: Anzahl, Fehler, Durchsatz, p50/p95/p99 gegen die SLO-Datei.
+Exit-Code 1 bei SLO-Verletzung oder Fehlern (HTTP 409 bei Buchungskonflikten zaehlt nicht als Fehler).
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+HIER = os.path.dirname(os.path.abspath(__file__))
+
+# -------------------- Testbestand --------------------
+
+def befuellen(n_geraete: int, n_historie: int, seed: int = 7) -> Dict[str, List[int]]:
+    """Stammdaten ueber die Helper, Historie (geschlossene Vermietungen) per Bulk-Insert."""
+    from sqlalchemy import insert, select
+    import flotte_v3_de as f
+
+    rnd = random.Random(seed)
+    f.init_db()
+    with f.SessionLocal() as s:
+        mps = [f.mietpark_anlegen(s, f"Mietpark {i}").id for i in range(5)]
+        ks = [f.kunde_anlegen(s, f"Kunde {i}").id for i in range(200)]
+        kategorien = ["drill_rig", "bagger", "radlader", "kran", "walze"]
+        gs = [f.geraet_anlegen(s, f"Geraet {i}", rnd.choice(kategorien), stundenzaehler=1000.0,
+                               heim_mietpark_id=rnd.choice(mps), anschaffungspreis=150000.0).id
+              for i in range(n_geraete)]
+        zeilen = []
+        pro_geraet = max(n_historie // n_geraete, 1)
+        for g in gs:   # je Geraet lueckenlos hintereinander, damit keine Ueberlappungen entstehen
+            tag = date(2020, 1, 1)
+            for _ in range(pro_geraet):
+                dauer = rnd.randrange(3, 40)
+                zeilen.append(dict(
+                    geraet_id=g, kunde_id=rnd.choice(ks), start_datum=tag, end_datum=tag + timedelta(days=dauer),
+                    stunden_ist=float(rnd.randrange(10, 300)), satz_wert=float(rnd.randrange(80, 400)),
+                    satz_einheit=f.SatzEinheit.TAEGLICH, status=f.VermietStatus.GESCHLOSSEN,
+                ))
+                tag += timedelta(days=dauer + rnd.randrange(1, 10))
+        s.execute(insert(f.Vermietung), zeilen)
+        s.commit()
+        geschlossen = list(s.scalars(select(f.Vermietung.id).where(f.Vermietung.status == f.VermietStatus.GESCHLOSSEN)))
+    return {"geraete": gs, "kunden": ks, "geschlossen": geschlossen}
+
+# -------------------- Server --------------------
+
+def _freier_port() -> int:
+    with socket.socket() as so:
+        so.bind(("127.0.0.1", 0))
+        return so.getsockname()[1]
+
+def server_starten(port: int) -> subprocess.Popen:
+    p = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_v3_de:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HIER, env=dict(os.environ),
+    )
+    for _ in range(100):
+        try:
+            c = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            c.request("GET", "/health"); c.getresponse().read()
+            return p
+        except OSError:
+            time.sleep(0.1)
+    p.kill()
+    raise RuntimeError("uvicorn startet nicht")
+
+# -------------------- Last --------------------
+
+class Operationen:
+    """Die Workload-Bausteine; jede Operation liefert (Methode, Pfad, Body)."""
+
+    def __init__(self, daten: Dict[str, List[int]]):
+        self.daten = daten
+        self.offen: List[Tuple[int, str]] = []   # (id, end_datum) aus vermietung_anlegen, von _schliessen verbraucht
+        self.lock = threading.Lock()
+        self.naechster_tag = {g: date(2031, 1, 1) for g in daten["geraete"]}
+
+    def geraete_list(self, rnd: random.Random):
+        return "GET", f"/geraete?limit=50&offset={rnd.randrange(0, 200)}", None
+
+    def vermietung_anlegen(self, rnd: random.Random):
+        g = rnd.choice(self.daten["geraete"])
+        with self.lock:
+            start = self.naechster_tag[g]
+            self.naechster_tag[g] = start + timedelta(days=8)
+        return "POST", "/vermietungen", {
+            "geraet_id": g, "kunde_id": rnd.choice(self.daten["kunden"]), "start_datum": start.isoformat(),
+            "end_datum": (start + timedelta(days=6)).isoformat(), "satz_wert": 150.0, "status": "OFFEN",
+        }
+
+    def vermietung_schliessen(self, rnd: random.Random):
+        with self.lock:
+            offen = self.offen.pop() if self.offen else None
+        if offen is None:
+            return self.vermietung_anlegen(rnd)
+        vid, ende = offen
+        return "POST", f"/vermietungen/{vid}/schliessen", {"end_datum": ende, "stunden_ist": 42.0}
+
+    def abrechnung(self, rnd: random.Random):
+        return "GET", f"/berichte/vermietungen/{rnd.choice(self.daten['geschlossen'])}/abrechnung", None
+
+    def auslastung(self, rnd: random.Random):
+        jahr, monat = rnd.choice([2021, 2022, 2023]), rnd.randrange(1, 13)
+        start = date(jahr, monat, 1)
+        ende = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return "GET", f"/berichte/auslastung?fenster_start={start}&fenster_ende={ende}", None
+
+def _perzentil(werte: List[float], p: float) -> float:
+    if not werte: return 0.0
+    w = sorted(werte)
+    return w[min(len(w) - 1, max(0, int(round(p / 100.0 * len(w) + 0.5)) - 1))]
+
+def last_fahren(port: int, ops: Operationen, mix: Dict[str, int], clients: int, dauer: float
+                ) -> Tuple[Dict[str, List[float]], Dict[str, int], Dict[str, int], float]:
+    namen = list(mix)
+    gewichte = [mix[n] for n in namen]
+    latenzen: Dict[str, List[float]] = {n: [] for n in namen}
+    fehler: Dict[str, int] = {n: 0 for n in namen}
+    konflikte: Dict[str, int] = {n: 0 for n in namen}
+    ende = time.perf_counter() + dauer
+
+    def client(i: int):
+        rnd = random.Random(i)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        lokal: Dict[str, List[float]] = {n: [] for n in namen}
+        while time.perf_counter() < ende:
+            name = rnd.choices(namen, gewichte)[0]
+            methode, pfad, body = getattr(ops, name)(rnd)
+            t0 = time.perf_counter()
+            try:
+                conn.request(methode, pfad, body=json.dumps(body) if body is not None else None,
+                             headers={"Content-Type": "application/json"})
+                r = conn.getresponse(); daten = r.read()
+            except (OSError, http.client.HTTPException):
+                conn.close(); conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                fehler[name] += 1
+                continue
+            lokal[name].append((time.perf_counter() - t0) * 1000)
+            if r.status == 409:
+                konflikte[name] += 1
+            elif r.status >= 400:
+                fehler[name] += 1
+            elif pfad == "/vermietungen":   # auch der Rueckfall von vermietung_schliessen
+                with ops.lock:
+                    ops.offen.append((json.loads(daten)["id"], body["end_datum"]))
+        for n, werte in lokal.items():
+            latenzen[n].extend(werte)   # list.extend ist unter dem GIL atomar
+        conn.close()
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return latenzen, fehler, konflikte, time.perf_counter() - t0
+
+# -------------------- Bericht --------------------
+
+def bericht(latenzen, fehler, konflikte, laufzeit: float, slo: Dict[str, Dict[str, float]]) -> int:
+    verstoesse = 0
+    gesamt = sum(len(v) for v in latenzen.values())
+    print(f"\n{gesamt} Anfragen in {laufzeit:.1f}s = {gesamt / laufzeit:.0f} req/s\n")
+    print(f"{'Operation':<24}{'n':>7}{'req/s':>8}{'Fehler':>8}{'409':>6}{'p50':>8}{'p95':>8}{'p99':>8}  SLO")
+    for name, werte in latenzen.items():
+        p = {k: _perzentil(werte, k) for k in (50, 95, 99)}
+        ziel = slo.get(name, {})
+        verletzt = [f"p{k}>{ziel[f'p{k}_ms']:.0f}" for k in (50, 95, 99) if f"p{k}_ms" in ziel and p[k] > ziel[f"p{k}_ms"]]
+        if fehler[name]: verletzt.append("Fehler")
+        verstoesse += bool(verletzt)
+        print(f"{name:<24}{len(werte):>7}{len(werte) / laufzeit:>8.1f}{fehler[name]:>8}{konflikte[name]:>6}"
+              f"{p[50]:>8.1f}{p[95]:>8.1f}{p[99]:>8.1f}  {'OK' if not verletzt else ', '.join(verletzt)}")
+    return verstoesse
+
+def _mix(text: str) -> Dict[str, int]:
+    out = {}
+    for teil in text.split(","):
+        name, _, gewicht = teil.partition("=")
+        if not hasattr(Operationen, name.strip()): raise SystemExit(f"unbekannte Operation '{name}'")
+        out[name.strip()] = int(gewicht or 1)
+    return out
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--dauer", type=float, default=30.0, help="Sekunden")
+    ap.add_argument("--clients", type=int, default=20)
+    ap.add_argument("--geraete", type=int, default=300)
+    ap.add_argument("--historie", type=int, default=20000, help="geschlossene Vermietungen")
+    ap.add_argument("--mix", type=_mix, default=_mix(
+        "geraete_list=40,vermietung_anlegen=15,vermietung_schliessen=15,abrechnung=20,auslastung=10"))
+    ap.add_argument("--slo", default=os.path.join(HIER, "lasttest_slo.json"))
+    args = ap.parse_args(argv)
+
+    os.environ.setdefault("FLOTTE_DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "lasttest.db"))
+    t0 = time.perf_counter()
+    daten = befuellen(args.geraete, args.historie)
+    print(f"Testbestand: {len(daten['geraete'])} Geraete, {len(daten['geschlossen'])} Vermietungen "
+          f"({time.perf_counter() - t0:.1f}s)")
+
+    port = _freier_port()
+    server = server_starten(port)
+    try:
+        latenzen, fehler, konflikte, laufzeit = last_fahren(port, Operationen(daten), args.mix, args.clients, args.dauer)
+    finally:
+        server.terminate(); server.wait(10)
+    with open(args.slo, encoding="utf-8") as fh:
+        slo = json.load(fh)
+    return 1 if bericht(latenzen, fehler, konflikte, laufzeit, slo) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,433 @@
+# migrationen.py
+"""Versionierte Schema-Migrationen fuer flotte_v3_de.
+
+Laeuft ausserhalb des API-Prozesses (z.B. als Pre-Deploy-Kommando auf Render):
+
+    python -m migrationen            # auf neueste Version bringen
+    python -m migrationen --status   # aktuelle/ausstehende Versionen anzeigen
+
+Die API prueft beim Start die Schema-Version und bricht ab, wenn die DB hinter ``MIGRATIONEN`` liegt
+(``FLOTTE_AUTO_MIGRATION=1`` migriert stattdessen beim Start, fuer lokale/Demo-Instanzen). Auf Render
+gehoert ``python -m migrationen`` deshalb als Pre-Deploy-Kommando vor jeden Deploy.
+
+Jede Migration ist idempotent (checkfirst / IF NOT EXISTS), damit Bestands-DBs aus der Zeit von
+``create_all`` ohne Sonderbehandlung uebernommen werden, und bringt ihr Schema als eingefrorene DDL mit.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import (
+    CheckConstraint, Column, Date, DateTime, Enum as SAEnum, Float, ForeignKey, Integer, MetaData, String, Table,
+    UniqueConstraint, column, create_engine, func, insert, inspect, make_url, select, table, text,
+)
+from sqlalchemy.engine import Connection, Engine
+
+from flotte_v3_de import ENGINE
+
+_meta = MetaData()
+schema_version = Table(
+    "schema_version", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("beschreibung", String(200), nullable=False),
+    Column("angewendet_am", DateTime, nullable=False),
+)
+
+# Jede Migration beschreibt ihr Schema selbst (eingefroren): Tabellen als Core-Table, Indizes als DDL.
+# Nichts wird aus den aktuellen Modellen gelesen, damit neue und migrierte DBs dasselbe Schema haben.
+
+# -------------------- Bausteine --------------------
+
+def _geraet_status() -> SAEnum:
+    return SAEnum("VERFUEGBAR", "VERMIETET", "WARTUNG", "AUSGEMUSTERT", name="geraetstatus")
+
+def _standort_typ() -> SAEnum:
+    return SAEnum("MIETPARK", "KUNDE", name="standorttyp")
+
+def _tabellen_anlegen(conn: Connection, meta: MetaData, *namen: str) -> None:
+    meta.create_all(conn, tables=[meta.tables[n] for n in namen], checkfirst=True)
+
+def _index_anlegen(conn: Connection, name: str, tabelle: str, *spalten: str) -> None:
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {tabelle} ({', '.join(spalten)})"))
+
+def _index_entfernen(conn: Connection, name: str) -> None:
+    conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+def _spalte_hinzufuegen(conn: Connection, tabelle: str, spalte: str, ddl: str) -> None:
+    if spalte not in {c["name"] for c in inspect(conn).get_columns(tabelle)}:
+        conn.execute(text(f"ALTER TABLE {tabelle} ADD COLUMN {spalte} {ddl}"))
+
+def _geraet_verweis(meta: MetaData) -> None:
+    # nur als FK-Ziel, wird nicht angelegt
+    Table("geraet", meta, Column("id", Integer, primary_key=True))
+
+# -------------------- Migrationen --------------------
+
+def _m001_basisschema(conn: Connection) -> None:
+    """Stand vor den Migrationen (frueher per create_all beim Import)."""
+    m = MetaData()
+    Table("firma", m,
+          Column("id", Integer, primary_key=True),
+          Column("name", String(160), nullable=False),
+          Column("land", String(2)))
+    Table("mietpark", m,
+          Column("id", Integer, primary_key=True),
+          Column("name", String(160), nullable=False),
+          Column("adresse", String(260)))
+    Table("kunde", m,
+          Column("id", Integer, primary_key=True),
+          Column("name", String(160), nullable=False),
+          Column("email", String(160)),
+          Column("telefon", String(60)),
+          Column("rechnungsadresse", String(260)),
+          Column("ust_id", String(40)))
+    Table("baustelle", m,
+          Column("id", Integer, primary_key=True),
+          Column("kunde_id", ForeignKey("kunde.id", ondelete="SET NULL")),
+          Column("name", String(160), nullable=False),
+          Column("adresse", String(260)),
+          Column("stadt", String(120)),
+          Column("land", String(2)))
+    Table("geraet", m,
+          Column("id", Integer, primary_key=True),
+          Column("eigentuemer_firma_id", ForeignKey("firma.id", ondelete="SET NULL")),
+          Column("name", String(120), nullable=False),
+          Column("kategorie", String(60), nullable=False),
+          Column("modell", String(120)),
+          Column("seriennummer", String(120)),
+          Column("status", _geraet_status(), nullable=False),
+          Column("stundenzaehler", Float, nullable=False),
+          Column("stunden_pro_tag", Integer, nullable=False),
+          Column("kauf_datum", Date),
+          Column("anschaffungspreis", Float, nullable=False),
+          Column("standort_typ", _standort_typ(), nullable=False),
+          Column("akt_mietpark_id", ForeignKey("mietpark.id", ondelete="SET NULL")),
+          Column("akt_baustelle_id", ForeignKey("baustelle.id", ondelete="SET NULL")),
+          Column("heim_mietpark_id", ForeignKey("mietpark.id", ondelete="SET NULL")))
+    Table("vermietung", m,
+          Column("id", Integer, primary_key=True),
+          Column("geraet_id", ForeignKey("geraet.id", ondelete="RESTRICT"), nullable=False),
+          Column("kunde_id", ForeignKey("kunde.id", ondelete="RESTRICT"), nullable=False),
+          Column("baustelle_id", ForeignKey("baustelle.id", ondelete="SET NULL")),
+          Column("start_datum", Date, nullable=False),
+          Column("end_datum", Date),
+          Column("zaehler_start", Float),
+          Column("zaehler_ende", Float),
+          Column("stunden_ist", Float),
+          Column("satz_wert", Float, nullable=False),
+          Column("satz_einheit", SAEnum("TAEGLICH", "MONATLICH", name="satzeinheit"), nullable=False),
+          Column("status", SAEnum("RESERVIERT", "OFFEN", "GESCHLOSSEN", "STORNIERT", name="vermietstatus"), nullable=False),
+          Column("notizen", String(500)),
+          CheckConstraint("(zaehler_ende IS NULL) OR (zaehler_start IS NULL) OR (zaehler_ende >= zaehler_start)",
+                          name="ck_zaehler_nichtnegativ"))
+    Table("vermietung_position", m,
+          Column("id", Integer, primary_key=True),
+          Column("vermietung_id", ForeignKey("vermietung.id", ondelete="CASCADE"), nullable=False),
+          Column("typ", SAEnum("MONTAGE", "ERSATZTEIL", "SERVICEPAUSCHALE", "VERSICHERUNG", "SONSTIGES", name="postyp"),
+                 nullable=False),
+          Column("text", String(200)),
+          Column("menge", Float, nullable=False),
+          Column("einheit", String(20)),
+          Column("preis_einzel", Float, nullable=False),
+          Column("kosten_einzel", Float, nullable=False))
+    Table("rechnung", m,
+          Column("id", Integer, primary_key=True),
+          Column("vermietung_id", ForeignKey("vermietung.id", ondelete="CASCADE"), nullable=False),
+          Column("nummer", String(60), nullable=False),
+          Column("datum", Date, nullable=False),
+          Column("betrag_netto", Float),
+          Column("bezahlt", Integer, nullable=False),
+          UniqueConstraint("nummer", name="uq_rechnung_nummer"))
+    Table("wartung", m,
+          Column("id", Integer, primary_key=True),
+          Column("geraet_id", ForeignKey("geraet.id", ondelete="CASCADE"), nullable=False),
+          Column("start_datum", Date, nullable=False),
+          Column("end_datum", Date, nullable=False),
+          Column("grund", String(160)),
+          Column("notizen", String(500)))
+    Table("zaehlerstand", m,
+          Column("id", Integer, primary_key=True),
+          Column("geraet_id", ForeignKey("geraet.id", ondelete="CASCADE"), nullable=False),
+          Column("zeitpunkt", DateTime, nullable=False),
+          Column("art", SAEnum("ABGABE", "RUECKNAHME", "PERIODISCH", name="zaehlerart"), nullable=False),
+          Column("stand", Float, nullable=False))
+    m.create_all(conn, checkfirst=True)
+
+def _m002_outbox(conn: Connection) -> None:
+    m = MetaData()
+    Table("aenderung_ereignis", m,
+          Column("id", Integer, primary_key=True),
+          Column("zeitpunkt", DateTime, nullable=False),
+          Column("typ", String(40), nullable=False),
+          Column("entitaet", String(40), nullable=False),
+          Column("entitaet_id", Integer, nullable=False),
+          Column("daten", String(500)),
+          sqlite_autoincrement=True)
+    _tabellen_anlegen(conn, m, "aenderung_ereignis")
+
+def _m003_hot_path_indizes(conn: Connection) -> None:
+    _index_anlegen(conn, "ix_vermietung_geraet_start", "vermietung", "geraet_id", "start_datum")
+    _index_anlegen(conn, "ix_vermietung_kunde", "vermietung", "kunde_id")
+    _index_anlegen(conn, "ix_vermietung_start", "vermietung", "start_datum")
+    _index_anlegen(conn, "ix_vermietung_ende", "vermietung", "end_datum")
+    _index_anlegen(conn, "ix_position_vermietung", "vermietung_position", "vermietung_id")
+    _index_anlegen(conn, "ix_rechnung_vermietung", "rechnung", "vermietung_id")
+    _index_anlegen(conn, "ix_wartung_geraet", "wartung", "geraet_id")
+    _index_anlegen(conn, "ix_zaehlerstand_geraet_zeit", "zaehlerstand", "geraet_id", "zeitpunkt")
+
+def _m004_buchungs_konflikte(conn: Connection) -> None:
+    _spalte_hinzufuegen(conn, "geraet", "buchungs_version", "INTEGER NOT NULL DEFAULT 0")
+    if conn.dialect.name == "postgresql":
+        # Doppelbuchungen auf Speicherebene ausschliessen (offenes Ende = unbegrenzter Bereich)
+        if conn.scalar(text("SELECT 1 FROM pg_constraint WHERE conname = 'ex_vermietung_zeitraum'")):
+            return
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+        # Bestehende Ueberlappungen vorher melden, sonst scheitert ADD CONSTRAINT ohne Hinweis auf die Saetze
+        ueberlappend = conn.execute(text(
+            "SELECT a.geraet_id, a.id, b.id FROM vermietung a JOIN vermietung b "
+            "ON a.geraet_id = b.geraet_id AND a.id < b.id "
+            "AND daterange(a.start_datum, a.end_datum, '[]') && daterange(b.start_datum, b.end_datum, '[]') "
+            "WHERE a.status <> 'STORNIERT' AND b.status <> 'STORNIERT' ORDER BY a.geraet_id, a.id LIMIT 50"
+        )).all()
+        if ueberlappend:
+            liste = ", ".join(f"Geraet {g}: {a}/{b}" for g, a, b in ueberlappend)
+            raise RuntimeError(f"Ueberlappende Vermietungen verhindern ex_vermietung_zeitraum "
+                               f"(erst bereinigen, max. 50 gezeigt): {liste}")
+        conn.execute(text(
+            "ALTER TABLE vermietung ADD CONSTRAINT ex_vermietung_zeitraum EXCLUDE USING gist "
+            "(geraet_id WITH =, daterange(start_datum, end_datum, '[]') WITH &&) "
+            "WHERE (status <> 'STORNIERT')"
+        ))
+
+def _m005_archiv_stand(conn: Connection) -> None:
+    m = MetaData()
+    Table("archiv_stand", m,
+          Column("id", Integer, primary_key=True),
+          Column("bis_datum", Date),
+          Column("aktualisiert_am", DateTime, nullable=False))
+    _tabellen_anlegen(conn, m, "archiv_stand")
+
+def _m006_offene_posten(conn: Connection) -> None:
+    _index_anlegen(conn, "ix_rechnung_vermietung_konto", "rechnung", "vermietung_id", "bezahlt", "datum", "betrag_netto")
+    _index_anlegen(conn, "ix_rechnung_offen", "rechnung", "bezahlt", "datum", "vermietung_id", "betrag_netto")
+    _index_entfernen(conn, "ix_rechnung_vermietung")   # Praefix von ix_rechnung_vermietung_konto
+
+def _m007_vermietung_status(conn: Connection) -> None:
+    _index_anlegen(conn, "ix_vermietung_status", "vermietung", "status")
+    if conn.dialect.name == "sqlite":
+        # Ohne Statistik waehlt SQLite zwischen ix_vermietung_status und ix_vermietung_geraet_start
+        # nach Anlagereihenfolge; ANALYZE zeigt ihm, dass status kaum selektiv ist
+        conn.execute(text("ANALYZE"))
+
+def _m008_aenderungs_version(conn: Connection) -> None:
+    # Bestandszeilen behalten 0: sie kommen ueber den Vollabgleich (since=0), Deltas starten danach
+    for tabelle in ("firma", "mietpark", "kunde", "baustelle", "geraet"):
+        _spalte_hinzufuegen(conn, tabelle, "aenderungs_version", "INTEGER NOT NULL DEFAULT 0")
+        _index_anlegen(conn, f"ix_{tabelle}_aenderung", tabelle, "aenderungs_version")
+
+# Archiv bis Migration 011: eigene DB (FLOTTE_ARCHIV_DB_URL, sonst diese SQLite-Datei)
+_ALT_ARCHIV_URL = os.environ.get("FLOTTE_ARCHIV_DB_URL", "sqlite:///flotte_v3_archiv.db")
+
+def _m009_geraet_historie(conn: Connection) -> None:
+    """Historie anlegen und aus den Vermietungen (inkl. Archiv) rekonstruieren. Rueckgaben fuehren zum
+    Heim-Mietpark (der tatsaechliche Rueckgabe-Mietpark ist nur fuer den aktuellen Stand bekannt)."""
+    m = MetaData()
+    _geraet_verweis(m)
+    gh = Table("geraet_historie", m,
+               Column("id", Integer, primary_key=True),
+               Column("geraet_id", ForeignKey("geraet.id", ondelete="CASCADE"), nullable=False),
+               Column("gueltig_ab", Date, nullable=False),
+               Column("status", _geraet_status(), nullable=False),
+               Column("standort_typ", _standort_typ(), nullable=False),
+               Column("akt_mietpark_id", Integer),
+               Column("akt_baustelle_id", Integer))
+    _tabellen_anlegen(conn, m, "geraet_historie")
+    _index_anlegen(conn, "ix_geraet_historie_stichtag", "geraet_historie", "geraet_id", "gueltig_ab", "id")
+    if conn.scalar(select(func.count()).select_from(gh)):
+        return
+
+    mieten: dict = {}
+    v = table("vermietung", column("geraet_id"), column("start_datum", Date), column("end_datum", Date),
+              column("baustelle_id"), column("status"))
+    for gid, start, ende, bst, st in conn.execute(
+        select(v.c.geraet_id, v.c.start_datum, v.c.end_datum, v.c.baustelle_id, v.c.status)
+        .where(v.c.status.in_(["OFFEN", "GESCHLOSSEN"]))
+    ):   # OFFEN: end_datum ist nur geplant, die Rueckgabe steht noch aus
+        mieten.setdefault(gid, []).append((start, ende if st == "GESCHLOSSEN" else None, bst))
+    stand = table("archiv_stand", column("id"), column("bis_datum", Date))
+    if conn.scalar(select(stand.c.bis_datum).where(stand.c.id == 1)) is not None:
+        va = table("vermietung_archiv", column("geraet_id"), column("start_datum", Date), column("end_datum", Date),
+                   column("baustelle_id"))
+        archiv = create_engine(_ALT_ARCHIV_URL)
+        try:
+            with archiv.connect() as a:
+                for gid, start, ende, bst in a.execute(select(va.c.geraet_id, va.c.start_datum, va.c.end_datum,
+                                                              va.c.baustelle_id)):
+                    mieten.setdefault(gid, []).append((start, ende, bst))
+        finally:
+            archiv.dispose()
+
+    g = table("geraet", column("id"), column("kauf_datum", Date), column("heim_mietpark_id"), column("status"),
+              column("standort_typ"), column("akt_mietpark_id"), column("akt_baustelle_id"))
+    zeilen = []
+    for r in conn.execute(select(g)):
+        eigene = [(r.kauf_datum or date.min, "VERFUEGBAR", "MIETPARK", r.heim_mietpark_id, None)]
+        for start, ende, bst in sorted(mieten.get(r.id, []), key=lambda x: x[0]):
+            eigene.append((start, "VERMIETET", "KUNDE", eigene[-1][3], bst))
+            if ende is not None:
+                eigene.append((ende + timedelta(days=1), "VERFUEGBAR", "MIETPARK", r.heim_mietpark_id, None))
+        aktuell = (r.status, r.standort_typ, r.akt_mietpark_id, r.akt_baustelle_id)
+        if eigene[-1][1:] != aktuell:   # z.B. anderer Rueckgabe-Mietpark: aktueller Stand gilt ab letztem Uebergang
+            eigene.append((eigene[-1][0],) + aktuell)
+        zeilen += [dict(geraet_id=r.id, gueltig_ab=ab, status=st, standort_typ=typ, akt_mietpark_id=mp, akt_baustelle_id=bst)
+                   for ab, st, typ, mp, bst in eigene]
+    for i in range(0, len(zeilen), 5000):
+        conn.execute(insert(gh), zeilen[i:i + 5000])
+
+def _m010_keyset_indizes(conn: Connection) -> None:
+    _index_anlegen(conn, "ix_vermietung_kunde_start", "vermietung", "kunde_id", "start_datum", "id")
+    _index_anlegen(conn, "ix_vermietung_status_start", "vermietung", "status", "start_datum", "id")
+    _index_anlegen(conn, "ix_vermietung_start_id", "vermietung", "start_datum", "id")
+    _index_anlegen(conn, "ix_geraet_status", "geraet", "status", "id")
+    _index_anlegen(conn, "ix_geraet_standort", "geraet", "standort_typ", "id")
+    _index_anlegen(conn, "ix_baustelle_kunde", "baustelle", "kunde_id", "id")
+    for alt in ("ix_vermietung_kunde", "ix_vermietung_status", "ix_vermietung_start"):   # jeweils Praefix der neuen
+        _index_entfernen(conn, alt)
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("ANALYZE"))
+
+def _m011_archiv_im_primaer(conn: Connection) -> None:
+    """Archivtabellen in den Primaer holen (gleiche Sicherung, Constraints ueber beide Ebenen pruefbar) und
+    eine bestehende Archiv-DB uebernehmen. Halb archivierte Zeilen (Abbruch zwischen Kopieren und Loeschen
+    im alten Ablauf) bleiben heiss und werden beim naechsten Lauf erneut archiviert."""
+    m = MetaData()
+    va = Table("vermietung_archiv", m,
+               Column("id", Integer, primary_key=True, autoincrement=False),
+               Column("geraet_id", Integer, nullable=False),
+               Column("kunde_id", Integer, nullable=False),
+               Column("baustelle_id", Integer),
+               Column("start_datum", Date, nullable=False),
+               Column("end_datum", Date, nullable=False),
+               Column("stunden_ist", Float),
+               Column("satz_wert", Float, nullable=False),
+               Column("satz_einheit", SAEnum("TAEGLICH", "MONATLICH", name="satzeinheit"), nullable=False),
+               Column("miete", Float, nullable=False),
+               Column("positionen_einnahmen", Float, nullable=False),
+               Column("kosten_gesamt", Float, nullable=False),
+               Column("archiviert_am", DateTime, nullable=False))
+    ra = Table("rechnung_archiv", m,
+               Column("id", Integer, primary_key=True, autoincrement=False),
+               Column("vermietung_id", Integer, nullable=False),
+               Column("nummer", String(60), nullable=False),
+               Column("datum", Date, nullable=False),
+               Column("betrag_netto", Float),
+               Column("bezahlt", Integer, nullable=False))
+    za = Table("zaehlerstand_archiv", m,
+               Column("id", Integer, primary_key=True, autoincrement=False),
+               Column("geraet_id", Integer, nullable=False),
+               Column("zeitpunkt", DateTime, nullable=False),
+               Column("art", SAEnum("ABGABE", "RUECKNAHME", "PERIODISCH", name="zaehlerart"), nullable=False),
+               Column("stand", Float, nullable=False))
+    _tabellen_anlegen(conn, m, "vermietung_archiv", "rechnung_archiv", "zaehlerstand_archiv")
+    _index_anlegen(conn, "ix_vermietung_archiv_geraet_start", "vermietung_archiv", "geraet_id", "start_datum")
+    _index_anlegen(conn, "ix_vermietung_archiv_kunde", "vermietung_archiv", "kunde_id")
+    _index_anlegen(conn, "ix_vermietung_archiv_zeitraum", "vermietung_archiv", "start_datum", "end_datum")
+    _index_anlegen(conn, "ix_rechnung_archiv_vermietung", "rechnung_archiv", "vermietung_id")
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ux_rechnung_archiv_nummer ON rechnung_archiv (nummer)"))
+    _index_anlegen(conn, "ix_zaehlerstand_archiv_geraet_zeit", "zaehlerstand_archiv", "geraet_id", "zeitpunkt")
+
+    stand = table("archiv_stand", column("id"), column("bis_datum", Date))
+    if conn.scalar(select(stand.c.bis_datum).where(stand.c.id == 1)) is None:
+        return   # nie archiviert
+    if conn.scalar(select(func.count()).select_from(va)):
+        return   # bereits uebernommen
+    url = make_url(_ALT_ARCHIV_URL)
+    if url.get_backend_name() == "sqlite" and not os.path.exists(url.database or ""):
+        raise RuntimeError(f"Archiv-DB {url} nicht gefunden: FLOTTE_ARCHIV_DB_URL auf die bisherige Archiv-DB setzen")
+    archiv = create_engine(url)
+    try:
+        with archiv.connect() as a:
+            vorhanden = set(inspect(a).get_table_names())
+            for t in (va, ra, za):
+                if t.name not in vorhanden: continue
+                res = a.execute(select(t))
+                while zeilen := res.fetchmany(5000):
+                    conn.execute(insert(t), [z._asdict() for z in zeilen])
+    finally:
+        archiv.dispose()
+    conn.execute(text("DELETE FROM rechnung_archiv WHERE vermietung_id IN (SELECT id FROM vermietung)"))
+    conn.execute(text("DELETE FROM vermietung_archiv WHERE id IN (SELECT id FROM vermietung)"))
+    conn.execute(text("DELETE FROM zaehlerstand_archiv WHERE id IN (SELECT id FROM zaehlerstand)"))
+
+def _m012_ereignis_position(conn: Connection) -> None:
+    # Bestehende Ereignisse behalten ihre ID als Position (bisheriger Resume-Offset gilt weiter)
+    _spalte_hinzufuegen(conn, "aenderung_ereignis", "position", "INTEGER")
+    conn.execute(text("UPDATE aenderung_ereignis SET position = id WHERE position IS NULL"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ux_aenderung_ereignis_position ON aenderung_ereignis (position)"))
+    m = MetaData()
+    Table("ereignis_position", m,
+          Column("id", Integer, primary_key=True),
+          Column("wert", Integer, nullable=False))
+    _tabellen_anlegen(conn, m, "ereignis_position")
+    if not conn.scalar(text("SELECT COUNT(*) FROM ereignis_position")):
+        conn.execute(text("INSERT INTO ereignis_position (id, wert) "
+                          "SELECT 1, COALESCE(MAX(position), 0) FROM aenderung_ereignis"))
+
+MIGRATIONEN: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Basisschema", _m001_basisschema),
+    (2, "Outbox aenderung_ereignis", _m002_outbox),
+    (3, "Indizes fuer Ueberlappung, Auslastung und Detail-Listen", _m003_hot_path_indizes),
+    (4, "Buchungsversion je Geraet, Exclusion-Constraint (Postgres)", _m004_buchungs_konflikte),
+    (5, "Archiv-Markierung archiv_stand", _m005_archiv_stand),
+    (6, "Abdeckende Rechnungs-Indizes fuer Kundenkonto & offene Posten", _m006_offene_posten),
+    (7, "Index fuer Statusfilter der Vermietungsliste", _m007_vermietung_status),
+    (8, "Aenderungsversion der Stammdaten fuer /sync", _m008_aenderungs_version),
+    (9, "Status-/Standort-Historie geraet_historie (mit Rueckbefuellung)", _m009_geraet_historie),
+    (10, "Indizes fuer Keyset-Paginierung der Listen", _m010_keyset_indizes),
+    (11, "Archivtabellen im Primaer (Uebernahme der Archiv-DB)", _m011_archiv_im_primaer),
+    (12, "Commit-geordnete Outbox-Position", _m012_ereignis_position),
+]
+
+# -------------------- Runner --------------------
+
+def aktuelle_version(conn: Connection) -> int:
+    schema_version.create(conn, checkfirst=True)
+    return conn.scalar(select(schema_version.c.version).order_by(schema_version.c.version.desc()).limit(1)) or 0
+
+def migrieren(engine: Optional[Engine] = None, ziel: Optional[int] = None) -> List[int]:
+    """Wendet alle ausstehenden Migrationen (bis ``ziel``) je in eigener Transaktion an."""
+    engine = engine or ENGINE
+    angewendet: List[int] = []
+    with engine.begin() as conn:
+        stand = aktuelle_version(conn)
+    for version, beschreibung, fn in MIGRATIONEN:
+        if version <= stand or (ziel is not None and version > ziel):
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(schema_version.insert().values(
+                version=version, beschreibung=beschreibung, angewendet_am=datetime.utcnow()))
+        angewendet.append(version)
+    return angewendet
+
+def _main(argv: List[str]) -> int:
+    engine = ENGINE
+    if "--status" in argv:
+        with engine.begin() as conn:
+            stand = aktuelle_version(conn)
+        print(f"Schema-Version: {stand}")
+        for version, beschreibung, _ in MIGRATIONEN:
+            print(f"  {'x' if version <= stand else ' '} {version:03d} {beschreibung}")
+        return 0
+    t0 = time.perf_counter()
+    neu = migrieren(engine)
+    dauer = (time.perf_counter() - t0) * 1000
+    print(f"Migrationen angewendet: {neu or 'keine'} ({dauer:.0f} ms)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,136 @@
+# nachtlauf.py
+"""Naechtliche Berichte ohne HTTP/FastAPI: direkt gegen die DB, parallel in Worker-Prozessen.
+
+    python -m nachtlauf auslastung --von 2025-01-01 --bis 2025-01-31
+    python -m nachtlauf finanzen
+    python -m nachtlauf abrechnungsvorschau [--stichtag 2025-01-31]
+
+    Optionen: --worker N (Standard: CPU-Anzahl)  --chunk 200  --aus nachtlauf/  --format csv|parquet
+
+Die Arbeit wird nach Geraeten (auslastung, finanzen) bzw. Kunden (abrechnungsvorschau) in Chunks
+zerlegt. Jeder Worker verwirft die geerbten Engines und oeffnet eigene Lese-Sessions. Fortschritt und
+Zeiten je Chunk gehen nach stderr, damit sich die Chunk-Groesse einstellen laesst.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+import flotte_v3_de as f
+
+try:   # optional: --format parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+Zeile = Dict[str, object]
+
+# -------------------- Jobs (laufen im Worker) --------------------
+
+def _auslastung(ids: List[int], p: Dict[str, object]) -> List[Zeile]:
+    with f.lese_session() as s:
+        _, pro = f.flotten_auslastung_iststunden(s, p["von"], p["bis"], geraet_ids=ids)
+    return [{"geraet_id": gid, "von": p["von"], "bis": p["bis"], "auslastung": round(wert, 4)}
+            for gid, wert in sorted(pro.items())]
+
+def _finanzen(ids: List[int], p: Dict[str, object]) -> List[Zeile]:
+    with f.lese_session() as s:
+        return [{"geraet_id": gid, **f.geraet_finanz_uebersicht(s, gid)} for gid in ids]
+
+def _abrechnungsvorschau(ids: List[int], p: Dict[str, object]) -> List[Zeile]:
+    with f.lese_session() as s:
+        return [{"stichtag": p["stichtag"], **z} for z in f.abrechnung_vorschau(s, p["stichtag"], kunde_ids=ids)]
+
+def _geraete_ids() -> List[int]:
+    with f.lese_session() as s:
+        return list(s.scalars(select(f.Geraet.id).where(f.Geraet.status != f.GeraetStatus.AUSGEMUSTERT).order_by(f.Geraet.id)))
+
+def _kunden_mit_offenen() -> List[int]:
+    with f.lese_session() as s:
+        return list(s.scalars(select(f.Vermietung.kunde_id).where(f.Vermietung.status == f.VermietStatus.OFFEN)
+                              .distinct().order_by(f.Vermietung.kunde_id)))
+
+# name -> (Einheiten auflisten, Chunk verarbeiten)
+JOBS: Dict[str, Tuple[Callable[[], List[int]], Callable[[List[int], Dict[str, object]], List[Zeile]]]] = {
+    "auslastung": (_geraete_ids, _auslastung),
+    "finanzen": (_geraete_ids, _finanzen),
+    "abrechnungsvorschau": (_kunden_mit_offenen, _abrechnungsvorschau),
+}
+
+def _worker_start() -> None:
+    f.engines_verwerfen()   # geerbte Verbindungen (fork) nicht mit dem Elternprozess teilen
+
+def _chunk_ausfuehren(job: str, ids: List[int], parameter: Dict[str, object]) -> Tuple[List[Zeile], float]:
+    t0 = time.perf_counter()
+    zeilen = JOBS[job][1](ids, parameter)
+    return zeilen, time.perf_counter() - t0
+
+# -------------------- Ausgabe --------------------
+
+def schreiben(zeilen: List[Zeile], pfad: str, format: str) -> str:
+    os.makedirs(os.path.dirname(pfad) or ".", exist_ok=True)
+    if format == "parquet":
+        pfad += ".parquet"
+        pq.write_table(pa.Table.from_pylist(zeilen), pfad)
+        return pfad
+    pfad += ".csv"
+    with open(pfad, "w", newline="", encoding="utf-8") as fh:
+        w = csv.DictWriter(fh, fieldnames=list(zeilen[0]) if zeilen else ["leer"])
+        w.writeheader()
+        w.writerows(zeilen)
+    return pfad
+
+# -------------------- CLI --------------------
+
+def ausfuehren(job: str, parameter: Dict[str, object], worker: int, chunk: int) -> List[Zeile]:
+    einheiten = JOBS[job][0]()
+    chunks = [einheiten[i:i + chunk] for i in range(0, len(einheiten), chunk)]
+    print(f"{job}: {len(einheiten)} Einheiten in {len(chunks)} Chunks a {chunk}, {worker} Worker", file=sys.stderr)
+    ergebnis: Dict[int, List[Zeile]] = {}
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=worker, initializer=_worker_start) as pool:
+        laeufe = {pool.submit(_chunk_ausfuehren, job, c, parameter): i for i, c in enumerate(chunks)}
+        for n, fut in enumerate(as_completed(laeufe), 1):
+            i = laeufe[fut]
+            zeilen, dauer = fut.result()
+            ergebnis[i] = zeilen
+            print(f"  [{n}/{len(chunks)}] Chunk {i}: {len(chunks[i])} Einheiten, {len(zeilen)} Zeilen, "
+                  f"{dauer:.2f}s ({time.perf_counter() - t0:.1f}s gesamt)", file=sys.stderr)
+    return [z for i in range(len(chunks)) for z in ergebnis[i]]   # Reihenfolge stabil wie die Einheiten
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m nachtlauf", description=__doc__.splitlines()[0])
+    ap.add_argument("job", choices=sorted(JOBS))
+    ap.add_argument("--von", type=date.fromisoformat)
+    ap.add_argument("--bis", type=date.fromisoformat)
+    ap.add_argument("--stichtag", type=date.fromisoformat, default=date.today())
+    ap.add_argument("--worker", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--chunk", type=int, default=200, help="Geraete bzw. Kunden je Aufgabe")
+    ap.add_argument("--aus", default="nachtlauf", help="Ausgabeverzeichnis")
+    ap.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    args = ap.parse_args(argv)
+    if args.job == "auslastung" and (args.von is None or args.bis is None or args.bis < args.von):
+        ap.error("auslastung braucht --von <= --bis")
+    if args.format == "parquet" and pa is None:
+        ap.error("--format parquet braucht pyarrow (pip install pyarrow)")
+
+    parameter = {"von": args.von, "bis": args.bis, "stichtag": args.stichtag}
+    t0 = time.perf_counter()
+    zeilen = ausfuehren(args.job, parameter, args.worker, max(args.chunk, 1))
+    pfad = schreiben(zeilen, os.path.join(args.aus, f"{args.job}_{date.today():%Y%m%d}"), args.format)
+    dauer = time.perf_counter() - t0
+    print(f"{len(zeilen)} Zeilen -> {pfad} in {dauer:.2f}s ({len(zeilen) / dauer if dauer else 0:.0f} Zeilen/s)",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+# replika_pruefung.py
+"""Read-your-writes: Routing gegen eine Lese-Replika und Stammsatz-Cache ueber Prozessgrenzen.
+
+    python replika_pruefung.py     # Exit-Code 1 bei Verstoessen
+
+Zwei SQLite-Dateien in einem temporaeren Verzeichnis: Primaer (FLOTTE_DB_URL) und Replika
+(FLOTTE_LESE_DB_URL). Die "Replikation" ist eine Online-Sicherung (sqlite3 backup) des Primaers, dazwischen
+hinkt die Replika hinterher. Geprueft wird ueber die API:
+
+* ohne Token liest eine Liste von der Replika,
+* eine Schreibantwort traegt X-Konsistenz-Position (= Outbox-Position ihres Commits),
+* mit diesem Token liest die Liste vom Primaer, solange die Replika die Position nicht hat,
+* nach dem Nachziehen der Replika liest dieselbe Anfrage wieder von der Replika,
+* "X-Konsistenz: primaer" liest immer vom Primaer.
+
+Danach zwei uvicorn-Prozesse auf denselben Dateien (wie zwei Worker, Abgleich-Intervall des Stammsatz-Caches
+auf 60 s gestellt): A vermietet ein Geraet, B hat den Satz im Cache. Mit dem Token aus A's Antwort bzw. mit
+"X-Konsistenz: primaer" liefert B den neuen Status sofort, ohne Token den Cache-Stand.
+"""
+from __future__ import annotations
+
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+HIER = os.path.dirname(os.path.abspath(__file__))
+VERZ = tempfile.mkdtemp()
+PRIMAER, REPLIKA = os.path.join(VERZ, "primaer.db"), os.path.join(VERZ, "replika.db")
+os.environ["FLOTTE_DB_URL"] = "sqlite:///" + PRIMAER
+os.environ["FLOTTE_LESE_DB_URL"] = "sqlite:///" + REPLIKA
+
+from sqlalchemy import event
+
+import flotte_v3_de as f
+
+def replizieren() -> None:
+    f.LESE_ENGINE.dispose()   # keine offenen Verbindungen auf die Zieldatei waehrend der Sicherung
+    with sqlite3.connect(PRIMAER) as quelle, sqlite3.connect(REPLIKA) as ziel:
+        quelle.backup(ziel)
+
+class Quelle:
+    """Merkt sich, welche Engine die Geraete-Liste gelesen hat (Statements mit FROM geraet)."""
+
+    def __init__(self):
+        self.engines: List[str] = []
+        for name, engine in (("primaer", f.ENGINE), ("replika", f.LESE_ENGINE)):
+            event.listen(engine, "before_cursor_execute", self._merker(name))
+
+    def _merker(self, name: str):
+        def _mitschreiben(conn, cursor, statement, *args):
+            if "FROM geraet" in statement:
+                self.engines.append(name)
+        return _mitschreiben
+
+    def lesen(self, c, headers: dict) -> Tuple[str, List[int]]:
+        self.engines.clear()
+        r = c.get("/geraete?limit=500", headers=headers)
+        assert r.status_code == 200, r.text
+        return ",".join(dict.fromkeys(self.engines)), [g["id"] for g in r.json()]
+
+# -------------------- zwei Prozesse --------------------
+
+def _freier_port() -> int:
+    with socket.socket() as so:
+        so.bind(("127.0.0.1", 0))
+        return so.getsockname()[1]
+
+def server_starten(port: int) -> subprocess.Popen:
+    p = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_v3_de:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HIER, env=dict(os.environ, FLOTTE_STAMMSATZ_ABGLEICH_S="60"),
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return p
+        except OSError:
+            time.sleep(0.1)
+    p.kill()
+    raise RuntimeError("uvicorn startet nicht")
+
+def anfrage(port: int, methode: str, pfad: str, body: Optional[dict] = None,
+            headers: Optional[Dict[str, str]] = None) -> Tuple[dict, Dict[str, str]]:
+    c = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    c.request(methode, pfad, body=json.dumps(body) if body is not None else None,
+              headers={"Content-Type": "application/json", **(headers or {})})
+    r = c.getresponse()
+    daten = json.loads(r.read())
+    assert r.status == 200, (methode, pfad, r.status, daten)
+    return daten, {k.lower(): v for k, v in r.getheaders()}
+
+def prozesse_pruefen(pruefen, geraete: List[int], kunde: int) -> None:
+    port_a, port_b = _freier_port(), _freier_port()
+    a, b = server_starten(port_a), server_starten(port_b)
+
+    def vermieten(geraet: int) -> str:   # in A; liefert das Konsistenz-Token
+        _, kopf = anfrage(port_a, "POST", "/vermietungen", {"geraet_id": geraet, "kunde_id": kunde,
+                                                            "start_datum": str(date.today()), "satz_wert": 100.0})
+        return kopf.get("x-konsistenz-position", "")
+
+    def status_in_b(geraet: int, headers: Optional[Dict[str, str]] = None) -> str:
+        return anfrage(port_b, "GET", f"/geraete/{geraet}", headers=headers)[0]["status"]
+
+    try:
+        vorher = [status_in_b(g) for g in geraete]   # B lagert die Saetze ein
+        token = vermieten(geraete[0])
+        ohne = status_in_b(geraete[0])
+        pruefen("B ohne Token: Cache-Stand", ohne == vorher[0], f"{vorher[0]} -> {ohne}")
+        mit = status_in_b(geraete[0], {"X-Konsistenz-Position": token})
+        pruefen("B mit Token aus A: neuer Status", mit == "VERMIETET", f"Token {token}: {mit}")
+        vermieten(geraete[1])
+        primaer = status_in_b(geraete[1], {"X-Konsistenz": "primaer"})
+        pruefen("B mit X-Konsistenz: primaer", primaer == "VERMIETET", f"{vorher[1]} -> {primaer}")
+    finally:
+        for p in (a, b):
+            p.terminate(); p.wait(10)
+
+def main() -> int:
+    f.init_db()
+    with f.SessionLocal() as s:
+        mp = f.mietpark_anlegen(s, "Mietpark Replika").id
+        kunde = f.kunde_anlegen(s, "Kunde Replika").id
+        geraete = [f.geraet_anlegen(s, f"Replika {i}", "test", heim_mietpark_id=mp).id for i in range(3)]
+    replizieren()
+
+    from fastapi.testclient import TestClient
+    import api_v3_de
+    c = TestClient(api_v3_de.app)
+    quelle = Quelle()
+    ergebnisse: List[Tuple[str, bool, str]] = []
+
+    def pruefen(name: str, ok: bool, info: str = "") -> None:
+        ergebnisse.append((name, ok, info))
+
+    engine, ids = quelle.lesen(c, {})
+    pruefen("ohne Token -> Replika", engine == "replika", engine)
+
+    r = c.post("/geraete", json={"name": "Neu", "kategorie": "test", "heim_mietpark_id": mp})
+    neu, token = r.json()["id"], r.headers.get("X-Konsistenz-Position")
+    with f.SessionLocal() as s:
+        stand = f.letzte_ereignis_position(s)
+    pruefen("Schreibantwort traegt Position", token == str(stand), f"{token} / Outbox {stand}")
+
+    engine, ids = quelle.lesen(c, {})
+    pruefen("ohne Token: Replika hinkt hinterher", engine == "replika" and neu not in ids, engine)
+    engine, ids = quelle.lesen(c, {"X-Konsistenz-Position": token})
+    pruefen("Token > Replika -> Primaer", engine == "primaer" and neu in ids, engine)
+    engine, ids = quelle.lesen(c, {"X-Konsistenz-Position": "kaputt"})
+    pruefen("ungueltiges Token -> Replika", engine == "replika", engine)
+
+    replizieren()
+    engine, ids = quelle.lesen(c, {"X-Konsistenz-Position": token})
+    pruefen("Replika nachgezogen -> Replika", engine == "replika" and neu in ids, engine)
+    engine, ids = quelle.lesen(c, {"X-Konsistenz": "primaer"})
+    pruefen("X-Konsistenz: primaer -> Primaer", engine == "primaer", engine)
+
+    prozesse_pruefen(pruefen, geraete[:2], kunde)
+
+    fehler = 0
+    for name, ok, info in ergebnisse:
+        fehler += not ok
+        print(f"{'OK    ' if ok else 'FEHLER'} {name:<40} {info}")
+    print(f"{fehler} Verstoesse")
+    return 1 if fehler else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from "react";
+import React, { useEffect, useRef, useState } from "react";
 
 // ---------------------------------------------
 // Typen (angepasst an eure FastAPI-Response-Modelle)
@@ -50,7 +50,12 @@ function q(params: Record<string, any>) {
   return s ? `?${s}` : "";
 }
 
-async function apiGet<T>(baseUrl: string, path: string, params: Record<string, any> = {}): Promise<T> {
+// Read-your-writes: hoechste Outbox-Position (X-Konsistenz-Position) aus Schreibantworten; Folge-GETs schicken sie
+// mit, der Server liest dann erst von der Replika, wenn diese die Position erreicht hat
+let konsistenzPosition = 0;
+
+// Listen blaettern per Keyset-Cursor: der Server liefert den Cursor der Folgeseite im Header X-Next-Cursor
+async function apiGetSeite<T>(baseUrl: string, path: string, params: Record<string, any> = {}): Promise<{ daten: T; naechster: string | null }> {
   const url = `${baseUrl}${path}${q(params)}`;
   console.log(`🔍 GET: ${url}`);
   
@@ -61,6 +66,7 @@ async function apiGet<T>(baseUrl: string, path: string, params: Record<string, a
         'Accept': 'application/json',
         'Content-Type': 'application/json',
         'Cache-Control': 'no-cache',
+        ...(konsistenzPosition ? { 'X-Konsistenz-Position': String(konsistenzPosition) } : {}),
       },
       mode: 'cors',
       credentials: 'omit',
@@ -77,13 +83,34 @@ async function apiGet<T>(baseUrl: string, path: string, params: Record<string, a
     
     const data = await res.json();
     console.log(`📦 Data received:`, data);
-    return data;
+    return { daten: data, naechster: res.headers.get("X-Next-Cursor") };
   } catch (error) {
     console.error(`❌ Fetch failed for ${url}:`, error);
     throw error;
   }
 }
 
+async function apiGet<T>(baseUrl: string, path: string, params: Record<string, any> = {}): Promise<T> {
+  return (await apiGetSeite<T>(baseUrl, path, params)).daten;
+}
+
+// Stammdaten-Cache: einmal Vollabgleich ueber /sync, danach nur Deltas seit der letzten version
+type SyncTabelle = { spalten: string[]; zeilen: any[][]; geloescht: number[] };
+const stammdatenCache: { baseUrl: string; version: number; tabellen: Record<string, Map<number, any>> } = { baseUrl: "", version: 0, tabellen: {} };
+
+async function stammdaten<T>(baseUrl: string, tabelle: string): Promise<T[]> {
+  if (stammdatenCache.baseUrl !== baseUrl) Object.assign(stammdatenCache, { baseUrl, version: 0, tabellen: {} });
+  const res = await apiGet<{ version: number; voll: boolean; tabellen: Record<string, SyncTabelle> }>(baseUrl, "/sync", { since: stammdatenCache.version });
+  if (res.voll) stammdatenCache.tabellen = {};
+  Object.entries(res.tabellen).forEach(([name, t]) => {
+    const m = stammdatenCache.tabellen[name] ?? (stammdatenCache.tabellen[name] = new Map());
+    t.zeilen.forEach((z) => { const o: any = {}; t.spalten.forEach((sp, i) => { o[sp] = z[i]; }); m.set(o.id, o); });
+    t.geloescht.forEach((id) => m.delete(id));
+  });
+  stammdatenCache.version = res.version;
+  return Array.from(stammdatenCache.tabellen[tabelle]?.values() ?? []) as T[];
+}
+
 async function apiPost<T>(baseUrl: string, path: string, body: any): Promise<T> {
   const url = `${baseUrl}${path}`;
   console.log(`📤 POST: ${url}`, body);
@@ -110,6 +137,7 @@ async function apiPost<T>(baseUrl: string, path: string, body: any): Promise<T>
       throw new Error(`HTTP ${res.status}: ${errorText}`);
     }
     
+    konsistenzPosition = Math.max(konsistenzPosition, Number(res.headers.get('X-Konsistenz-Position')) || 0);
     const data = await res.json();
     console.log(`📦 Data received:`, data);
     return data;
@@ -126,6 +154,27 @@ async function apiPost<T>(baseUrl: string, path: string, body: any): Promise<T>
 const fmtEUR = (n?: number | null) => typeof n === "number" ? n.toLocaleString("de-DE", { style: "currency", currency: "EUR" }) : "–";
 const fmtDate = (s?: string | null) => s ? new Date(s).toLocaleDateString("de-DE") : "–";
 
+// Live-Änderungen über SSE (/events): ruft onEvent je passendem Ereignis mit Typ und Nutzdaten auf
+// (daten: entitaet, entitaet_id, zeitpunkt + Felder des Ereignisses, z.B. geraet_id, status). Die Ereignis-ID ist
+// die Outbox-Position: sie hebt konsistenzPosition an, damit das Nachladen mindestens diesen Stand liest
+type LiveEreignis = { typ: string; daten: Record<string, any> };
+
+function useLiveEvents(baseUrl: string, typen: string[], onEvent: (e: LiveEreignis) => void) {
+  const cb = useRef(onEvent);
+  cb.current = onEvent;
+  useEffect(() => {
+    const es = new EventSource(`${baseUrl}/events`);
+    const handler = (ev: MessageEvent) => {
+      let daten: Record<string, any> = {};
+      try { daten = JSON.parse(ev.data); } catch {}
+      konsistenzPosition = Math.max(konsistenzPosition, Number(ev.lastEventId) || 0);
+      cb.current({ typ: ev.type, daten });
+    };
+    typen.forEach((t) => es.addEventListener(t, handler as EventListener));
+    return () => es.close();
+  }, [baseUrl, typen.join(",")]);
+}
+
 function Badge({ children, tone = "slate" }: { children: React.ReactNode; tone?: "slate" | "green" | "yellow" | "red" | "blue" }) {
   const map: Record<string, string> = {
     slate: "bg-slate-100 text-slate-700",
@@ -343,7 +392,9 @@ function GeraeteBoard({ baseUrl, onToast }: { baseUrl: string; onToast: (s: stri
   const [status, setStatus] = useState<GeraetStatus | "">("");
   const [standort, setStandort] = useState<StandortTyp | "">("");
   const [limit, setLimit] = useState(25);
-  const [offset, setOffset] = useState(0);
+  const [seiten, setSeiten] = useState<(string | null)[]>([null]);   // Cursor je besuchter Seite, letzter = aktuelle
+  const [naechster, setNaechster] = useState<string | null>(null);
+  const cursor = seiten[seiten.length - 1];
   const [items, setItems] = useState<Geraet[]>([]);
   const [loading, setLoading] = useState(false);
   const [select, setSelect] = useState<Geraet | null>(null);
@@ -353,27 +404,40 @@ function GeraeteBoard({ baseUrl, onToast }: { baseUrl: string; onToast: (s: stri
   async function load() {
     setLoading(true);
     try {
-      const data = await apiGet<Geraet[]>(baseUrl, "/geraete", { status: status || undefined, standort_typ: standort || undefined, limit, offset });
+      const { daten: data, naechster } = await apiGetSeite<Geraet[]>(baseUrl, "/geraete", { status: status || undefined, standort_typ: standort || undefined, limit, cursor });
       setItems(data);
+      setNaechster(naechster);
     } catch (e: any) {
       onToast?.(`Fehler beim Laden der Geräte: ${e?.message ?? e}`);
       setItems([]);
     } finally { setLoading(false); }
   }
 
-  useEffect(() => { load(); }, [status, standort, limit, offset, baseUrl]);
+  useEffect(() => { load(); }, [status, standort, limit, cursor, baseUrl]);
+
+  // Live: nur das betroffene Gerät nachladen statt der ganzen Seite
+  async function geraetAktualisieren({ daten }: LiveEreignis) {
+    const id = daten.geraet_id;
+    if (!items.some((g) => g.id === id)) return;   // nicht auf dieser Seite
+    try {
+      const g = await apiGet<Geraet>(baseUrl, `/geraete/${id}`);
+      const passt = (!status || g.status === status) && (!standort || g.standort_typ === standort);
+      setItems((prev) => prev.flatMap((x) => (x.id !== id ? [x] : passt ? [g] : [])));
+    } catch {}
+  }
+  useLiveEvents(baseUrl, ["vermietung_angelegt", "vermietung_gestartet", "vermietung_geschlossen"], geraetAktualisieren);
 
   // Stammdaten (einmalig Kunden) – für Formulare
   useEffect(() => {
     (async () => {
-      try { setKunden(await apiGet<Kunde[]>(baseUrl, "/kunden", { limit: 500 })); } catch {}
+      try { setKunden(await stammdaten<Kunde>(baseUrl, "kunden")); } catch {}
     })();
   }, [baseUrl]);
 
   useEffect(() => {
     if (!select?.id) return;
     (async () => {
-      try { setBaustellen(await apiGet<Baustelle[]>(baseUrl, "/baustellen", { limit: 500 })); } catch {}
+      try { setBaustellen(await stammdaten<Baustelle>(baseUrl, "baustellen")); } catch {}
     })();
   }, [select?.id, baseUrl]);
 
@@ -382,25 +446,25 @@ function GeraeteBoard({ baseUrl, onToast }: { baseUrl: string; onToast: (s: stri
       title="Geräte"
       actions={
         <Toolbar>
-          <Select value={status} onChange={(e) => { setOffset(0); setStatus(e.target.value as any); }}>
+          <Select value={status} onChange={(e) => { setSeiten([null]); setStatus(e.target.value as any); }}>
             <option value="">Status: alle</option>
             {(["VERFUEGBAR", "VERMIETET", "WARTUNG", "AUSGEMUSTERT"] as GeraetStatus[]).map((s) => (
               <option key={s} value={s}>{s}</option>
             ))}
           </Select>
-          <Select value={standort} onChange={(e) => { setOffset(0); setStandort(e.target.value as any); }}>
+          <Select value={standort} onChange={(e) => { setSeiten([null]); setStandort(e.target.value as any); }}>
             <option value="">Standort: alle</option>
             {(["MIETPARK", "KUNDE"] as StandortTyp[]).map((s) => (
               <option key={s} value={s}>{s}</option>
             ))}
           </Select>
-          <Select value={String(limit)} onChange={(e) => { setOffset(0); setLimit(Number(e.target.value)); }}>
+          <Select value={String(limit)} onChange={(e) => { setSeiten([null]); setLimit(Number(e.target.value)); }}>
             {[10, 25, 50, 100].map((n) => (
               <option key={n} value={n}>pro Seite: {n}</option>
             ))}
           </Select>
-          <Button variant="outline" onClick={() => { setOffset(Math.max(0, offset - limit)); }}>◀</Button>
-          <Button variant="outline" onClick={() => { setOffset(offset + limit); }}>▶</Button>
+          <Button variant="outline" disabled={seiten.length <= 1} onClick={() => { setSeiten(seiten.slice(0, -1)); }}>◀</Button>
+          <Button variant="outline" disabled={!naechster} onClick={() => { setSeiten([...seiten, naechster]); }}>▶</Button>
           <Button variant="ghost" onClick={load}>{loading ? "Lädt…" : "Aktualisieren"}</Button>
         </Toolbar>
       }
@@ -558,7 +622,9 @@ function StartVorgangForm({ baseUrl, geraet, kunden, baustellen, onDone }: { bas
 function VermietungenBoard({ baseUrl, onToast, anchorVermietungId }: { baseUrl: string; onToast: (s: string | null) => void; anchorVermietungId?: number | null }) {
   const [status, setStatus] = useState<VermietStatus | "">("");
   const [limit, setLimit] = useState(25);
-  const [offset, setOffset] = useState(0);
+  const [seiten, setSeiten] = useState<(string | null)[]>([null]);   // Cursor je besuchter Seite, letzter = aktuelle
+  const [naechster, setNaechster] = useState<string | null>(null);
+  const cursor = seiten[seiten.length - 1];
   const [items, setItems] = useState<Vermietung[]>([]);
   const [loading, setLoading] = useState(false);
   const [detail, setDetail] = useState<Vermietung | null>(null);
@@ -568,8 +634,9 @@ function VermietungenBoard({ baseUrl, onToast, anchorVermietungId }: { baseUrl:
   async function load() {
     setLoading(true);
     try {
-      const data = await apiGet<Vermietung[]>(baseUrl, "/vermietungen", { status: status || undefined, limit, offset });
+      const { daten: data, naechster } = await apiGetSeite<Vermietung[]>(baseUrl, "/vermietungen", { status: status || undefined, limit, cursor });
       setItems(data);
+      setNaechster(naechster);
       if (anchorVermietungId) {
         const hit = data.find((v) => v.id === anchorVermietungId);
         if (hit) setDetail(hit);
@@ -580,7 +647,29 @@ function VermietungenBoard({ baseUrl, onToast, anchorVermietungId }: { baseUrl:
     } finally { setLoading(false); }
   }
 
-  useEffect(() => { load(); }, [status, limit, offset, baseUrl]);
+  useEffect(() => { load(); }, [status, limit, cursor, baseUrl]);
+
+  // Live: nur die betroffene Vermietung nachladen und in die Seite einsortieren (Reihenfolge wie der
+  // Server: start_datum, id). Neue Vermietungen nur, wenn sie zwischen die Schlüssel dieser Seite fallen.
+  const nachStart = (a: Vermietung, b: Vermietung) => a.start_datum.localeCompare(b.start_datum) || a.id - b.id;
+  async function vermietungAktualisieren({ typ, daten }: LiveEreignis) {
+    const id = daten.entitaet_id;
+    const vorhanden = items.some((v) => v.id === id);
+    if (!vorhanden && typ !== "vermietung_angelegt") return;
+    try {
+      const v = await apiGet<Vermietung>(baseUrl, `/vermietungen/${id}`);
+      setItems((prev) => {
+        const ohne = prev.filter((x) => x.id !== id);
+        if (status && v.status !== status) return ohne;
+        const aufSeite = prev.some((x) => x.id === id) || (
+          (cursor === null || (prev.length > 0 && nachStart(v, prev[0]) > 0)) &&
+          (prev.length < limit || nachStart(v, prev[prev.length - 1]) < 0));
+        return aufSeite ? [...ohne, v].sort(nachStart) : prev;   // nicht kürzen: der Folge-Cursor bleibt gültig
+      });
+      setDetail((d) => (d?.id === id ? v : d));
+    } catch {}
+  }
+  useLiveEvents(baseUrl, ["vermietung_angelegt", "vermietung_gestartet", "vermietung_geschlossen"], vermietungAktualisieren);
   useEffect(() => { if (anchorVermietungId) load(); }, [anchorVermietungId]);
 
   async function resolveGeraet(id: number) {
@@ -591,7 +680,7 @@ function VermietungenBoard({ baseUrl, onToast, anchorVermietungId }: { baseUrl:
   }
   async function resolveKunde(id: number) {
     if (kundenCache[id]) return kundenCache[id];
-    const ks = await apiGet<Kunde[]>(baseUrl, "/kunden", { limit: 500 });
+    const ks = await stammdaten<Kunde>(baseUrl, "kunden");
     const hit = ks.find((k) => k.id === id);
     if (hit) setKundenCache((prev) => ({ ...prev, [id]: hit }));
     return hit as Kunde | undefined;
@@ -602,19 +691,19 @@ function VermietungenBoard({ baseUrl, onToast, anchorVermietungId }: { baseUrl:
       title="Vermietungen"
       actions={
         <Toolbar>
-          <Select value={status} onChange={(e) => { setOffset(0); setStatus(e.target.value as any); }}>
+          <Select value={status} onChange={(e) => { setSeiten([null]); setStatus(e.target.value as any); }}>
             <option value="">Status: alle</option>
             {(["RESERVIERT", "OFFEN", "GESCHLOSSEN", "STORNIERT"] as VermietStatus[]).map((s) => (
               <option key={s} value={s}>{s}</option>
             ))}
           </Select>
-          <Select value={String(limit)} onChange={(e) => { setOffset(0); setLimit(Number(e.target.value)); }}>
+          <Select value={String(limit)} onChange={(e) => { setSeiten([null]); setLimit(Number(e.target.value)); }}>
             {[10, 25, 50, 100].map((n) => (
               <option key={n} value={n}>pro Seite: {n}</option>
             ))}
           </Select>
-          <Button variant="outline" onClick={() => { setOffset(Math.max(0, offset - limit)); }}>◀</Button>
-          <Button variant="outline" onClick={() => { setOffset(offset + limit); }}>▶</Button>
+          <Button variant="outline" disabled={seiten.length <= 1} onClick={() => { setSeiten(seiten.slice(0, -1)); }}>◀</Button>
+          <Button variant="outline" disabled={!naechster} onClick={() => { setSeiten([...seiten, naechster]); }}>▶</Button>
           <Button variant="ghost" onClick={load}>{loading ? "Lädt…" : "Aktualisieren"}</Button>
         </Toolbar>
       }
@@ -911,7 +1000,7 @@ function EinnahmenReport({ baseUrl, onToast }: { baseUrl: string; onToast: (s: s
   async function calc() {
     setLoading(true);
     try {
-      const list = await apiGet<Vermietung[]>(baseUrl, "/vermietungen", { status: status || undefined, limit, offset: 0 });
+      const list = await apiGet<Vermietung[]>(baseUrl, "/vermietungen", { status: status || undefined, limit, fields: "start_datum,end_datum" });
       const sel = list.filter((v) => overlaps(v.start_datum, v.end_datum ?? undefined, start, ende));
       const abrs = await Promise.all(sel.map((v) => apiGet<Abrechnung>(baseUrl, `/berichte/vermietungen/${v.id}/abrechnung`).then((a) => ({ id: v.id, ...a })).catch(() => null)));
       const rowsOk = abrs.filter(Boolean) as (Abrechnung & { id: number })[];
@@ -1032,7 +1121,7 @@ function StammdatenBoard({ baseUrl, onToast }: { baseUrl: string; onToast: (s: s
 
   // Baustelle
   const [kunden, setKunden] = useState<Kunde[]>([]);
-  useEffect(() => { apiGet<Kunde[]>(baseUrl, "/kunden", { limit: 500 }).then(setKunden).catch(() => {}); }, [baseUrl]);
+  useEffect(() => { stammdaten<Kunde>(baseUrl, "kunden").then(setKunden).catch(() => {}); }, [baseUrl]);
   const [bKundeId, setBKundeId] = useState<string>("");
   const [bName, setBName] = useState("");
   const [bAdr, setBAdr] = useState("");